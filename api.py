@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from utils.assistant import (
+    RAG_RESPONSE_PREFIX,
+    astream_chat,
+    astream_rag,
+    open_vector_store,
+)
+from utils.constants import (
+    API_MAX_CONCURRENT_REQUESTS,
+    API_MAX_QUEUED_REQUESTS,
+    API_MAX_SESSIONS,
+    API_QUEUE_TIMEOUT,
+    MODELS,
+    REWRITE_MODELS,
+    VECTOR_STORE_BACKEND,
+)
+from utils.history import ConversationHistory
+from utils.resources import (
+    get_chat_model,
+    get_routed_chat_model,
+    registry,
+    warm_up_in_background,
+)
+from utils.tracing import PROMETHEUS_CONTENT_TYPE, metrics, tracer
+
+# Headless API for the assistant: uvicorn api:app --host 0.0.0.0 --port 8000
+# Answers stream as server-sent events; the Streamlit app uses the same
+# service layer (utils/assistant.py) in-process.
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+API_KEYS = {
+    "openai": os.getenv("OPENAI_API_KEY"),
+    "anthropic": os.getenv("ANTHROPIC_API_KEY"),
+}
+
+
+class AdmissionControl:
+    """Bound concurrent requests and the queue waiting for a slot.
+
+    Requests beyond ``max_concurrent`` wait up to ``queue_timeout`` seconds;
+    once ``max_queued`` are already waiting, or the wait times out, they are
+    rejected with 503 and Retry-After so clients back off instead of piling up.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def _reject(self, reason: str):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy ({reason}), retry later",
+            headers={"Retry-After": str(max(1, int(self.queue_timeout)))},
+        )
+
+    async def acquire(self):
+        """Wait for a slot; returns an idempotent release function."""
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            self._reject("queue full")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue timeout")
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.in_flight -= 1
+                self._semaphore.release()
+
+        return release
+
+
+class SessionStore:
+    """In-memory chat sessions; the least recently used are evicted first."""
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def get(self, session_id: Optional[str]) -> Dict:
+        session_id = session_id or uuid.uuid4().hex
+        session = self._sessions.pop(session_id, None) or {
+            "id": session_id,
+            "messages": [],
+            "history": ConversationHistory(),
+            "lock": asyncio.Lock(),
+        }
+        self._sessions[session_id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+
+class ChatRequest(BaseModel):
+    message: str
+    session_id: Optional[str] = None
+    model: str = next(iter(MODELS))
+    use_rag: bool = True
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _sources(docs: List) -> List[Dict]:
+    return [
+        {
+            "source": doc.metadata.get("source"),
+            "section": doc.metadata.get("section"),
+            "endpoint": doc.metadata.get("endpoint"),
+        }
+        for doc in docs
+    ]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.admission = AdmissionControl(
+        API_MAX_CONCURRENT_REQUESTS, API_MAX_QUEUED_REQUESTS, API_QUEUE_TIMEOUT
+    )
+    app.state.sessions = SessionStore(API_MAX_SESSIONS)
+    app.state.vector_db = await asyncio.to_thread(
+        open_vector_store, VECTOR_STORE_BACKEND, API_KEYS["openai"]
+    )
+    warm_up_in_background(API_KEYS["openai"], API_KEYS["anthropic"])
+    yield
+
+
+app = FastAPI(title="Crustdata API assistant", lifespan=lifespan)
+
+
+@app.post("/v1/chat")
+async def chat(request: ChatRequest):
+    """Answer one message of a session, streaming tokens as server-sent events.
+
+    Events: ``session`` (the session id), ``sources`` (retrieved chunks, RAG
+    only), ``token`` for each piece of the answer, then ``done`` or ``error``.
+    """
+    if request.model not in MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown model {request.model}")
+    provider = request.model.split("/", 1)[0]
+    if not API_KEYS[provider]:
+        raise HTTPException(status_code=400, detail=f"No API key for {provider}")
+
+    # Built before a slot is taken, so a failing client cannot leak the slot
+    llm = get_routed_chat_model(request.model, 0.3, API_KEYS)
+    llm_rewrite = get_chat_model(
+        provider, REWRITE_MODELS[provider], 0, API_KEYS[provider]
+    )
+
+    release = await app.state.admission.acquire()
+    try:
+        session = app.state.sessions.get(request.session_id)
+    except Exception:
+        release()
+        raise
+
+    async def events():
+        try:
+            # One answer at a time per session, so history stays in order
+            async with session["lock"]:
+                yield _sse("session", {"session_id": session["id"]})
+                session["messages"].append({"role": "user", "content": request.message})
+                messages = await asyncio.to_thread(
+                    session["history"].build,
+                    session["messages"],
+                    llm_rewrite,
+                    MODELS[request.model]["history_tokens"],
+                    request.model,
+                )
+
+                retrieved = []
+                prefix = RAG_RESPONSE_PREFIX if request.use_rag else ""
+
+                def on_complete(answer):
+                    session["messages"].append(
+                        {"role": "assistant", "content": prefix + answer}
+                    )
+
+                if request.use_rag:
+                    stream = astream_rag(
+                        llm,
+                        messages,
+                        app.state.vector_db,
+                        rewrite_llm=llm_rewrite,
+                        on_retrieved=retrieved.extend,
+                        on_complete=on_complete,
+                    )
+                else:
+                    stream = astream_chat(llm, messages, on_complete=on_complete)
+
+                sources_sent = False
+                async for token in stream:
+                    if retrieved and not sources_sent:
+                        yield _sse("sources", {"sources": _sources(retrieved)})
+                        sources_sent = True
+                    yield _sse("token", {"text": token})
+                yield _sse("done", {"session_id": session["id"]})
+        except Exception as e:
+            tracer.error("answer", e, model=request.model)
+            logger.warning("Error answering session %s: %s", session["id"], e)
+            if session["messages"] and session["messages"][-1]["role"] == "user":
+                session["messages"].pop()
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also frees the slot if the client disconnects before streaming starts
+        background=BackgroundTask(release),
+    )
+
+
+@app.delete("/v1/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not app.state.sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return {"deleted": session_id}
+
+
+@app.get("/health")
+async def health(deep: bool = False):
+    """Load figures; ``deep`` also runs the shared resources' health checks."""
+    admission = app.state.admission
+    result = {
+        "status": "ok",
+        "in_flight": admission.in_flight,
+        "queued": admission.queued,
+        "max_concurrent": admission.max_concurrent,
+    }
+    if deep:
+        result["resources"] = await asyncio.to_thread(registry.health)
+        if any(value != "ok" for value in result["resources"].values()):
+            result["status"] = "degraded"
+    return result
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latencies, request outcomes and token counts, see utils/tracing.py."""
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -3,7 +3,7 @@ import os
 import dotenv
 import uuid
 
-from utils.constants import DEFAULT_RAG_URLS, MODELS
+from utils.constants import METRICS_PORT, MODELS, REWRITE_MODELS
 
 
 if os.name == "posix":
@@ -12,13 +12,16 @@ if os.name == "posix":
 
     sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
 
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain.schema import HumanMessage, AIMessage
-from langchain_core.documents import Document
+from utils.history import ConversationHistory
+from utils.resources import (
+    get_chat_model,
+    get_routed_chat_model,
+    warm_up_in_background,
+)
+from utils.tracing import serve_metrics_in_background
 from utils.rag_utils import (
-    _split_and_load_docs,
     load_doc_to_db,
+    show_ingestion_progress,
     stream_llm_response,
     stream_llm_rag_response,
     initialize_vector_db,
@@ -52,6 +55,9 @@ if "rag_sources" not in st.session_state:
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+if "history" not in st.session_state:
+    st.session_state.history = ConversationHistory()
+
 # Initialize API keys in session state
 if "openai_api_key" not in st.session_state:
     st.session_state.openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -59,6 +65,12 @@ if "openai_api_key" not in st.session_state:
 if "anthropic_api_key" not in st.session_state:
     st.session_state.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
 
+# Build shared clients and open their connections once per process
+warm_up_in_background(
+    st.session_state.openai_api_key, st.session_state.anthropic_api_key
+)
+serve_metrics_in_background(METRICS_PORT)
+
 if not st.session_state.default_urls_loaded:
     with st.spinner("Initializing vector store..."):
         if "vector_db" not in st.session_state:
@@ -124,7 +136,10 @@ else:
         with cols0[1]:
             st.button(
                 "Clear Chat",
-                on_click=lambda: st.session_state.messages.clear(),
+                on_click=lambda: (
+                    st.session_state.messages.clear(),
+                    st.session_state.history.reset(),
+                ),
                 type="primary",
             )
 
@@ -138,6 +153,8 @@ else:
             on_change=load_doc_to_db,
             key="rag_docs",
         )
+        if st.session_state.get("ingestion_jobs"):
+            show_ingestion_progress()
 
         with st.expander(
             f"📚 Documents in DB ({0 if not is_vector_db_loaded else len(st.session_state.rag_sources)})"
@@ -149,21 +166,23 @@ else:
             )
 
     # Main chat app
+    # Chat models are shared by every session, see utils/resources.py
     model_provider = st.session_state.model.split("/")[0]
-    if model_provider == "openai":
-        llm_stream = ChatOpenAI(
-            api_key=openai_api_key,
-            model_name=st.session_state.model.split("/")[-1],
-            temperature=0.3,
-            streaming=True,
-        )
-    elif model_provider == "anthropic":
-        llm_stream = ChatAnthropic(
-            api_key=anthropic_api_key,
-            model=st.session_state.model.split("/")[-1],
-            temperature=0.3,
-            streaming=True,
-        )
+    api_key = openai_api_key if model_provider == "openai" else anthropic_api_key
+    # Hedged with the other provider's model when both keys are configured
+    llm_stream = get_routed_chat_model(
+        st.session_state.model,
+        temperature=0.3,
+        api_keys={"openai": openai_api_key, "anthropic": anthropic_api_key},
+    )
+
+    # Cheaper model of the same provider for query rewrites and history summaries
+    llm_rewrite = get_chat_model(
+        model_provider,
+        REWRITE_MODELS[model_provider],
+        temperature=0,
+        api_key=api_key,
+    )
 
     # Display chat history
     for message in st.session_state.messages:
@@ -180,16 +199,19 @@ else:
 
         # Generate and display assistant response
         with st.chat_message("assistant"):
-            messages = [
-                HumanMessage(content=m["content"])
-                if m["role"] == "user"
-                else AIMessage(content=m["content"])
-                for m in st.session_state.messages
-            ]
+            # Recent turns verbatim, older ones folded into a running summary
+            messages = st.session_state.history.build(
+                st.session_state.messages,
+                llm_rewrite,
+                token_budget=MODELS[st.session_state.model]["history_tokens"],
+                model=st.session_state.model,
+            )
 
             if not st.session_state.use_rag:
                 response = stream_llm_response(llm_stream, messages)
                 st.write_stream(response)
             else:
-                response = stream_llm_rag_response(llm_stream, messages)
+                response = stream_llm_rag_response(
+                    llm_stream, messages, rewrite_llm=llm_rewrite
+                )
                 st.write_stream(response)
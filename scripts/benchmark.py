@@ -0,0 +1,380 @@
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+# Add project root to Python path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+# Caches and indexes are module-level singletons configured from the
+# environment, so point them at a scratch directory before importing them
+WORK_DIR = tempfile.mkdtemp(prefix="crustdata-bench-")
+os.environ["SEMANTIC_CACHE_PATH"] = os.path.join(WORK_DIR, "semantic_cache.db")
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(WORK_DIR, "embedding_cache.db")
+os.environ["BM25_INDEX_PATH"] = os.path.join(WORK_DIR, "bm25_index.json")
+
+from langchain_core.documents import Document
+
+from utils.assistant import add_documents, astream_rag, stream_rag
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_service import EmbeddingService, FakeEmbeddings
+from utils.fakes import FakeStreamingChatModel
+from utils.history import ConversationHistory
+from utils.local_vector_store import LocalVectorStore
+from utils.router import RouterChatModel
+from utils.tokens import count_tokens
+
+STAGES = ["history", "retrieval", "ttft", "generation", "total"]
+# Latency differences below this are noise, not regressions
+NOISE_FLOOR_SECONDS = 0.005
+
+
+def make_corpus(endpoints):
+    """Markdown docs shaped like the Crustdata API reference."""
+    docs = []
+    for i in range(endpoints):
+        body = "\n\n".join(
+            [
+                f"# Resource {i} API",
+                f"## Search resource {i}",
+                f"Send POST /resource{i}/search with a filters array to find "
+                f"resource {i} records. Filters combine with AND; each names a "
+                "column, a type and a value.",
+                "```json\n"
+                + json.dumps(
+                    {"filters": [{"column": f"field_{i}", "type": "=", "value": i}]},
+                    indent=2,
+                )
+                + "\n```",
+                f"## Enrich resource {i}",
+                f"GET /resource{i}/enrich returns field_{i}, linkedin_profile_url "
+                "and headcount for up to 25 identifiers per request. " * 3,
+            ]
+        )
+        docs.append(Document(page_content=body, metadata={"source": f"doc-{i}"}))
+    return docs
+
+
+def make_questions(session, turns, endpoints):
+    first = session % endpoints
+    questions = [f"How do I search resource {first} records by field_{first}?"]
+    for turn in range(1, turns):
+        # Short follow-ups go through the history-aware query rewrite
+        questions.append(
+            "What about its pagination?"
+            if turn % 2
+            else f"How do I enrich resource {(first + turn) % endpoints}?"
+        )
+    return questions
+
+
+def _record(timings, start, retrieved_at, first_token_at, end, history_seconds):
+    timings["history"].append(history_seconds)
+    timings["retrieval"].append((retrieved_at or end) - start)
+    timings["ttft"].append((first_token_at or end) - start)
+    timings["generation"].append(end - (first_token_at or end))
+    timings["total"].append(end - start + history_seconds)
+
+
+def run_session(session, args, vector_db, llm, rewrite_llm, timings, counters):
+    history = ConversationHistory()
+    chat = []
+    for question in make_questions(session, args.turns, args.endpoints):
+        chat.append({"role": "user", "content": question})
+        history_start = perf_counter()
+        messages = history.build(chat, rewrite_llm, args.history_tokens, "gpt-4o")
+        start = perf_counter()
+        history_seconds = start - history_start
+        marks = {"retrieved": None, "first_token": None}
+
+        def on_retrieved(docs):
+            marks["retrieved"] = perf_counter()
+
+        answer = []
+        try:
+            for token in stream_rag(
+                llm, messages, vector_db, rewrite_llm, on_retrieved=on_retrieved
+            ):
+                if marks["first_token"] is None:
+                    marks["first_token"] = perf_counter()
+                answer.append(token)
+        except Exception as e:
+            counters["errors"] += 1
+            print(f"Session {session} failed: {e}", file=sys.__stderr__)
+            continue
+        _record(
+            timings,
+            start,
+            marks["retrieved"],
+            marks["first_token"],
+            perf_counter(),
+            history_seconds,
+        )
+        counters["turns"] += 1
+        # Answers stream in coalesced pieces of several tokens
+        counters["flushes"] += len(answer)
+        counters["tokens"] += count_tokens("".join(answer), "gpt-4o")
+        chat.append({"role": "assistant", "content": "".join(answer)})
+
+
+async def arun_session(session, args, vector_db, llm, rewrite_llm, timings, counters):
+    history = ConversationHistory()
+    chat = []
+    for question in make_questions(session, args.turns, args.endpoints):
+        chat.append({"role": "user", "content": question})
+        history_start = perf_counter()
+        messages = await asyncio.to_thread(
+            history.build, chat, rewrite_llm, args.history_tokens, "gpt-4o"
+        )
+        start = perf_counter()
+        history_seconds = start - history_start
+        marks = {"retrieved": None, "first_token": None}
+
+        def on_retrieved(docs):
+            marks["retrieved"] = perf_counter()
+
+        answer = []
+        try:
+            async for token in astream_rag(
+                llm, messages, vector_db, rewrite_llm, on_retrieved=on_retrieved
+            ):
+                if marks["first_token"] is None:
+                    marks["first_token"] = perf_counter()
+                answer.append(token)
+        except Exception as e:
+            counters["errors"] += 1
+            print(f"Session {session} failed: {e}", file=sys.__stderr__)
+            continue
+        _record(
+            timings,
+            start,
+            marks["retrieved"],
+            marks["first_token"],
+            perf_counter(),
+            history_seconds,
+        )
+        counters["turns"] += 1
+        # Answers stream in coalesced pieces of several tokens
+        counters["flushes"] += len(answer)
+        counters["tokens"] += count_tokens("".join(answer), "gpt-4o")
+        chat.append({"role": "assistant", "content": "".join(answer)})
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values) * 1000
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+
+def benchmark(args):
+    embeddings = CachedEmbeddings(
+        EmbeddingService(FakeEmbeddings(latency=args.embed_latency))
+    )
+    vector_db = LocalVectorStore(embeddings)
+    llm = FakeStreamingChatModel(
+        model_name="fake-answer",
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+        error_rate=args.error_rate,
+    )
+    if args.router:
+        # A healthy second provider to hedge and fail over to
+        fallback = FakeStreamingChatModel(
+            model_name="fake-fallback",
+            first_token_latency=args.first_token_latency,
+            tokens_per_second=args.tokens_per_second,
+        )
+        llm = RouterChatModel(
+            models={"fake/answer": llm, "fake/fallback": fallback},
+            model_name="fake-answer",
+        )
+    rewrite_llm = FakeStreamingChatModel(
+        model_name="fake-rewrite",
+        response="resource search pagination cursor",
+        first_token_latency=args.rewrite_latency,
+        tokens_per_second=1000,
+    )
+    timings = {stage: [] for stage in STAGES}
+    counters = {"turns": 0, "tokens": 0, "flushes": 0, "errors": 0}
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log if args.quiet else sys.stdout):
+        index_start = perf_counter()
+        add_documents(vector_db, make_corpus(args.endpoints))
+        index_seconds = perf_counter() - index_start
+
+        start = perf_counter()
+        session_args = (args, vector_db, llm, rewrite_llm, timings, counters)
+        if args.use_async:
+
+            async def run_all():
+                await asyncio.gather(
+                    *(arun_session(s, *session_args) for s in range(args.sessions))
+                )
+
+            asyncio.run(run_all())
+        else:
+            # One thread per session, like Streamlit's script threads
+            with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+                for future in [
+                    executor.submit(run_session, s, *session_args)
+                    for s in range(args.sessions)
+                ]:
+                    future.result()
+        wall_seconds = perf_counter() - start
+
+    return {
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline", "save_baseline", "quiet")
+        },
+        "index_seconds": round(index_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "turns": counters["turns"],
+        "errors": counters["errors"],
+        "flushes_per_turn": round(counters["flushes"] / max(counters["turns"], 1), 1),
+        "throughput": {
+            "turns_per_second": round(counters["turns"] / wall_seconds, 2),
+            "tokens_per_second": round(counters["tokens"] / wall_seconds, 2),
+        },
+        "stages": {stage: summarize(values) for stage, values in timings.items()},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of stage latencies and throughput beyond ``tolerance``."""
+    regressions = []
+    for stage, stats in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage, {})
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if metric not in stats or metric not in base:
+                continue
+            current, previous = stats[metric], base[metric]
+            if (
+                current > previous * (1 + tolerance)
+                and current - previous > NOISE_FLOOR_SECONDS * 1000
+            ):
+                regressions.append(f"{stage} {metric}: {previous} -> {current}")
+    for metric, current in results["throughput"].items():
+        previous = baseline.get("throughput", {}).get(metric)
+        if previous and current < previous * (1 - tolerance):
+            regressions.append(f"{metric}: {previous} -> {current}")
+    return regressions
+
+
+def print_report(results):
+    print(
+        f"{results['turns']} turns from {results['config']['sessions']} sessions in "
+        f"{results['wall_seconds']:.2f}s, {results['errors']} errors; "
+        f"{results['throughput']['turns_per_second']} turns/s, "
+        f"{results['throughput']['tokens_per_second']} tokens/s, "
+        f"{results['flushes_per_turn']} flushes per answer"
+    )
+    print(f"{'stage':<11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for stage, stats in results["stages"].items():
+        if stats["count"]:
+            print(
+                f"{stage:<11} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                f"{stats['p99_ms']:>9.1f} {stats['mean_ms']:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the RAG pipeline offline with fake models"
+    )
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions")
+    parser.add_argument("--turns", type=int, default=4, help="questions per session")
+    parser.add_argument("--endpoints", type=int, default=40, help="corpus size")
+    parser.add_argument(
+        "--first-token-latency", type=float, default=0.3, help="answer model, seconds"
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument(
+        "--tail-rate", type=float, default=0, help="share of slow first tokens"
+    )
+    parser.add_argument(
+        "--tail-latency", type=float, default=3, help="slow first token, seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="share of failing answers"
+    )
+    parser.add_argument(
+        "--router",
+        action="store_true",
+        help="route answers through RouterChatModel with a fallback model",
+    )
+    parser.add_argument(
+        "--rewrite-latency", type=float, default=0.15, help="rewrite model, seconds"
+    )
+    parser.add_argument(
+        "--embed-latency", type=float, default=0.02, help="seconds per embedding call"
+    )
+    parser.add_argument("--history-tokens", type=int, default=6000)
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="run sessions on one event loop, like the HTTP API",
+    )
+    parser.add_argument("--output", default="data/benchmark_results.json")
+    parser.add_argument("--baseline", default="data/benchmark_baseline.json")
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the new baseline",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed relative regression"
+    )
+    parser.add_argument(
+        "--verbose",
+        dest="quiet",
+        action="store_false",
+        help="show the pipeline's own log output",
+    )
+    args = parser.parse_args()
+
+    results = benchmark(args)
+    print_report(results)
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+    elif baseline_path.exists():
+        regressions = compare(
+            results, json.loads(baseline_path.read_text()), args.tolerance
+        )
+        if regressions:
+            print(f"Regressions against {baseline_path}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {baseline_path}")
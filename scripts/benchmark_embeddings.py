@@ -0,0 +1,86 @@
+import os
+import sys
+import argparse
+import json
+from time import perf_counter
+
+# Add project root to Python path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from utils.embedding_service import EmbeddingService, FakeEmbeddings
+
+
+def make_texts(count, words):
+    """Distinct chunk-sized texts, so nothing is deduplicated along the way."""
+    return [
+        f"chunk {i}: " + " ".join(f"word{(i * 7 + j) % 997}" for j in range(words))
+        for i in range(count)
+    ]
+
+
+def benchmark(
+    texts=2000,
+    words=300,
+    batch_size=256,
+    concurrency=4,
+    rpm=3000,
+    tpm=1_000_000,
+    latency=0.2,
+    latency_per_1k_tokens=0.01,
+):
+    """Embed synthetic chunks through the service with a fake provider."""
+    service = EmbeddingService(
+        FakeEmbeddings(latency=latency, latency_per_1k_tokens=latency_per_1k_tokens),
+        batch_size=batch_size,
+        max_concurrency=concurrency,
+        requests_per_minute=rpm,
+        tokens_per_minute=tpm,
+    )
+    corpus = make_texts(texts, words)
+    start = perf_counter()
+    vectors = service.embed_documents(corpus)
+    seconds = perf_counter() - start
+    assert len(vectors) == len(corpus)
+
+    metrics = service.metrics()
+    print(
+        f"{len(corpus)} texts in {seconds:.2f}s: "
+        f"{len(corpus) / seconds:.0f} texts/s, "
+        f"{metrics['tokens'] / seconds:.0f} tokens/s "
+        f"(batch {batch_size}, concurrency {concurrency})"
+    )
+    print(json.dumps(metrics, indent=2))
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark embedding throughput offline with a fake provider"
+    )
+    parser.add_argument("--texts", type=int, default=2000, help="texts to embed")
+    parser.add_argument("--words", type=int, default=300, help="words per text")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=3000, help="requests/minute")
+    parser.add_argument("--tpm", type=float, default=1_000_000, help="tokens/minute")
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="simulated seconds per request"
+    )
+    parser.add_argument(
+        "--latency-per-1k-tokens",
+        type=float,
+        default=0.01,
+        help="simulated seconds per thousand tokens",
+    )
+    args = parser.parse_args()
+    benchmark(
+        texts=args.texts,
+        words=args.words,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        latency=args.latency,
+        latency_per_1k_tokens=args.latency_per_1k_tokens,
+    )
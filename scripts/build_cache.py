@@ -1,66 +1,277 @@
 import os
 import sys
-import hashlib
-from pathlib import Path
-import json
+import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import sleep, time
+import random
+
+import requests
 
 # Add project root to Python path
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
-from utils.notion_loader import NotionLoader
+from langchain_core.documents import Document
+
+from notion_loader import NotionLoader, create_chrome_driver
 from utils.constants import DEFAULT_RAG_URLS
+from utils.cache_utils import DocumentCache
+
+
+class WorkerResources:
+    """Long-lived HTTP session and browser per worker thread.
+
+    Each worker reuses its own session and, only if a page needs the Selenium
+    fallback, its own Chrome across every URL it processes. Loads run on
+    helper threads (see ``_call_with_deadline``), so the resources are bound
+    to the worker that starts the load rather than the thread using them.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._sessions = {}
+        self._drivers = {}
+        self._lock = threading.Lock()
+
+    def session(self):
+        worker = threading.get_ident()
+        with self._lock:
+            if worker not in self._sessions:
+                self._sessions[worker] = requests.Session()
+            return self._sessions[worker]
+
+    def driver_factory(self):
+        """A browser factory for the calling worker."""
+        worker = threading.get_ident()
 
+        def driver():
+            with self._lock:
+                if worker in self._drivers:
+                    return self._drivers[worker]
+            new_driver = create_chrome_driver(page_load_timeout=self.timeout)
+            with self._lock:
+                self._drivers[worker] = new_driver
+            return new_driver
 
-def build_cache():
-    # Create cache directories
-    data_dir = Path("data")
-    content_dir = data_dir / "content"
-    metadata_dir = data_dir / "metadata"
+        return driver
 
-    for directory in [data_dir, content_dir, metadata_dir]:
-        directory.mkdir(exist_ok=True)
+    def reset(self):
+        """Drop the calling worker's session and browser after a timed-out load.
 
-    # Process each default URL
-    for url_data in DEFAULT_RAG_URLS:
-        url = url_data["url"]
-        print(f"Processing {url}")
+        Closing them makes the abandoned load fail fast, and the next attempt
+        starts with fresh ones.
+        """
+        worker = threading.get_ident()
+        with self._lock:
+            session = self._sessions.pop(worker, None)
+            driver = self._drivers.pop(worker, None)
+        if session is not None:
+            session.close()
+        if driver is not None:
+            self._quit(driver)
 
+    def _quit(self, driver):
         try:
-            # First try loading from URL
-            loader = NotionLoader(url, cache_enabled=False)
-            docs = loader.load()
-
-            if not docs and "fallback_file" in url_data:
-                # If URL fails, use fallback file
-                with open(url_data["fallback_file"], "r") as f:
-                    content = f.read()
-                    docs = [
-                        Document(
-                            page_content=content,
-                            metadata={"source": url, "title": url.split("/")[-1]},
-                        )
-                    ]
-
-            if docs:
-                # Generate cache key
-                cache_key = hashlib.sha256(url.encode()).hexdigest()
-
-                # Save content - properly access Document attributes
-                content_path = content_dir / f"{cache_key}.txt"
-                with open(content_path, "w", encoding="utf-8") as f:
-                    f.write(docs[0].page_content)  # Use page_content attribute
-
-                # Save metadata
-                metadata_path = metadata_dir / f"{cache_key}.json"
-                with open(metadata_path, "w", encoding="utf-8") as f:
-                    json.dump(docs[0].metadata, f)  # Use metadata attribute
-
-                print(f"Cached {url}")
+            driver.quit()
+        except Exception as e:
+            print(f"Error closing browser: {e}")
+
+    def close(self):
+        with self._lock:
+            drivers = list(self._drivers.values())
+            self._drivers.clear()
+        for driver in drivers:
+            self._quit(driver)
+
+
+def _call_with_deadline(fn, timeout):
+    """Return ``fn()``, or raise TimeoutError if it takes over ``timeout`` seconds.
 
+    ``fn`` runs on a daemon thread. A call that overruns is abandoned rather
+    than killed, and its result is discarded.
+    """
+    outcome = {}
+    done = threading.Event()
+
+    def run():
+        try:
+            outcome["value"] = fn()
         except Exception as e:
-            print(f"Error processing {url}: {e}")
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=run, daemon=True, name="load").start()
+    if not done.wait(timeout):
+        raise TimeoutError(f"took longer than {timeout}s")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+def _load_url(url_data, resources, mode, timeout, retries, backoff, force):
+    """Load one URL with retries, falling back to its fallback_file.
+
+    Fresh cache entries are skipped and stale ones are revalidated, so an
+    unchanged page costs one cheap request and no extraction. Each attempt
+    is abandoned after ``timeout`` seconds.
+    """
+    url = url_data["url"]
+    start_time = time()
+    result = {"url": url, "status": "failed", "attempts": 0, "error": None}
+    docs, validators = [], {}
+    cache = DocumentCache()
+    cached_doc = None if force else cache.get_document(url)
+
+    def attempt_load(loader):
+        if cached_doc is not None:
+            if not cached_doc["stale"]:
+                return "fresh", [], {}
+            return ("updated" if loader.revalidate() else "unchanged"), [], {}
+        docs, validators = loader.fetch()
+        return "scraped", docs, validators
+
+    for attempt in range(retries + 1):
+        result["attempts"] = attempt + 1
+        try:
+            # Built on this worker, so it gets the worker's session and browser
+            loader = NotionLoader(
+                url,
+                cache_enabled=False,
+                mode=mode,
+                session=resources.session(),
+                driver_factory=resources.driver_factory(),
+            )
+            status, docs, validators = _call_with_deadline(
+                lambda: attempt_load(loader), timeout
+            )
+            if cached_doc is not None or docs:
+                result["status"] = status
+                break
+            result["error"] = "no content extracted"
+        except TimeoutError as e:
+            resources.reset()
+            result["error"] = str(e)
+        except Exception as e:
+            result["error"] = str(e)
+
+        if attempt < retries:
+            # Exponential backoff with jitter so workers do not retry in lockstep
+            sleep(backoff * 2**attempt * (1 + random.random()))
+
+    if not docs and cached_doc is None and "fallback_file" in url_data:
+        # If URL fails, use fallback file
+        try:
+            with open(url_data["fallback_file"], "r") as f:
+                content = f.read()
+            docs = [
+                Document(
+                    page_content=content,
+                    metadata={"source": url, "title": url.split("/")[-1]},
+                )
+            ]
+            validators = {}
+            result["status"] = "fallback"
+        except OSError as e:
+            result["error"] = f"{result['error']}; fallback: {e}"
+
+    result["docs"] = docs
+    result["validators"] = validators
+    result["seconds"] = time() - start_time
+    return result
+
+
+def build_cache(
+    workers=4, mode="auto", timeout=120, retries=2, backoff=1.0, force=False
+):
+    cache = DocumentCache()
+    resources = WorkerResources(timeout)
+    results = []
+    start_time = time()
+
+    # Process the default URLs concurrently on a bounded pool
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _load_url,
+                    url_data,
+                    resources,
+                    mode,
+                    timeout,
+                    retries,
+                    backoff,
+                    force,
+                ): url_data["url"]
+                for url_data in DEFAULT_RAG_URLS
+            }
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {
+                        "url": url,
+                        "status": "failed",
+                        "attempts": 0,
+                        "error": str(e),
+                        "docs": [],
+                        "validators": {},
+                        "seconds": time() - start_time,
+                    }
+
+                if result["docs"]:
+                    doc = result["docs"][0]
+                    cache.save_document(
+                        url, doc.page_content, doc.metadata, **result["validators"]
+                    )
+                    print(f"Cached {url}")
+                elif result["status"] in ("fresh", "unchanged", "updated"):
+                    print(f"Cache entry {result['status']}: {url}")
+                else:
+                    print(f"Error processing {url}: {result['error']}")
+                results.append(result)
+    finally:
+        resources.close()
+
+    print(f"\nProcessed {len(results)} URLs in {time() - start_time:.1f}s")
+    print(f"{'status':<9} {'attempts':>8} {'seconds':>8}  url")
+    for result in sorted(results, key=lambda r: r["seconds"], reverse=True):
+        print(
+            f"{result['status']:<9} {result['attempts']:>8} "
+            f"{result['seconds']:>8.1f}  {result['url']}"
+        )
+    return results
 
 
 if __name__ == "__main__":
-    build_cache()
+    parser = argparse.ArgumentParser(description="Build the Notion document cache")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent pages")
+    parser.add_argument(
+        "--mode",
+        choices=["auto", "http", "selenium"],
+        default="auto",
+        help="NotionLoader mode, auto only starts a browser when needed",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="seconds per load attempt"
+    )
+    parser.add_argument("--retries", type=int, default=2, help="retries per URL")
+    parser.add_argument(
+        "--backoff", type=float, default=1.0, help="base retry backoff in seconds"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="reload every page instead of revalidating cached ones",
+    )
+    args = parser.parse_args()
+    build_cache(
+        workers=args.workers,
+        mode=args.mode,
+        timeout=args.timeout,
+        retries=args.retries,
+        backoff=args.backoff,
+        force=args.force,
+    )
@@ -2,11 +2,10 @@ import os
 from pathlib import Path
 import sys
 import json
+import argparse
 from pinecone import Pinecone
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 from langchain_pinecone import PineconeVectorStore
 import pinecone
 from pinecone.grpc import PineconeGRPC as Pinecone
@@ -16,14 +15,192 @@ load_dotenv()
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
+from utils.constants import (
+    BM25_INDEX_PATH,
+    LOCAL_INDEX_DTYPE,
+    LOCAL_INDEX_PATH,
+    PINECONE_INDEX_NAME,
+)
+from utils.bm25_index import BM25Index
+from utils.doc_splitter import chunk_id, split_documents
+from utils.local_vector_store import LocalVectorStore
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_service import get_embedding_service
+from utils.cache_utils import DocumentCache
 
-def build_and_upload_index():
-    # Initialize Pinecone with new syntax
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
 
-    # Create index if it doesn't exist
-    index_name = "crustdata-docs"
-    print(f"crust data docs index: {pc.list_indexes().names()}")
+MANIFEST_PATH = "data/index_manifest_{backend}.json"
+
+
+def load_documents():
+    """Stream the cached documents and their metadata from the packed cache"""
+    for url, content, metadata in DocumentCache().iter_documents():
+        yield Document(page_content=content, metadata={"source": url, **metadata})
+
+
+def identify_chunks(splits):
+    """Map chunk IDs to (document, manifest entry), dropping duplicate chunks."""
+    chunks = {}
+    positions = {}
+    for doc in splits:
+        source = doc.metadata.get("source", "Unknown Source")
+        position = positions.get(source, 0)
+        positions[source] = position + 1
+        doc_id = chunk_id(source, doc.page_content)
+        if doc_id not in chunks:
+            chunks[doc_id] = (doc, {"source": source, "position": position})
+    return chunks
+
+
+def load_manifest(backend):
+    manifest_path = Path(MANIFEST_PATH.format(backend=backend))
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(backend, manifest):
+    manifest_path = Path(MANIFEST_PATH.format(backend=backend))
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def plan_sync(chunks, manifest):
+    """Work out which chunk IDs to add, update and delete.
+
+    A chunk counts as an update when it replaces a pushed chunk at the same
+    position of the same source; its old ID is deleted as part of the update.
+    """
+    pushed_positions = {
+        (entry["source"], entry["position"]): doc_id
+        for doc_id, entry in manifest.items()
+    }
+    adds, updates = [], []
+    replaced = set()
+    for doc_id, (_, entry) in chunks.items():
+        if doc_id in manifest:
+            continue
+        old_id = pushed_positions.get((entry["source"], entry["position"]))
+        if old_id is not None and old_id not in chunks:
+            updates.append(doc_id)
+            replaced.add(old_id)
+        else:
+            adds.append(doc_id)
+    stale = [doc_id for doc_id in manifest if doc_id not in chunks]
+    deletes = [doc_id for doc_id in stale if doc_id not in replaced]
+    return adds, updates, deletes, stale
+
+
+def indexed_document_ids():
+    """IDs of document chunks pushed by earlier builds, for any backend."""
+    ids = set()
+    for backend in ("pinecone", "local"):
+        ids.update(load_manifest(backend))
+    return ids
+
+
+def build_bm25_index(chunks, previous_ids=()):
+    """Rebuild the lexical index over every current chunk; it is local and cheap.
+
+    Chunks of earlier builds (``previous_ids``) are replaced by the current
+    ones. Chunks that UI uploads added are in no manifest and are carried
+    over, since they stay in the vector store.
+    """
+    replaced = set(previous_ids) | set(chunks)
+    uploads = []
+    if os.path.exists(BM25_INDEX_PATH):
+        uploads = [
+            doc
+            for doc in BM25Index.load(BM25_INDEX_PATH).docs
+            if doc is not None and doc["id"] not in replaced
+        ]
+
+    bm25_index = BM25Index()
+    bm25_index.add_documents(
+        [
+            Document(page_content=doc["text"], metadata=doc["metadata"])
+            for doc in uploads
+        ],
+        ids=[doc["id"] for doc in uploads],
+    )
+    ids = list(chunks)
+    bm25_index.add_documents([chunks[doc_id][0] for doc_id in ids], ids=ids)
+    bm25_index.save(BM25_INDEX_PATH)
+    print(
+        f"Saved BM25 index over {len(ids)} chunks and {len(uploads)} uploaded "
+        f"chunks to {BM25_INDEX_PATH}"
+    )
+
+
+def _open_vector_store(backend, embeddings):
+    if backend == "local":
+        if LocalVectorStore.exists(LOCAL_INDEX_PATH):
+            return LocalVectorStore.load(LOCAL_INDEX_PATH, embeddings, mmap=False)
+        return LocalVectorStore(embeddings, dtype=LOCAL_INDEX_DTYPE)
+    return PineconeVectorStore(index_name=PINECONE_INDEX_NAME, embedding=embeddings)
+
+
+def sync_index(backend="pinecone", dry_run=False, batch_size=100):
+    """Push only new or changed chunks and delete chunks that no longer exist."""
+    chunks = identify_chunks(split_documents(load_documents()))
+    manifest = load_manifest(backend)
+    previous_ids = indexed_document_ids()
+    adds, updates, deletes, stale = plan_sync(chunks, manifest)
+
+    print(
+        f"Sync plan for {backend}: {len(adds)} to add, {len(updates)} to update, "
+        f"{len(deletes)} to delete, {len(chunks) - len(adds) - len(updates)} unchanged"
+    )
+    if dry_run:
+        for label, ids in (("add", adds), ("update", updates)):
+            for doc_id in ids:
+                entry = chunks[doc_id][1]
+                print(f"  {label} {doc_id[:12]} {entry['source']} #{entry['position']}")
+        for doc_id in deletes:
+            entry = manifest[doc_id]
+            print(f"  delete {doc_id[:12]} {entry['source']} #{entry['position']}")
+        return
+
+    # Unchanged chunks are served from the embedding cache
+    embeddings = CachedEmbeddings(get_embedding_service())
+    vector_store = _open_vector_store(backend, embeddings)
+
+    upserts = adds + updates
+    for start in range(0, len(upserts), batch_size):
+        batch_ids = upserts[start : start + batch_size]
+        vector_store.add_documents([chunks[i][0] for i in batch_ids], ids=batch_ids)
+        # Record progress per batch so an interrupted sync resumes where it stopped
+        for doc_id in batch_ids:
+            manifest[doc_id] = chunks[doc_id][1]
+        save_manifest(backend, manifest)
+        print(f"Upserted {start + len(batch_ids)}/{len(upserts)} chunks")
+
+    for start in range(0, len(stale), batch_size):
+        batch_ids = stale[start : start + batch_size]
+        vector_store.delete(ids=batch_ids)
+        for doc_id in batch_ids:
+            manifest.pop(doc_id, None)
+        save_manifest(backend, manifest)
+    if stale:
+        print(f"Deleted {len(stale)} stale chunks")
+
+    if backend == "local":
+        vector_store.save(LOCAL_INDEX_PATH)
+    build_bm25_index(chunks, previous_ids)
+    print(f"Embedding cache: {embeddings.hits} hits, {embeddings.misses} misses")
+    print(f"Embedding service: {embeddings.embeddings.metrics()}")
+
+
+def build_and_upload_index(backend="pinecone", batch_size=100):
+    if backend == "pinecone":
+        # Initialize Pinecone with new syntax
+        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+        print(f"crust data docs index: {pc.list_indexes().names()}")
+
     # if index_name not in pc.list_indexes().names():
     # pc.create_index(
     #     name="serverless-index",
@@ -32,44 +209,83 @@ def build_and_upload_index():
     #     spec=ServerlessSpec(cloud="aws", region="us-east-1"),
     # )
 
-    # Load documents from data/content directory and their corresponding metadata
-    content_dir = Path("data/content")
-    metadata_dir = Path("data/metadata")
-    docs = []
-
-    for file_path in content_dir.glob("*.txt"):
-        # Load content
-        loader = TextLoader(str(file_path))
-        content_docs = loader.load()
-
-        # Load corresponding metadata
-        metadata_path = metadata_dir / f"{file_path.stem}.json"
-        if metadata_path.exists():
-            with open(metadata_path, "r") as f:
-                metadata = json.load(f)
-                # Update metadata for each document
-                for doc in content_docs:
-                    doc.metadata.update(metadata)
-
-        docs.extend(content_docs)
-
-    # Split documents
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=5000,
-        chunk_overlap=1000,
-    )
-    splits = text_splitter.split_documents(docs)
-
-    # Create embeddings and upload to Pinecone
-    embeddings = OpenAIEmbeddings()
-    vector_store = PineconeVectorStore.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        index_name="serverless-index",
-    )
+    chunks = identify_chunks(split_documents(load_documents()))
+    ids = list(chunks)
+    splits = [chunks[doc_id][0] for doc_id in ids]
+    previous_ids = indexed_document_ids()
+
+    # Unchanged chunks are served from the embedding cache
+    embeddings = CachedEmbeddings(get_embedding_service())
 
-    print(f"Successfully uploaded {len(splits)} document chunks to Pinecone")
+    if backend == "local":
+        # Build the NumPy index that the app memory-maps
+        vector_store = LocalVectorStore.from_documents(
+            documents=splits,
+            embedding=embeddings,
+            ids=ids,
+            dtype=LOCAL_INDEX_DTYPE,
+        )
+        vector_store.save(LOCAL_INDEX_PATH)
+        print(f"Saved {len(splits)} document chunks to {LOCAL_INDEX_PATH}")
+    else:
+        # Create embeddings and upload to Pinecone; deterministic IDs overwrite
+        # previously uploaded copies of the same chunk instead of duplicating it
+        vector_store = PineconeVectorStore.from_documents(
+            documents=splits,
+            embedding=embeddings,
+            ids=ids,
+            index_name=PINECONE_INDEX_NAME,
+        )
+        print(f"Successfully uploaded {len(splits)} document chunks to Pinecone")
+
+    # Chunks of the previous build that no longer exist stay in the manifest
+    # until they are deleted, so an interrupted rebuild or a later --sync
+    # still removes them
+    previous = load_manifest(backend)
+    stale = [doc_id for doc_id in previous if doc_id not in chunks]
+    manifest = {doc_id: chunks[doc_id][1] for doc_id in ids}
+    if backend == "pinecone":
+        manifest.update((doc_id, previous[doc_id]) for doc_id in stale)
+        save_manifest(backend, manifest)
+        for start in range(0, len(stale), batch_size):
+            batch_ids = stale[start : start + batch_size]
+            vector_store.delete(ids=batch_ids)
+            for doc_id in batch_ids:
+                manifest.pop(doc_id, None)
+            save_manifest(backend, manifest)
+        if stale:
+            print(f"Deleted {len(stale)} stale chunks")
+    else:
+        # The local index was rebuilt from the current chunks only
+        save_manifest(backend, manifest)
+    build_bm25_index(chunks, previous_ids)
+    print(f"Embedding cache: {embeddings.hits} hits, {embeddings.misses} misses")
+    print(f"Embedding service: {embeddings.embeddings.metrics()}")
 
 
 if __name__ == "__main__":
-    build_and_upload_index()
+    parser = argparse.ArgumentParser(description="Build the document vector index")
+    parser.add_argument(
+        "--backend",
+        choices=["pinecone", "local"],
+        default="pinecone",
+        help="upload to Pinecone or build the local NumPy index",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="only push new or changed chunks and delete removed ones",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="with --sync, print the add/update/delete plan without changing the index",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=100, help="chunks per upsert/delete batch"
+    )
+    args = parser.parse_args()
+    if args.sync:
+        sync_index(backend=args.backend, dry_run=args.dry_run, batch_size=args.batch_size)
+    else:
+        build_and_upload_index(backend=args.backend, batch_size=args.batch_size)
@@ -0,0 +1,258 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_community.document_loaders.base import BaseLoader
+import requests
+import time
+from utils.cache_utils import DocumentCache, content_hash
+import notion_parser
+
+LOADER_MODES = ("auto", "http", "selenium")
+
+
+def create_chrome_driver(page_load_timeout: Optional[float] = None):
+    """Start a headless Chrome suitable for loading Notion pages."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--window-size=1920,1080")
+
+    driver = webdriver.Chrome(options=chrome_options)
+    if page_load_timeout:
+        driver.set_page_load_timeout(page_load_timeout)
+    return driver
+
+
+class NotionLoader(BaseLoader):
+    """Load a public Notion page.
+
+    ``mode="http"`` reads the page-chunk JSON (falling back to the page HTML)
+    without a browser. ``mode="selenium"`` drives headless Chrome and clicks
+    every toggle open. ``mode="auto"`` tries HTTP first and only starts a
+    browser if that yields no content.
+
+    ``session`` and ``driver_factory`` let callers reuse a long-lived HTTP
+    session and browser across many pages; a browser obtained from
+    ``driver_factory`` is left running after the load.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        cache_enabled: bool = True,
+        mode: str = "auto",
+        session: Optional[requests.Session] = None,
+        driver_factory: Optional[Callable] = None,
+    ):
+        if mode not in LOADER_MODES:
+            raise ValueError(f"Unknown loader mode {mode}, use one of {LOADER_MODES}")
+        self.url = url
+        self.cache_enabled = cache_enabled
+        self.mode = mode
+        self.session = session
+        self.driver_factory = driver_factory
+        self.cache = DocumentCache()
+
+    def _load_with_http(self, validators: Optional[Dict] = None):
+        """Returns (title, text, validators) extracted without a browser.
+
+        When the upstream page still matches ``validators`` (same raw payload
+        hash, or a 304 for the HTML), text is None and nothing is extracted.
+        """
+        validators = validators or {}
+        session = self.session or requests.Session()
+        try:
+            record_map = notion_parser.fetch_record_map(self.url, session)
+            source_hash = notion_parser.record_map_hash(record_map)
+            if source_hash == validators.get("source_hash"):
+                return None, None, {"source_hash": source_hash}
+            title, text = notion_parser.record_map_to_markdown(
+                record_map, notion_parser.page_id_from_url(self.url)
+            )
+            if text:
+                return title, text, {"source_hash": source_hash}
+        except Exception as e:
+            print(f"Error loading Notion page chunks: {e}")
+
+        # Exported or server-rendered HTML, toggles are <details> elements
+        html, etag, last_modified = notion_parser.fetch_html_conditional(
+            self.url,
+            session,
+            etag=validators.get("etag"),
+            last_modified=validators.get("last_modified"),
+        )
+        new_validators = {"etag": etag, "last_modified": last_modified}
+        if html is not None:
+            new_validators["source_hash"] = content_hash(html)
+        if html is None or new_validators["source_hash"] == validators.get(
+            "source_hash"
+        ):
+            return None, None, new_validators
+        title, text = notion_parser.html_to_markdown(html)
+        return title, text, new_validators
+
+    def revalidate(self) -> bool:
+        """Check the upstream page and refresh the cache entry.
+
+        Returns whether the content changed. An unchanged page only has its
+        fetch time bumped: no extraction, and the content file is untouched
+        so nothing downstream is re-embedded.
+        """
+        if self.mode == "selenium":
+            return self._load_and_save(save=True)[1]
+
+        validators = self.cache.get_validators(self.url)
+        title, text, new_validators = self._load_with_http(validators)
+        if text is None:
+            self.cache.touch(self.url, **new_validators)
+            return False
+        if not text:
+            return self._load_and_save(save=True)[1]
+        metadata = {"source": self.url, "title": title}
+        return self.cache.save_document(self.url, text, metadata, **new_validators)
+
+    def _expand_toggle_blocks(self, driver):
+        """Expands all toggle blocks in the page."""
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.action_chains import ActionChains
+
+        toggle_blocks = driver.find_elements(By.CLASS_NAME, "notion-toggle-block")
+        print(f"Found {len(toggle_blocks)} toggle blocks")
+
+        for toggle in toggle_blocks:
+            try:
+                # Find the button within the toggle block
+                button = toggle.find_element(By.CSS_SELECTOR, "[role='button']")
+
+                # Check if the toggle is already expanded
+                aria_expanded = button.get_attribute("aria-expanded")
+                if aria_expanded != "true":
+                    # Scroll the toggle into view
+                    driver.execute_script("arguments[0].scrollIntoView(true);", toggle)
+                    time.sleep(0.5)  # Wait for scroll to complete
+
+                    # Click to expand
+                    ActionChains(driver).move_to_element(button).click().perform()
+                    time.sleep(0.2)  # Wait for expansion animation
+
+                    print("Expanded a toggle block")
+            except Exception as e:
+                print(f"Error expanding toggle block: {e}")
+
+    def _extract_content(self, driver):
+        """Extracts content from the page after expanding toggles."""
+        from selenium.webdriver.common.by import By
+
+        try:
+            main_content = driver.find_element(By.CLASS_NAME, "notion-page-content")
+
+            # First expand all toggle blocks
+            self._expand_toggle_blocks(driver)
+
+            # Wait a bit for all expansions to complete
+            time.sleep(2)
+
+            # Get the text content
+            text = main_content.text
+
+            # Log content statistics
+            print(f"Extracted content length: {len(text)} characters")
+            print(f"Content preview: {text[:200]}...")
+
+            return text
+
+        except Exception as e:
+            print(f"Error extracting content: {e}")
+            return ""
+
+    def load(self) -> List[Document]:
+        # Check cache first if enabled
+        if self.cache_enabled:
+            cached_doc = self.cache.get_document(self.url)
+            if cached_doc:
+                print(f"Loading from cache for URL: {self.url}")
+                # Serve the stale copy now and refresh it in the background
+                if cached_doc["stale"]:
+                    self.cache.revalidate_in_background(self.url, self.revalidate)
+                return [
+                    Document(
+                        page_content=cached_doc["content"],
+                        metadata=cached_doc["metadata"],
+                    )
+                ]
+
+        return self._load_and_save(save=self.cache_enabled)[0]
+
+    def fetch(self) -> Tuple[List[Document], Dict]:
+        """Load the page without the cache: (documents, cache validators).
+
+        The validators (etag, last-modified, source hash) let the next
+        revalidation be a conditional request; browser loads have none.
+        """
+        text, title, validators = "", self.url.split("/")[-1], {}
+        if self.mode in ("auto", "http"):
+            try:
+                title, text, validators = self._load_with_http()
+                print(f"Loaded Notion page without a browser: {self.url}")
+            except Exception as e:
+                print(f"Error loading Notion page over HTTP: {e}")
+
+        # Selenium is only the fallback when HTTP extraction yields nothing
+        if not text and self.mode in ("auto", "selenium"):
+            title, text = self._load_with_selenium()
+            validators = {}
+
+        if not text:
+            return [], {}
+
+        metadata = {
+            "source": self.url,
+            "title": title,
+        }
+        return [Document(page_content=text, metadata=metadata)], validators
+
+    def _load_and_save(self, save: bool):
+        """Returns (documents, whether the cached content changed)."""
+        docs, validators = self.fetch()
+
+        # Save to cache if enabled
+        changed = False
+        if docs and save:
+            changed = self.cache.save_document(
+                self.url, docs[0].page_content, docs[0].metadata, **validators
+            )
+
+        return docs, changed
+
+    def _load_with_selenium(self):
+        """Returns (title, text) scraped with headless Chrome."""
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
+        driver = None
+        owns_driver = self.driver_factory is None
+        try:
+            driver = create_chrome_driver() if owns_driver else self.driver_factory()
+            print(f"\nLoading Notion page: {self.url}")
+
+            driver.get(self.url)
+
+            # Wait for the main content to load
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CLASS_NAME, "notion-page-content"))
+            )
+
+            # Extract content with expanded toggles
+            return driver.title, self._extract_content(driver)
+
+        except Exception as e:
+            print(f"Error loading Notion page: {e}")
+            return "", ""
+
+        finally:
+            if driver and owns_driver:
+                driver.quit()
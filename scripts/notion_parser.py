@@ -0,0 +1,379 @@
+"""Browserless extraction of public Notion pages.
+
+Pages are read either from Notion's page-chunk JSON (``loadCachedPageChunk``)
+or from exported/public-page HTML. Both are rendered to markdown with toggle
+contents inlined, so nothing has to be clicked open in a browser.
+"""
+
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+REQUEST_TIMEOUT = 20
+CHUNK_LIMIT = 100
+# syncRecordValues accepts a bounded number of pointers per request
+RECORD_BATCH = 100
+
+_PAGE_ID = re.compile(r"([0-9a-f]{32})(?:[?#]|$)")
+
+
+def page_id_from_url(url: str) -> str:
+    """Extract the dashed page UUID from a notion.site URL."""
+    match = _PAGE_ID.search(url.replace("-", "").lower())
+    if not match:
+        raise ValueError(f"No Notion page id in URL: {url}")
+    raw = match.group(1)
+    return f"{raw[:8]}-{raw[8:12]}-{raw[12:16]}-{raw[16:20]}-{raw[20:]}"
+
+
+# --- Page-chunk JSON ---
+
+
+def _api_url(url: str, endpoint: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}/api/v3/{endpoint}"
+
+
+def _blocks(record_map: Dict) -> Dict:
+    return record_map.setdefault("block", {})
+
+
+def _block_value(record_map: Dict, block_id: str) -> Optional[Dict]:
+    record = _blocks(record_map).get(block_id)
+    if not record:
+        return None
+    value = record.get("value", {})
+    # Newer responses wrap the block in an extra {"value": ..., "role": ...}
+    if "value" in value and "type" not in value:
+        value = value["value"]
+    return value
+
+
+def fetch_record_map(url: str, session: Optional[requests.Session] = None) -> Dict:
+    """Download every block of a public page, including toggle children."""
+    session = session or requests.Session()
+    page_id = page_id_from_url(url)
+    record_map = {"block": {}}
+    cursor = {"stack": []}
+    chunk_number = 0
+
+    while True:
+        response = session.post(
+            _api_url(url, "loadCachedPageChunk"),
+            json={
+                "pageId": page_id,
+                "limit": CHUNK_LIMIT,
+                "cursor": cursor,
+                "chunkNumber": chunk_number,
+                "verticalColumns": False,
+            },
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        payload = response.json()
+        _blocks(record_map).update(payload.get("recordMap", {}).get("block", {}))
+        cursor = payload.get("cursor", {"stack": []})
+        chunk_number += 1
+        if not cursor.get("stack"):
+            break
+
+    # Collapsed toggles can reference children that were not sent with the page
+    while True:
+        missing = [
+            child_id
+            for block_id in list(_blocks(record_map))
+            for child_id in (_block_value(record_map, block_id) or {}).get(
+                "content", []
+            )
+            if child_id not in _blocks(record_map)
+        ]
+        if not missing:
+            break
+        for start in range(0, len(missing), RECORD_BATCH):
+            response = session.post(
+                _api_url(url, "syncRecordValues"),
+                json={
+                    "requests": [
+                        {"pointer": {"table": "block", "id": block_id}, "version": -1}
+                        for block_id in missing[start : start + RECORD_BATCH]
+                    ]
+                },
+                timeout=REQUEST_TIMEOUT,
+            )
+            response.raise_for_status()
+            fetched = response.json().get("recordMap", {}).get("block", {})
+            _blocks(record_map).update(fetched)
+            # Never loop forever on blocks the API refuses to return
+            for block_id in missing[start : start + RECORD_BATCH]:
+                _blocks(record_map).setdefault(block_id, {})
+
+    return record_map
+
+
+def record_map_hash(record_map: Dict) -> str:
+    """Hash of the raw blocks, changes whenever any block is edited."""
+    canonical = json.dumps(record_map.get("block", {}), sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _rich_text(segments) -> str:
+    """Render Notion's [[text, [[annotation, ...], ...]], ...] rich text."""
+    parts = []
+    for segment in segments or []:
+        text = segment[0]
+        annotations = segment[1] if len(segment) > 1 else []
+        for annotation in annotations:
+            kind = annotation[0]
+            if kind == "c":
+                text = f"`{text}`"
+            elif kind == "b":
+                text = f"**{text}**"
+            elif kind == "a" and len(annotation) > 1:
+                text = f"[{text}]({annotation[1]})"
+        parts.append(text)
+    return "".join(parts)
+
+
+def _title(block: Dict) -> str:
+    return _rich_text(block.get("properties", {}).get("title"))
+
+
+def _render_table(record_map: Dict, block: Dict) -> List[str]:
+    columns = block.get("format", {}).get("table_block_column_order", [])
+    rows = []
+    for row_id in block.get("content", []):
+        row = _block_value(record_map, row_id) or {}
+        properties = row.get("properties", {})
+        cells = [
+            _rich_text(properties.get(column)).replace("|", "\\|") for column in columns
+        ]
+        rows.append("| " + " | ".join(cells) + " |")
+    if rows:
+        rows.insert(1, "| " + " | ".join("---" for _ in columns) + " |")
+    return rows
+
+
+def _render_block(record_map: Dict, block_id: str, depth: int, lines: List[str]):
+    block = _block_value(record_map, block_id)
+    if not block or not block.get("alive", True):
+        return
+    kind = block.get("type")
+    text = _title(block)
+    indent = "  " * depth
+    render_children = True
+
+    if kind == "header":
+        lines.append(f"# {text}")
+    elif kind == "sub_header":
+        lines.append(f"## {text}")
+    elif kind == "sub_sub_header":
+        lines.append(f"### {text}")
+    elif kind == "bulleted_list":
+        lines.append(f"{indent}- {text}")
+    elif kind == "numbered_list":
+        lines.append(f"{indent}1. {text}")
+    elif kind == "to_do":
+        lines.append(f"{indent}- [ ] {text}")
+    elif kind == "toggle":
+        # Toggle titles often name an endpoint or example; keep them as labels
+        lines.append(f"{indent}{text}")
+    elif kind == "quote" or kind == "callout":
+        lines.append(f"> {text}")
+    elif kind == "code":
+        language = _rich_text(block.get("properties", {}).get("language")).lower()
+        lines.append(f"```{language if language != 'plain text' else ''}")
+        lines.append(text)
+        lines.append("```")
+    elif kind == "divider":
+        lines.append("---")
+    elif kind == "table":
+        lines.extend(_render_table(record_map, block))
+        render_children = False
+    elif kind == "page" and depth > 0:
+        # Link to a sub page, its content is loaded separately
+        lines.append(f"{indent}{text}")
+        render_children = False
+    elif text:
+        lines.append(f"{indent}{text}")
+
+    if render_children:
+        nested = kind in ("bulleted_list", "numbered_list", "to_do", "toggle")
+        for child_id in block.get("content", []):
+            _render_block(record_map, child_id, depth + 1 if nested else depth, lines)
+
+
+def record_map_to_markdown(record_map: Dict, page_id: str) -> Tuple[str, str]:
+    """Render a page's record map to (title, markdown)."""
+    page = _block_value(record_map, page_id)
+    if not page:
+        raise ValueError(f"Page {page_id} is not in the record map")
+    lines: List[str] = []
+    for child_id in page.get("content", []):
+        _render_block(record_map, child_id, 0, lines)
+    return _title(page), "\n".join(lines).strip()
+
+
+# --- HTML ---
+
+_HEADINGS = {"h1": "# ", "h2": "## ", "h3": "### ", "h4": "#### "}
+_SKIPPED = {"script", "style", "noscript", "svg", "head", "nav", "button"}
+
+
+def _inline(node) -> str:
+    if isinstance(node, NavigableString):
+        return str(node)
+    if not isinstance(node, Tag) or node.name in _SKIPPED:
+        return ""
+    text = "".join(_inline(child) for child in node.children)
+    if node.name == "code":
+        return f"`{text}`"
+    if node.name == "br":
+        return "\n"
+    return text
+
+
+def _html_block(node, depth: int, lines: List[str]):
+    if isinstance(node, NavigableString):
+        text = str(node).strip()
+        if text:
+            lines.append(text)
+        return
+    if not isinstance(node, Tag) or node.name in _SKIPPED:
+        return
+
+    name = node.name
+    indent = "  " * depth
+    if name in _HEADINGS:
+        lines.append(_HEADINGS[name] + _inline(node).strip())
+    elif name == "pre":
+        code = node.find("code") or node
+        classes = " ".join(code.get("class", []))
+        language = re.search(r"language-([\w+-]+)", classes)
+        lines.append(f"```{language.group(1).lower() if language else ''}")
+        lines.append(code.get_text().rstrip("\n"))
+        lines.append("```")
+    elif name in ("ul", "ol"):
+        marker = "-" if name == "ul" else "1."
+        for item in node.find_all("li", recursive=False):
+            nested = [
+                child
+                for child in item.children
+                if isinstance(child, Tag)
+                and child.name in ("ul", "ol", "details", "pre")
+            ]
+            text = "".join(
+                _inline(child) for child in item.children if child not in nested
+            ).strip()
+            lines.append(f"{indent}{marker} {text}")
+            for child in nested:
+                _html_block(child, depth + 1, lines)
+    elif name == "details":
+        # Toggle blocks in exported HTML; include summary and body unconditionally
+        summary = node.find("summary")
+        if summary:
+            lines.append(f"{indent}{_inline(summary).strip()}")
+        for child in node.children:
+            if child is not summary:
+                _html_block(child, depth + 1, lines)
+    elif name == "table":
+        rows = []
+        for tr in node.find_all("tr"):
+            cells = [
+                _inline(cell).strip().replace("|", "\\|")
+                for cell in tr.find_all(["td", "th"])
+            ]
+            rows.append("| " + " | ".join(cells) + " |")
+        if rows:
+            width = rows[0].count(" | ") + 1
+            rows.insert(1, "| " + " | ".join("---" for _ in range(width)) + " |")
+        lines.extend(rows)
+    elif name == "blockquote":
+        lines.append("> " + _inline(node).strip())
+    elif name == "hr":
+        lines.append("---")
+    elif name in ("p", "figcaption", "summary"):
+        text = _inline(node).strip()
+        if text:
+            lines.append(f"{indent}{text}")
+    else:
+        # Containers (div, article, section, body, ...) are walked through
+        for child in node.children:
+            _html_block(child, depth, lines)
+
+
+def html_to_markdown(html: str) -> Tuple[str, str]:
+    """Render exported or public-page Notion HTML to (title, markdown)."""
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text().strip() if soup.title else ""
+    root = (
+        soup.find(class_="notion-page-content")
+        or soup.find("article")
+        or soup.body
+        or soup
+    )
+    lines: List[str] = []
+    _html_block(root, 0, lines)
+    return title, "\n".join(lines).strip()
+
+
+def fetch_html(url: str, session: Optional[requests.Session] = None) -> str:
+    return fetch_html_conditional(url, session)[0]
+
+
+def fetch_html_conditional(
+    url: str,
+    session: Optional[requests.Session] = None,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """GET a page with If-None-Match/If-Modified-Since.
+
+    Returns (html, etag, last_modified); html is None on 304 Not Modified.
+    """
+    session = session or requests.Session()
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    return (
+        response.text,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+    )
+
+
+# --- Local files ---
+
+
+def parse_file(path: str, page_id: Optional[str] = None) -> Tuple[str, str]:
+    """Parse a saved page-chunk JSON or HTML file to (title, markdown).
+
+    Used to check extraction against fixture files without any network.
+    """
+    raw = Path(path).read_text(encoding="utf-8")
+    if path.endswith(".json"):
+        payload = json.loads(raw)
+        record_map = payload.get("recordMap", payload)
+        if page_id is None:
+            # The page is the block without a parent block in the map
+            blocks = record_map.get("block", {})
+            page_id = next(
+                block_id
+                for block_id in blocks
+                if (_block_value(record_map, block_id) or {}).get("type") == "page"
+                and (_block_value(record_map, block_id) or {}).get("parent_table")
+                != "block"
+            )
+        return record_map_to_markdown(record_map, page_id)
+    return html_to_markdown(raw)
@@ -0,0 +1,188 @@
+import os
+import sys
+import argparse
+import ast
+import json
+import re
+import subprocess
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to Python path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+# Only needed by offline scripts or on first use; importing any of them
+# when the app starts is reported as a regression
+DEFERRED_PACKAGES = (
+    "selenium",
+    "bs4",
+    "pinecone",
+    "langchain_pinecone",
+    "langchain_community",
+    "langchain_openai",
+    "langchain_anthropic",
+    "openai",
+    "anthropic",
+    "pypdf",
+    "docx2txt",
+    "onnxruntime",
+)
+_IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def startup_modules(entry_point: str):
+    """Modules imported at the top level of ``entry_point``, in order."""
+    tree = ast.parse(Path(entry_point).read_text(encoding="utf-8"))
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def profile_once(modules):
+    """Import ``modules`` in a fresh interpreter with -X importtime.
+
+    Returns the wall time of the imports and the self/cumulative
+    microseconds and nesting depth of every module imported.
+    """
+    code = (
+        "from time import perf_counter\n"
+        "start = perf_counter()\n"
+        f"for name in {modules!r}:\n"
+        "    __import__(name)\n"
+        "print(perf_counter() - start)\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode:
+        sys.exit(f"Importing the app's modules failed:\n{process.stderr[-2000:]}")
+    imports = []
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            imports.append((name, int(own), int(cumulative), len(indent) // 2))
+    return float(process.stdout.strip().splitlines()[-1]), imports
+
+
+def profile(modules, runs, top):
+    walls, packages, direct = [], defaultdict(list), defaultdict(list)
+    for _ in range(runs):
+        wall, imports = profile_once(modules)
+        walls.append(wall)
+        own_by_package = defaultdict(int)
+        for name, own, cumulative, depth in imports:
+            own_by_package[name.split(".")[0]] += own
+            if name in modules:
+                direct[name].append(cumulative)
+        for package, own in own_by_package.items():
+            packages[package].append(own)
+    loaded = set(packages)
+
+    def ms(values):
+        return round(float(np.median(values)) / 1000, 1)
+
+    ranked = sorted(packages.items(), key=lambda item: -np.median(item[1]))
+    return {
+        "config": {"modules": modules, "runs": runs, "python": sys.version.split()[0]},
+        "startup_ms": round(float(np.median(walls)) * 1000, 1),
+        # Cumulative time of each module the entry point imports, children
+        # already imported by an earlier module excluded
+        "modules_ms": {name: ms(direct[name]) for name in modules if name in direct},
+        "packages_ms": {package: ms(values) for package, values in ranked[:top]},
+        "deferred_loaded": [
+            package for package in DEFERRED_PACKAGES if package in loaded
+        ],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Startup regressions beyond ``tolerance`` and newly eager packages."""
+    regressions = []
+    previous = baseline.get("startup_ms")
+    if previous and results["startup_ms"] > previous * (1 + tolerance):
+        regressions.append(f"startup_ms: {previous} -> {results['startup_ms']}")
+    for package in results["deferred_loaded"]:
+        regressions.append(f"{package} is imported at startup")
+    return regressions
+
+
+def print_report(results):
+    print(
+        f"Startup imports: {results['startup_ms']:.1f} ms "
+        f"(median of {results['config']['runs']} fresh interpreters)"
+    )
+    print(f"{'module':<34} {'cumulative ms':>14}")
+    for name, value in results["modules_ms"].items():
+        print(f"{name:<34} {value:>14.1f}")
+    print(f"{'package':<34} {'self ms':>14}")
+    for package, value in results["packages_ms"].items():
+        print(f"{package:<34} {value:>14.1f}")
+    if results["deferred_loaded"]:
+        print(f"Imported at startup: {', '.join(results['deferred_loaded'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report where the app's import (cold start) time goes"
+    )
+    parser.add_argument(
+        "--entry-point",
+        default=os.path.join(project_root, "app.py"),
+        help="file whose top-level imports are profiled",
+    )
+    parser.add_argument(
+        "--module",
+        action="append",
+        dest="modules",
+        help="profile these modules instead, e.g. api",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters")
+    parser.add_argument("--top", type=int, default=15, help="packages to report")
+    parser.add_argument("--output", default="data/startup_profile.json")
+    parser.add_argument("--baseline", default="data/startup_baseline.json")
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the new baseline",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed relative regression"
+    )
+    args = parser.parse_args()
+
+    results = profile(
+        args.modules or startup_modules(args.entry_point), args.runs, args.top
+    )
+    print_report(results)
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+    elif baseline_path.exists():
+        regressions = compare(
+            results, json.loads(baseline_path.read_text()), args.tolerance
+        )
+        if regressions:
+            print(f"Regressions against {baseline_path}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {baseline_path}")
@@ -0,0 +1,56 @@
+import os
+import sys
+import argparse
+import json
+from collections import Counter
+from pathlib import Path
+
+# Add project root to Python path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from utils.constants import PROMPT_CORE_SECTIONS_PATH, TRACE_PATH
+
+
+def count_sections(trace_path):
+    """How often each (source, section) was retrieved in the traced requests.
+
+    Sources are only recorded by requests traced with TRACE_LEVEL=debug.
+    """
+    counts = Counter()
+    with open(trace_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            for source in record.get("sources") or []:
+                if isinstance(source, dict) and source.get("section"):
+                    counts[(source["source"], source["section"])] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rank the most retrieved documentation sections for the "
+        "cached system prompt"
+    )
+    parser.add_argument("--traces", default=TRACE_PATH, help="JSON-lines traces")
+    parser.add_argument("--top", type=int, default=20, help="sections to keep")
+    parser.add_argument("--output", default=PROMPT_CORE_SECTIONS_PATH)
+    args = parser.parse_args()
+
+    counts = count_sections(args.traces)
+    if not counts:
+        sys.exit(
+            f"No retrieved sections in {args.traces}; "
+            "collect traces with TRACE_LEVEL=debug first."
+        )
+    ranked = [
+        {"source": source, "section": section, "count": count}
+        for (source, section), count in counts.most_common(args.top)
+    ]
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(ranked, indent=2))
+    for item in ranked:
+        print(f"{item['count']:>6}  {item['source']}: {item['section']}")
+    # The sections are only packed up to PROMPT_CORE_TOKENS when chains are built
+    print(f"Wrote {len(ranked)} sections to {output}; restart the app to use them")
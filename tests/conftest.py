@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the app's modules from the project root, and the offline
+# loaders (notion_parser) from scripts/, as the scripts themselves do
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, "scripts"))
@@ -0,0 +1,73 @@
+import os
+
+import notion_parser
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def parse_fixture(name):
+    return notion_parser.parse_file(os.path.join(FIXTURES, name))
+
+
+def test_html_export():
+    title, markdown = parse_fixture("notion_page.html")
+    assert title == "Crustdata Discovery And Enrichment API"
+    lines = markdown.splitlines()
+    assert lines[0] == "# Company Endpoints"
+    assert "## Company Discovery: Screening API" in lines
+    assert "### Rate limits" in lines
+    # Page chrome is skipped
+    assert "Share" not in markdown
+    assert "__notion" not in markdown
+
+
+def test_html_toggle_contents_are_inlined():
+    _, markdown = parse_fixture("notion_page.html")
+    lines = markdown.splitlines()
+    assert "Request example" in lines
+    assert "  Send the filters as a JSON array." in lines
+    assert "Response fields" in lines
+    assert "  - `linkedin_profile_url`: the company's LinkedIn page" in lines
+
+
+def test_html_code_blocks_and_tables():
+    _, markdown = parse_fixture("notion_page.html")
+    assert (
+        "```bash\n"
+        "curl --location 'https://api.crustdata.com/screener/company/search' \\\n"
+        "--header 'Authorization: Token $token' \\\n"
+    ) in markdown
+    assert (
+        "| Plan | Requests per minute |\n| --- | --- |\n| Standard | 15 |" in markdown
+    )
+
+
+def test_page_chunk():
+    title, markdown = parse_fixture("notion_page_chunk.json")
+    assert title == "People Endpoints"
+    lines = markdown.splitlines()
+    assert lines[0] == "# People Discovery API"
+    assert "## Response" in lines
+    assert "Search people with `filters` and a page number." in lines
+
+
+def test_page_chunk_toggle_contents_and_code():
+    _, markdown = parse_fixture("notion_page_chunk.json")
+    lines = markdown.splitlines()
+    toggle = lines.index("Request example")
+    assert lines[toggle + 1] == "  Filter by current title:"
+    # The code block is wrapped in the newer {"value": {"value": ...}} shape
+    assert lines[toggle + 2] == "```bash"
+    assert lines[toggle + 3].startswith(
+        "curl 'https://api.crustdata.com/screener/person/search'"
+    )
+    assert lines[toggle + 5] == "```"
+    assert "| linkedin_profile_url | string |" in lines
+
+
+def test_page_id_from_url():
+    url = (
+        "https://crustdata.notion.site/"
+        "People-Endpoints-0e7f2a5c1b3d4c6e8f90123456789abc"
+    )
+    assert notion_parser.page_id_from_url(url) == "0e7f2a5c-1b3d-4c6e-8f90-123456789abc"
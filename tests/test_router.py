@@ -0,0 +1,257 @@
+import asyncio
+import uuid
+from time import sleep
+from typing import List, Optional
+
+import numpy as np
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import Field
+
+from utils.constants import ROUTER_HEDGE_DEFAULT_DELAY, ROUTER_MIN_SAMPLES
+from utils.fakes import FakeProviderError, FakeStreamingChatModel
+from utils.prompt_caching import CACHE_CONTROL, with_cache_breakpoints
+from utils.router import ModelStats, RouterChatModel, get_model_stats
+
+
+class ChatAnthropic(FakeStreamingChatModel):
+    """Named like the real model, so it gets cache breakpoints."""
+
+    received: List = Field(default_factory=list)
+
+    def _stream(self, messages, stop=None, *args, **kwargs):
+        self.received.append((messages, stop))
+        yield from super()._stream(messages, stop, *args, **kwargs)
+
+
+class TrackedChatModel(FakeStreamingChatModel):
+    """Fake provider that logs its calls and can fail after ``fail_after`` tokens."""
+
+    fail_after: Optional[int] = None
+    calls: List[str] = Field(default_factory=list)
+
+    def _check(self, position):
+        if self.fail_after is not None and position == self.fail_after:
+            raise FakeProviderError(f"{self.model_name} failed mid-stream")
+
+    def _stream(self, *args, **kwargs):
+        self.calls.append("start")
+        try:
+            for position, chunk in enumerate(super()._stream(*args, **kwargs)):
+                self._check(position)
+                self.calls.append("token")
+                yield chunk
+        finally:
+            self.calls.append("closed")
+
+    async def _astream(self, *args, **kwargs):
+        self.calls.append("start")
+        try:
+            position = 0
+            async for chunk in super()._astream(*args, **kwargs):
+                self._check(position)
+                position += 1
+                self.calls.append("token")
+                yield chunk
+        finally:
+            self.calls.append("closed")
+
+
+MESSAGES = [
+    SystemMessage(content="You answer questions about the Crustdata API."),
+    HumanMessage(content="How do I search companies?"),
+    HumanMessage(content="And people?"),
+]
+MODES = ["stream", "astream"]
+
+
+def make_router(primary_model, fallback_model):
+    # Stats are shared by name across the process, so every test gets its own
+    suffix = uuid.uuid4().hex[:8]
+    primary, fallback = f"anthropic/claude-{suffix}", f"openai/gpt-{suffix}"
+    router = RouterChatModel(models={primary: primary_model, fallback: fallback_model})
+    return router, primary, fallback
+
+
+def run(router, mode):
+    """(answer streamed so far, error raised or None)."""
+    chunks = []
+    try:
+        if mode == "stream":
+            for chunk in router.stream(MESSAGES):
+                chunks.append(chunk.content)
+        else:
+
+            async def collect():
+                async for chunk in router.astream(MESSAGES):
+                    chunks.append(chunk.content)
+
+            asyncio.run(collect())
+    except FakeProviderError as e:
+        return "".join(chunks), e
+    return "".join(chunks), None
+
+
+def prime(name, ttft):
+    stats = get_model_stats(name)
+    for _ in range(ROUTER_MIN_SAMPLES):
+        stats.record(ttft=ttft)
+
+
+def wait_for(condition, timeout=2.0):
+    # Sync attempts run on threads and only stop at their next chunk
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        sleep(0.01)
+    return condition()
+
+
+def test_cache_wrapped_anthropic_answers():
+    claude = ChatAnthropic(
+        model_name="claude", response="from claude", first_token_latency=0.01
+    )
+    gpt = FakeStreamingChatModel(
+        model_name="gpt", response="from gpt", first_token_latency=0.01
+    )
+    router, primary, _ = make_router(
+        with_cache_breakpoints(claude), with_cache_breakpoints(gpt)
+    )
+    assert run(router, "stream") == ("from claude", None)
+    assert not any(get_model_stats(primary).failures)
+
+
+def test_cache_wrapped_anthropic_answers_async():
+    claude = ChatAnthropic(
+        model_name="claude", response="from claude", first_token_latency=0.01
+    )
+    gpt = FakeStreamingChatModel(
+        model_name="gpt", response="from gpt", first_token_latency=0.01
+    )
+    router, primary, _ = make_router(
+        with_cache_breakpoints(claude), with_cache_breakpoints(gpt)
+    )
+    assert run(router, "astream") == ("from claude", None)
+    assert not any(get_model_stats(primary).failures)
+
+
+def test_cache_wrapper_passes_call_options_on():
+    claude = ChatAnthropic(
+        model_name="claude", response="from claude", first_token_latency=0.01
+    )
+    wrapped = with_cache_breakpoints(claude)
+    assert wrapped.invoke(MESSAGES, stop=["\n\n"]).content == "from claude"
+    messages, stop = claude.received[-1]
+    assert stop == ["\n\n"]
+    assert messages[0].content[-1]["cache_control"] == CACHE_CONTROL
+    assert messages[-2].content[-1]["cache_control"] == CACHE_CONTROL
+    assert messages[-1].content == MESSAGES[-1].content
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_slow_primary_is_hedged(mode, monkeypatch):
+    monkeypatch.setattr("utils.router.ROUTER_HEDGE_MIN_DELAY", 0.01)
+    slow = TrackedChatModel(
+        model_name="slow",
+        response="from the primary model",
+        first_token_latency=0.01,
+        tail_rate=1.0,
+        tail_latency=0.5,
+    )
+    fast = TrackedChatModel(
+        model_name="fast", response="from the fallback", first_token_latency=0.01
+    )
+    router, primary, _ = make_router(slow, fast)
+    prime(primary, 0.02)
+
+    assert run(router, mode) == ("from the fallback", None)
+    assert fast.calls[0] == "start"
+    # The loser is cancelled before streaming its answer
+    assert wait_for(lambda: "closed" in slow.calls)
+    assert slow.calls.count("token") < len(slow._tokens())
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_error_before_first_token_fails_over(mode):
+    failing = TrackedChatModel(
+        model_name="failing", first_token_latency=0.01, error_rate=1.0
+    )
+    healthy = TrackedChatModel(
+        model_name="healthy", response="from the fallback", first_token_latency=0.01
+    )
+    router, primary, fallback = make_router(failing, healthy)
+
+    assert run(router, mode) == ("from the fallback", None)
+    assert "token" not in failing.calls
+    assert list(get_model_stats(primary).failures) == [True]
+    assert list(get_model_stats(fallback).failures) == [False]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_error_after_tokens_is_raised(mode):
+    failing = TrackedChatModel(
+        model_name="failing",
+        response="one two three four",
+        first_token_latency=0.01,
+        fail_after=2,
+    )
+    healthy = TrackedChatModel(
+        model_name="healthy", response="from the fallback", first_token_latency=0.01
+    )
+    router, primary, _ = make_router(failing, healthy)
+
+    answer, error = run(router, mode)
+    # Switching providers now would splice two different answers together
+    assert answer == "one two"
+    assert isinstance(error, FakeProviderError)
+    assert healthy.calls == []
+    assert get_model_stats(primary).failures[-1]
+
+
+def test_hedge_delay_follows_ttft_p95(monkeypatch):
+    monkeypatch.setattr("utils.router.ROUTER_HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr("utils.router.ROUTER_HEDGE_MAX_DELAY", 5.0)
+    stats = ModelStats()
+    samples = list(np.linspace(0.1, 2.0, ROUTER_MIN_SAMPLES))
+    for ttft in samples[:-1]:
+        stats.record(ttft=ttft)
+    assert stats.hedge_delay() == ROUTER_HEDGE_DEFAULT_DELAY
+
+    stats.record(ttft=samples[-1])
+    assert stats.hedge_delay() == pytest.approx(np.percentile(samples, 95))
+
+    # Attempts without a first token are not TTFT samples
+    stats.record(failed=True)
+    assert len(stats.ttfts) == ROUTER_MIN_SAMPLES
+    for _ in range(ROUTER_MIN_SAMPLES * 10):
+        stats.record(ttft=9.0)
+    assert stats.hedge_delay() == 5.0
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_hedge_deadline_adapts_to_recorded_ttfts(mode, monkeypatch):
+    monkeypatch.setattr("utils.router.ROUTER_HEDGE_MIN_DELAY", 0.01)
+
+    def models():
+        primary_model = TrackedChatModel(
+            model_name="primary", response="from the primary", first_token_latency=0.2
+        )
+        fallback_model = TrackedChatModel(
+            model_name="fallback",
+            response="from the fallback",
+            first_token_latency=0.01,
+        )
+        return primary_model, fallback_model
+
+    # A primary that is usually this slow is waited for
+    primary_model, fallback_model = models()
+    router, primary, _ = make_router(primary_model, fallback_model)
+    prime(primary, 1.0)
+    assert run(router, mode) == ("from the primary", None)
+    assert fallback_model.calls == []
+
+    # The same latency from a usually fast primary is hedged
+    primary_model, fallback_model = models()
+    router, primary, _ = make_router(primary_model, fallback_model)
+    prime(primary, 0.02)
+    assert run(router, mode) == ("from the fallback", None)
@@ -0,0 +1,364 @@
+import asyncio
+import threading
+from time import perf_counter
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
+from langchain_core.runnables import RunnableLambda
+
+from utils.bm25_index import HybridRetriever, get_bm25_index
+from utils.cache_utils import DocumentCache
+from utils.constants import CONTEXT_TOKEN_BUDGET, RETRIEVAL_FETCH_K, RETRIEVAL_K
+from utils.context_packing import pack_context
+from utils.doc_splitter import split_documents, unique_chunks
+from utils.prompt_caching import (
+    PromptUsageCallback,
+    build_rag_prompt,
+    load_core_sections,
+    record_prompt_usage,
+)
+from utils.reranker import get_reranker
+from utils.resources import get_vector_store, save_vector_store
+from utils.retrieval import create_adaptive_retriever
+from utils.semantic_cache import get_semantic_cache, replay_answer
+from utils.streaming import AnswerBuffer, coalesce
+from utils.tokens import count_tokens
+from utils.tracing import tracer
+
+# Core chat and RAG logic shared by the Streamlit UI and the HTTP API. Nothing
+# here touches Streamlit; callers get the full answer through ``on_complete``.
+
+RAG_RESPONSE_PREFIX = "*(RAG Response)*\n"
+
+
+def open_vector_store(backend: str, api_key: Optional[str]):
+    """The shared vector store, with the answer cache tied to the corpus."""
+    vector_store = get_vector_store(backend, api_key)
+    # Cached answers are only valid for the documents they were built from
+    get_semantic_cache().set_corpus_version(DocumentCache().fingerprint())
+    return vector_store
+
+
+def add_documents(vector_db, docs: List) -> List[str]:
+    """Split ``docs`` and index the chunks in the vector store and BM25."""
+    chunks, ids = unique_chunks(split_documents(docs))
+    vector_db.add_documents(chunks, ids=ids)
+    save_vector_store(vector_db)
+    # Keep the lexical index in step with the vector store
+    bm25_index = get_bm25_index()
+    bm25_index.add_documents(chunks, ids=ids)
+    bm25_index.save()
+    get_semantic_cache().invalidate()
+    return ids
+
+
+def _get_context_retriever_chain(vector_db, llm, rewrite_llm=None, exclude=()):
+    # ``exclude`` holds (source, section) pairs already in the system prompt
+    # Exact identifiers (field names, endpoint paths) are found by BM25 even
+    # when their embeddings are not the nearest neighbours. Retrieval is wide
+    # for recall; the reranker picks the RETRIEVAL_K chunks that are packed.
+    retriever = HybridRetriever(
+        vector_store=vector_db,
+        bm25_index=get_bm25_index(),
+        k=RETRIEVAL_FETCH_K,
+        fetch_k=RETRIEVAL_FETCH_K,
+    )
+
+    def rerank(query, docs):
+        if exclude:
+            docs = [
+                doc
+                for doc in docs
+                if (doc.metadata.get("source"), doc.metadata.get("section"))
+                not in exclude
+            ]
+        with tracer.span("rerank", candidates=len(docs)):
+            return get_reranker().rerank(query, docs, RETRIEVAL_K)
+
+    # Follow-up questions are rewritten into a search query, preferably by a
+    # cheaper model than the one answering
+    adaptive_retriever = create_adaptive_retriever(
+        retriever, rewrite_llm or llm, k=RETRIEVAL_FETCH_K, rerank=rerank
+    )
+    model = _model_name(llm)
+
+    def retrieve_and_pack(inputs):
+        # Overlapping chunks are merged and the context trimmed to a budget
+        # before it is stuffed into the prompt
+        docs = adaptive_retriever.invoke(inputs)
+        with tracer.span("context_packing"):
+            return pack_context(docs, inputs["input"], CONTEXT_TOKEN_BUDGET, model)
+
+    return RunnableLambda(retrieve_and_pack, name="packed_retriever")
+
+
+# Chains are built once per (model, vector store) and shared by every
+# caller in this process.
+_RAG_CHAIN_CACHE = {}
+_RAG_CHAIN_LOCK = threading.Lock()
+
+
+def _model_cache_key(llm):
+    """Identify an LLM by its class and model name, not by instance."""
+    model_name = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    return f"{type(llm).__name__}/{model_name}"
+
+
+def _model_name(llm) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", "gpt-4o")
+
+
+def get_conversational_rag_chain(llm, vector_db, rewrite_llm=None):
+    """Return the cached RAG chain for this model and vector store."""
+    # The vector store is kept in the cache value so its id cannot be reused
+    key = (
+        _model_cache_key(llm),
+        _model_cache_key(rewrite_llm) if rewrite_llm else None,
+        id(vector_db),
+    )
+    with _RAG_CHAIN_LOCK:
+        cached = _RAG_CHAIN_CACHE.get(key)
+        if cached is not None:
+            return cached[1]
+        # Imported on first use, langchain.chains is slow to import
+        from langchain.chains import create_retrieval_chain
+        from langchain.chains.combine_documents import create_stuff_documents_chain
+
+        with tracer.span("build_rag_chain"):
+            # Frequently retrieved sections join the cached prompt prefix
+            core_sections, core_keys = load_core_sections(model=_model_name(llm))
+            retriever_chain = _get_context_retriever_chain(
+                vector_db, llm, rewrite_llm, exclude=core_keys
+            )
+            prompt, answer_llm = build_rag_prompt(llm, core_sections)
+
+            stuff_documents_chain = create_stuff_documents_chain(answer_llm, prompt)
+            chain = create_retrieval_chain(retriever_chain, stuff_documents_chain)
+        _RAG_CHAIN_CACHE[key] = (vector_db, chain)
+        return chain
+
+
+def _finish_trace(trace, llm, answer: str):
+    """Time the answer stream from its first token and count its tokens."""
+    if trace:
+        end = perf_counter()
+        trace.record("generation", trace.marks.get("ttft", end), end)
+        trace.add_tokens("answer", count_tokens(answer, _model_name(llm)))
+
+
+def stream_chat(
+    llm, messages: List, on_complete: Optional[Callable[[str], None]] = None
+) -> Iterator[str]:
+    """Stream a plain chat answer to ``messages``."""
+    with tracer.trace("chat", model=_model_cache_key(llm)) as trace:
+        buffer = AnswerBuffer()
+        for chunk in llm.stream(messages):
+            if chunk.usage_metadata:
+                record_prompt_usage(trace, chunk)
+            if chunk.content and buffer.empty:
+                trace.mark("ttft")
+            text = buffer.add(chunk.content)
+            if text:
+                yield text
+        text = buffer.flush()
+        if text:
+            yield text
+        answer = buffer.text()
+        _finish_trace(trace, llm, answer)
+        if on_complete is not None:
+            on_complete(answer)
+
+
+async def astream_chat(
+    llm, messages: List, on_complete: Optional[Callable[[str], None]] = None
+) -> AsyncIterator[str]:
+    with tracer.trace("chat", model=_model_cache_key(llm)) as trace:
+        buffer = AnswerBuffer()
+        async for chunk in llm.astream(messages):
+            if chunk.usage_metadata:
+                record_prompt_usage(trace, chunk)
+            if chunk.content and buffer.empty:
+                trace.mark("ttft")
+            text = buffer.add(chunk.content)
+            if text:
+                yield text
+        text = buffer.flush()
+        if text:
+            yield text
+        answer = buffer.text()
+        _finish_trace(trace, llm, answer)
+        if on_complete is not None:
+            on_complete(answer)
+
+
+def _semantic_cache_key(llm, vector_db) -> str:
+    """Answer model and embedding model, cached answers depend on both."""
+    embeddings = vector_db.embeddings
+    embedding_model = (
+        getattr(embeddings, "model", None)
+        or getattr(embeddings, "model_name", None)
+        or type(embeddings).__name__
+    )
+    return f"{_model_cache_key(llm)}|{embedding_model}"
+
+
+def _cached_answer(llm, vector_db, messages: List):
+    """(query embedding, cached answer) for a conversation's first question.
+
+    Follow-up questions depend on the conversation, so only the first
+    question of a conversation goes through the cache.
+    """
+    if len(messages) != 1:
+        return None, None
+    with tracer.span("semantic_cache") as span:
+        query_embedding = vector_db.embeddings.embed_query(messages[-1].content)
+        cached_answer = get_semantic_cache().lookup(
+            query_embedding, _semantic_cache_key(llm, vector_db)
+        )
+        span.set(hit=cached_answer is not None)
+    return query_embedding, cached_answer
+
+
+def _usage_config(trace):
+    # Streamed answers only carry text, the usage arrives with the callback
+    return {"callbacks": [PromptUsageCallback(trace)]} if trace else None
+
+
+def _start_rag_trace(llm, messages: List):
+    trace = tracer.trace("rag", model=_model_cache_key(llm), turn=len(messages))
+    if tracer.debug:
+        trace.set(query=messages[-1].content)
+    return trace
+
+
+def _on_context(trace, docs, on_retrieved):
+    if tracer.debug:
+        trace.set(
+            sources=[
+                {
+                    "source": doc.metadata.get("source"),
+                    "section": doc.metadata.get("section"),
+                }
+                for doc in docs
+            ]
+        )
+    if on_retrieved is not None:
+        on_retrieved(docs)
+
+
+def stream_rag(
+    llm,
+    messages: List,
+    vector_db,
+    rewrite_llm=None,
+    on_retrieved: Optional[Callable] = None,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> Iterator[str]:
+    """Stream a RAG answer to the last of ``messages``.
+
+    ``on_retrieved`` is an optional callback that receives the documents
+    from the chain's single retrieval, e.g. for debugging or showing sources.
+    ``rewrite_llm`` rewrites follow-up questions into search queries and
+    defaults to ``llm``. Standalone questions are answered from the
+    semantic cache when a close enough question was already answered by
+    the same model. Stages are timed by ``utils.tracing``.
+    """
+    with _start_rag_trace(llm, messages) as trace:
+        query_embedding, cached_answer = _cached_answer(llm, vector_db, messages)
+        if cached_answer is not None:
+            trace.outcome = "cache_hit"
+            yield from coalesce(replay_answer(cached_answer))
+            if on_complete is not None:
+                on_complete(cached_answer)
+            return
+
+        chain = get_conversational_rag_chain(llm, vector_db, rewrite_llm)
+        buffer = AnswerBuffer()
+        for chunk in chain.stream(
+            {
+                "messages": messages[:-1],
+                "input": messages[-1].content,
+                "query_embedding": query_embedding,
+            },
+            config=_usage_config(trace),
+        ):
+            if "context" in chunk:
+                _on_context(trace, chunk["context"], on_retrieved)
+            if "answer" in chunk:
+                if chunk["answer"] and buffer.empty:
+                    trace.mark("ttft")
+                text = buffer.add(chunk["answer"])
+                if text:
+                    yield text
+        text = buffer.flush()
+        if text:
+            yield text
+        answer = buffer.text()
+
+        if query_embedding is not None:
+            get_semantic_cache().store(
+                query_embedding,
+                _semantic_cache_key(llm, vector_db),
+                messages[-1].content,
+                answer,
+            )
+        _finish_trace(trace, llm, answer)
+        if on_complete is not None:
+            on_complete(answer)
+
+
+async def astream_rag(
+    llm,
+    messages: List,
+    vector_db,
+    rewrite_llm=None,
+    on_retrieved: Optional[Callable] = None,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> AsyncIterator[str]:
+    """Async ``stream_rag``; blocking lookups run on worker threads."""
+    with _start_rag_trace(llm, messages) as trace:
+        # to_thread copies the context, so the lookup's span joins the trace
+        query_embedding, cached_answer = await asyncio.to_thread(
+            _cached_answer, llm, vector_db, messages
+        )
+        if cached_answer is not None:
+            trace.outcome = "cache_hit"
+            for chunk in coalesce(replay_answer(cached_answer)):
+                yield chunk
+            if on_complete is not None:
+                on_complete(cached_answer)
+            return
+
+        chain = get_conversational_rag_chain(llm, vector_db, rewrite_llm)
+        buffer = AnswerBuffer()
+        async for chunk in chain.astream(
+            {
+                "messages": messages[:-1],
+                "input": messages[-1].content,
+                "query_embedding": query_embedding,
+            },
+            config=_usage_config(trace),
+        ):
+            if "context" in chunk:
+                _on_context(trace, chunk["context"], on_retrieved)
+            if "answer" in chunk:
+                if chunk["answer"] and buffer.empty:
+                    trace.mark("ttft")
+                text = buffer.add(chunk["answer"])
+                if text:
+                    yield text
+        text = buffer.flush()
+        if text:
+            yield text
+        answer = buffer.text()
+
+        if query_embedding is not None:
+            await asyncio.to_thread(
+                get_semantic_cache().store,
+                query_embedding,
+                _semantic_cache_key(llm, vector_db),
+                messages[-1].content,
+                answer,
+            )
+        _finish_trace(trace, llm, answer)
+        if on_complete is not None:
+            on_complete(answer)
@@ -0,0 +1,256 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.constants import BM25_INDEX_PATH
+
+# Identifiers, field names and endpoint paths stay whole, e.g.
+# linkedin_profile_url, /screener/company/search, api.crustdata.com
+_TOKEN = re.compile(r"[a-z0-9_]+(?:[./-][a-z0-9_]+)*")
+_PARTS = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms, keeping compound tokens whole and adding their parts."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PARTS.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring over document chunks."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Dict] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._positions: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add_documents(self, docs: List[Document], ids: Optional[List[str]] = None):
+        """Index chunks; a chunk with an id already in the index replaces it."""
+        with self._lock:
+            for i, doc in enumerate(docs):
+                doc_id = ids[i] if ids else (doc.id or str(len(self.docs)))
+                if doc_id in self._positions:
+                    self._remove(doc_id)
+                position = len(self.docs)
+                self.docs.append(
+                    {"id": doc_id, "text": doc.page_content, "metadata": doc.metadata}
+                )
+                terms = Counter(tokenize(doc.page_content))
+                length = sum(terms.values())
+                self.doc_lengths.append(length)
+                self._total_length += length
+                for term, frequency in terms.items():
+                    self.postings[term][position] = frequency
+                self._positions[doc_id] = position
+
+    def _remove(self, doc_id: str):
+        # Rows are tombstoned; positions of other documents stay valid
+        position = self._positions.pop(doc_id)
+        for term in set(tokenize(self.docs[position]["text"])):
+            self.postings[term].pop(position, None)
+        self._total_length -= self.doc_lengths[position]
+        self.doc_lengths[position] = 0
+        self.docs[position] = None
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._positions:
+                    self._remove(doc_id)
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        with self._lock:
+            count = len(self._positions)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            scores: Dict[int, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for position, frequency in postings.items():
+                    norm = (
+                        1
+                        - self.b
+                        + self.b * self.doc_lengths[position] / average_length
+                    )
+                    scores[position] += (
+                        idf * frequency * (self.k1 + 1) / (frequency + self.k1 * norm)
+                    )
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [
+                (
+                    Document(
+                        id=self.docs[position]["id"],
+                        page_content=self.docs[position]["text"],
+                        metadata=dict(self.docs[position]["metadata"]),
+                    ),
+                    score,
+                )
+                for position, score in top
+            ]
+
+    def idf(self, terms: List[str]) -> np.ndarray:
+        with self._lock:
+            count = max(len(self._positions), 1)
+            df = np.array([len(self.postings.get(term, ())) for term in terms])
+        return np.log(1 + (count - df + 0.5) / (df + 0.5))
+
+    def score_texts(self, query: str, texts: List[str]) -> np.ndarray:
+        """BM25 of ``query`` against arbitrary texts, with this index's statistics."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not texts:
+            return np.zeros(len(texts))
+        column = {term: i for i, term in enumerate(terms)}
+        frequencies = np.zeros((len(texts), len(terms)))
+        lengths = np.zeros(len(texts))
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            for token in tokens:
+                if token in column:
+                    frequencies[row, column[token]] += 1
+        with self._lock:
+            count = len(self._positions)
+            average_length = self._total_length / count if count else 0
+        average_length = average_length or lengths.mean() or 1
+        norm = 1 - self.b + self.b * lengths / average_length
+        saturated = (
+            frequencies * (self.k1 + 1) / (frequencies + self.k1 * norm[:, None])
+        )
+        return saturated @ self.idf(terms)
+
+    def save(self, path: str = BM25_INDEX_PATH):
+        """Persist documents and postings, replacing the file atomically."""
+        with self._lock:
+            live = [doc for doc in self.docs if doc is not None]
+            remap = {}
+            for position, doc in enumerate(self.docs):
+                if doc is not None:
+                    remap[position] = len(remap)
+            payload = {
+                "k1": self.k1,
+                "b": self.b,
+                "docs": live,
+                "doc_lengths": [self.doc_lengths[p] for p in remap],
+                "postings": {
+                    term: [[remap[p], f] for p, f in postings.items()]
+                    for term, postings in self.postings.items()
+                    if postings
+                },
+            }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = BM25_INDEX_PATH) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.docs = payload["docs"]
+        index.doc_lengths = payload["doc_lengths"]
+        index._total_length = sum(index.doc_lengths)
+        index._positions = {doc["id"]: i for i, doc in enumerate(index.docs)}
+        for term, postings in payload["postings"].items():
+            index.postings[term] = {position: tf for position, tf in postings}
+        return index
+
+
+_bm25_index = None
+_bm25_index_lock = threading.Lock()
+
+
+def get_bm25_index() -> BM25Index:
+    """Return the process-wide lexical index, loading it on first use."""
+    global _bm25_index
+    with _bm25_index_lock:
+        if _bm25_index is None:
+            if os.path.exists(BM25_INDEX_PATH):
+                _bm25_index = BM25Index.load(BM25_INDEX_PATH)
+                print(f"Loaded BM25 index with {len(_bm25_index)} chunks")
+            else:
+                _bm25_index = BM25Index()
+        return _bm25_index
+
+
+def reciprocal_rank_fusion(
+    *rankings: List[Document], k: int, rrf_k: int = 60
+) -> List[Document]:
+    """Fuse ranked lists by summing 1 / (rrf_k + rank) per document."""
+    scores: Dict[str, float] = defaultdict(float)
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc.page_content] += 1 / (rrf_k + rank + 1)
+            documents.setdefault(doc.page_content, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[content] for content in ranked[:k]]
+
+
+class HybridRetriever(BaseRetriever):
+    """Vector retrieval fused with BM25 via reciprocal-rank fusion."""
+
+    vector_store: object
+    bm25_index: object
+    k: int = 3
+    fetch_k: int = 8
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[Document]:
+        # ``query_embedding``, when the caller already embedded the query
+        if query_embedding is not None:
+            scored = self.vector_store.similarity_search_by_vector_with_score(
+                query_embedding, k=self.fetch_k
+            )
+        else:
+            scored = self.vector_store.similarity_search_with_score(
+                query, k=self.fetch_k
+            )
+        vector_docs = [
+            # The similarity is a reranking feature, see utils/reranker.py
+            Document(
+                id=doc.id,
+                page_content=doc.page_content,
+                metadata={**doc.metadata, "vector_score": float(score)},
+            )
+            for doc, score in scored
+        ]
+        lexical_docs = [doc for doc, _ in self.bm25_index.search(query, self.fetch_k)]
+        return reciprocal_rank_fusion(vector_docs, lexical_docs, k=self.k)
@@ -1,41 +1,319 @@
 import os
 import json
 import hashlib
+import mmap
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Optional
+from time import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from utils.constants import DOCUMENT_CACHE_TTL
+
+try:
+    import fcntl
+except ImportError:  # Windows, writers are only serialized within a process
+    fcntl = None
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path: Path, text: str):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
 
 
 class DocumentCache:
-    def __init__(self):
-        self.data_dir = Path("data")
-        self.content_dir = self.data_dir / "content"
-        self.metadata_dir = self.data_dir / "metadata"
+    """Packed on-disk cache of loaded documents with freshness information.
+
+    Content lives in one append-only data file. An index (``documents.idx``)
+    names that file and maps each URL hash to the offset and length of its
+    content, its metadata and its cache info: when it was fetched, the sha256
+    of the content, and the validators needed for a cheap revalidation
+    (ETag, Last-Modified and a hash of the raw upstream payload). Lookups are
+    a dict access plus a slice of the memory-mapped data file. Writes append
+    to the data file and then atomically replace the index, so readers never
+    see a half-written entry.
+
+    Entries older than ``ttl`` seconds are stale but are still served;
+    ``revalidate_in_background`` refreshes them without blocking the caller.
+    """
+
+    # URLs with a revalidation in flight, shared by every cache instance
+    _revalidating = set()
+    _revalidating_lock = threading.Lock()
+    _write_lock = threading.Lock()
+
+    def __init__(self, ttl: float = DOCUMENT_CACHE_TTL, data_dir: str = "data"):
+        self.ttl = ttl
+        self.data_dir = Path(data_dir)
+        self.index_path = self.data_dir / "documents.idx"
+        self.lock_path = self.data_dir / "documents.lock"
+        self._index: Dict[str, Dict] = {}
+        self._index_mtime = None
+        self._pack_name = "documents.pack"
+        self._mmap = None
+        self._mmap_name = None
 
     def _generate_cache_key(self, url: str) -> str:
         """Generate a unique cache key for a URL."""
         return hashlib.sha256(url.encode()).hexdigest()
 
+    # --- Index and data file ---
+
+    def _load_index(self, migrate: bool = True) -> Dict[str, Dict]:
+        """Return the entries, re-reading the index only when it was replaced."""
+        try:
+            mtime = self.index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            if migrate and self._index_mtime is None and self._has_legacy_files():
+                self.migrate_legacy()
+                return self._load_index(migrate=False)
+            return self._index
+        if mtime != self._index_mtime:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self._index = index["entries"]
+            self._pack_name = index["pack"]
+            self._index_mtime = mtime
+        return self._index
+
+    def _publish(self, entries: Dict[str, Dict], pack_name: str):
+        _write_atomic(
+            self.index_path, json.dumps({"pack": pack_name, "entries": entries})
+        )
+        self._index = entries
+        self._pack_name = pack_name
+        self._index_mtime = self.index_path.stat().st_mtime_ns
+
+    def _read_content(self, entry: Dict) -> str:
+        end = entry["offset"] + entry["length"]
+        if (
+            self._mmap is None
+            or self._mmap_name != self._pack_name
+            or end > len(self._mmap)
+        ):
+            # The data file only grows, remap when an entry lies past the end
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self.data_dir / self._pack_name, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap_name = self._pack_name
+        return self._mmap[entry["offset"] : end].decode("utf-8")
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across threads and, where possible, processes."""
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        with self._write_lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._index_mtime = None
+            yield
+
+    def _update(self, update: Callable[[Dict, object], None]):
+        """Apply ``update(entries, pack_file)`` under the writer lock and publish it."""
+        with self._locked():
+            entries = dict(self._load_index(migrate=False))
+            with open(self.data_dir / self._pack_name, "ab") as pack_file:
+                update(entries, pack_file)
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+            self._publish(entries, self._pack_name)
+
+    @staticmethod
+    def _append(pack_file, content: str) -> Tuple[int, int]:
+        data = content.encode("utf-8")
+        offset = pack_file.seek(0, os.SEEK_END)
+        pack_file.write(data)
+        return offset, len(data)
+
+    # --- Public API ---
+
     def get_document(self, url: str) -> Optional[Dict]:
-        """Retrieve document from pre-built cache."""
+        """Retrieve a document and its freshness from the cache.
+
+        Returns content, metadata, fetched_at and stale. Documents written
+        without a fetch time (e.g. migrated from an older cache) count as stale.
+        """
+        entry = self._load_index().get(self._generate_cache_key(url))
+        if entry is None:
+            return None
+        try:
+            content = self._read_content(entry)
+        except Exception as e:
+            print(f"Error reading from cache: {e}")
+            return None
+        fetched_at = entry["info"].get("fetched_at")
+        return {
+            "content": content,
+            "metadata": entry["metadata"],
+            "fetched_at": fetched_at,
+            "stale": fetched_at is None or time() - fetched_at > self.ttl,
+        }
+
+    def get_validators(self, url: str) -> Dict:
+        """ETag, Last-Modified, source hash and content hash of an entry."""
+        entry = self._load_index().get(self._generate_cache_key(url))
+        return dict(entry["info"]) if entry else {}
+
+    def save_document(
+        self,
+        url: str,
+        content: str,
+        metadata: Dict,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        source_hash: Optional[str] = None,
+    ) -> bool:
+        """Store a document, returning whether its content changed.
+
+        Unchanged content is not appended again, so anything keyed on the
+        content (index fingerprints, embeddings) stays valid.
+        """
+        cache_key = self._generate_cache_key(url)
+        new_hash = content_hash(content)
+        changed = []
+
+        def update(index, pack_file):
+            entry = index.get(cache_key)
+            if entry is None or entry["info"].get("content_hash") != new_hash:
+                offset, length = self._append(pack_file, content)
+                changed.append(True)
+            else:
+                offset, length = entry["offset"], entry["length"]
+            index[cache_key] = {
+                "url": url,
+                "offset": offset,
+                "length": length,
+                "metadata": metadata,
+                "info": {
+                    "fetched_at": time(),
+                    "content_hash": new_hash,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "source_hash": source_hash,
+                },
+            }
+
+        self._update(update)
+        return bool(changed)
+
+    def touch(self, url: str, **validators):
+        """Mark an entry as freshly validated, optionally updating validators."""
         cache_key = self._generate_cache_key(url)
-        content_path = self.content_dir / f"{cache_key}.txt"
-        metadata_path = self.metadata_dir / f"{cache_key}.json"
 
-        if content_path.exists() and metadata_path.exists():
+        def update(index, pack_file):
+            if cache_key not in index:
+                return
+            entry = dict(index[cache_key])
+            entry["info"] = {
+                **entry["info"],
+                **{k: v for k, v in validators.items() if v is not None},
+                "fetched_at": time(),
+            }
+            index[cache_key] = entry
+
+        self._update(update)
+
+    def revalidate_in_background(self, url: str, revalidate: Callable[[], bool]):
+        """Run ``revalidate`` on a daemon thread unless one is already running.
+
+        Callers keep serving the stale entry meanwhile (stale-while-revalidate).
+        """
+        with self._revalidating_lock:
+            if url in self._revalidating:
+                return
+            self._revalidating.add(url)
+
+        def run():
             try:
-                with open(content_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                with open(metadata_path, "r", encoding="utf-8") as f:
-                    metadata = json.load(f)
-                return {"content": content, "metadata": metadata}
+                changed = revalidate()
+                print(f"Revalidated {url}: {'changed' if changed else 'unchanged'}")
             except Exception as e:
-                print(f"Error reading from cache: {e}")
-                return None
-        return None
+                print(f"Error revalidating {url}: {e}")
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(url)
+
+        threading.Thread(target=run, daemon=True).start()
 
     def is_cached(self, url: str) -> bool:
         """Check if a URL is in the pre-built cache."""
-        cache_key = self._generate_cache_key(url)
-        return (self.content_dir / f"{cache_key}.txt").exists() and (
-            self.metadata_dir / f"{cache_key}.json"
-        ).exists()
+        return self._generate_cache_key(url) in self._load_index()
+
+    def iter_documents(self) -> Iterator[Tuple[str, str, Dict]]:
+        """Stream (url, content, metadata) for every cached document."""
+        for entry in list(self._load_index().values()):
+            yield entry["url"], self._read_content(entry), entry["metadata"]
+
+    def fingerprint(self) -> str:
+        """Hash of every cached document, changes whenever the corpus does."""
+        digest = hashlib.sha256()
+        for cache_key, entry in sorted(self._load_index().items()):
+            digest.update(cache_key.encode())
+            digest.update(entry["info"]["content_hash"].encode())
+        return digest.hexdigest()
+
+    def compact(self):
+        """Rewrite the data file without content superseded by later saves.
+
+        The live entries are copied to a new data file and the index is
+        switched to it atomically; the old file is removed afterwards.
+        """
+        with self._locked():
+            entries = {
+                key: dict(entry)
+                for key, entry in self._load_index(migrate=False).items()
+            }
+            old_pack = self.data_dir / self._pack_name
+            pack_name = f"documents.{int(time() * 1000)}.pack"
+            with open(self.data_dir / pack_name, "wb") as pack_file:
+                for entry in entries.values():
+                    content = self._read_content(entry)
+                    entry["offset"], entry["length"] = self._append(pack_file, content)
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+            self._publish(entries, pack_name)
+            if old_pack.exists():
+                old_pack.unlink()
+
+    # --- Migration from the two-files-per-URL layout ---
+
+    def _has_legacy_files(self) -> bool:
+        return (self.data_dir / "content").is_dir()
+
+    def migrate_legacy(self):
+        """Import data/content/<sha>.txt + data/metadata/<sha>.json pairs.
+
+        Migrated entries keep no fetch time, so they revalidate on first use.
+        """
+        content_dir = self.data_dir / "content"
+        metadata_dir = self.data_dir / "metadata"
+
+        def update(entries, pack_file):
+            for content_path in sorted(content_dir.glob("*.txt")):
+                metadata_path = metadata_dir / f"{content_path.stem}.json"
+                if not metadata_path.exists():
+                    continue
+                with open(metadata_path, "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+                url = metadata.get("source")
+                if not url or self._generate_cache_key(url) != content_path.stem:
+                    continue
+                content = content_path.read_text(encoding="utf-8")
+                offset, length = self._append(pack_file, content)
+                entries[content_path.stem] = {
+                    "url": url,
+                    "offset": offset,
+                    "length": length,
+                    "metadata": metadata,
+                    "info": {"fetched_at": None, "content_hash": content_hash(content)},
+                }
+
+        self._update(update)
+        print(f"Migrated {len(self._index)} cached documents to {self.index_path}")
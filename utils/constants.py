@@ -1,8 +1,19 @@
-MODELS = [
-    "openai/gpt-4o",
-    "openai/gpt-4o-mini",
-    "anthropic/claude-3-5-sonnet-20240620",
-]
+import os
+
+# Available models and the token budget for conversation history sent with
+# each request; older turns beyond the budget are folded into a summary.
+MODELS = {
+    "openai/gpt-4o": {"history_tokens": 6000},
+    "openai/gpt-4o-mini": {"history_tokens": 6000},
+    "anthropic/claude-3-5-sonnet-20240620": {"history_tokens": 6000},
+}
+
+
+# Cheap model per provider for query rewriting and history summaries
+REWRITE_MODELS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-haiku-20240307",
+}
 
 
 DEFAULT_RAG_URLS = [
@@ -15,3 +26,103 @@ DEFAULT_RAG_URLS = [
         "fallback_file": "docs/dataset_api.md",
     },
 ]
+
+
+# Semantic answer cache for standalone RAG questions
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "data/semantic_cache.db")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+# Vector store backend: "pinecone" (cloud index) or "local" (NumPy index on disk)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+PINECONE_INDEX_NAME = "serverless-index"
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "data/index")
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+
+# Persistent cache of embeddings keyed by model and chunk content hash
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.db")
+
+# Cached Notion documents older than this are served stale and revalidated
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", str(24 * 3600)))
+
+# Lexical (BM25) index fused with vector results, see utils/bm25_index.py
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "data/bm25_index.json")
+# Chunks passed to the answer model after reranking, and candidates fetched
+# per retriever and kept after fusion for the reranker
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "30"))
+# Directory with an ONNX cross-encoder (model.onnx and tokenizer.json) to
+# rerank with; without one a vectorized feature scorer is used
+RERANKER_MODEL_PATH = os.getenv("RERANKER_MODEL_PATH", "")
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+# Prompt tokens of retrieved context per turn, after merging overlapping chunks
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
+# Target chunk size for the section splitter; overlap only applies to the
+# character-split fallback for unstructured files
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "2000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+# Background ingestion of uploaded files
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "2"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+
+# Embedding service: "openai", or "fake" for offline deterministic vectors
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_RPM = float(os.getenv("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = float(os.getenv("EMBEDDING_TPM", "1000000"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+# Pooled HTTP connections shared by every session, see utils/resources.py
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+
+# HTTP API (api.py): concurrent answers, requests allowed to wait for a slot,
+# and how long they may wait before a 503
+API_MAX_CONCURRENT_REQUESTS = int(os.getenv("API_MAX_CONCURRENT_REQUESTS", "32"))
+API_MAX_QUEUED_REQUESTS = int(os.getenv("API_MAX_QUEUED_REQUESTS", "64"))
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "10"))
+API_MAX_SESSIONS = int(os.getenv("API_MAX_SESSIONS", "1000"))
+
+# Request tracing, see utils/tracing.py. TRACE_LEVEL is "off", "metrics"
+# (aggregated stage timings only), "trace" (also sampled per-request spans
+# written as JSON lines) or "debug" (spans also carry queries and sources)
+TRACE_LEVEL = os.getenv("TRACE_LEVEL", "metrics")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_PATH = os.getenv("TRACE_PATH", "data/traces.jsonl")
+# Port for the Prometheus metrics endpoint of the Streamlit app; 0 disables
+# it. The HTTP API serves the same metrics at /metrics.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Documentation sections placed in the cached system prompt, ranked by
+# scripts/select_core_sections.py, and their token budget (0 disables them)
+PROMPT_CORE_SECTIONS_PATH = os.getenv(
+    "PROMPT_CORE_SECTIONS_PATH", "data/core_sections.json"
+)
+PROMPT_CORE_TOKENS = int(os.getenv("PROMPT_CORE_TOKENS", "2000"))
+
+# Hedged routing between providers, see utils/router.py. Answers stream from
+# the selected model; if its first token is later than its rolling TTFT p95
+# (clamped to the min/max delay), the fallback model is asked as well. Off by
+# default, since the fallback is the other provider's model, see the README.
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "0") == "1"
+ROUTER_FALLBACK_MODELS = {
+    "openai": "anthropic/claude-3-5-sonnet-20240620",
+    "anthropic": "openai/gpt-4o",
+}
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "200"))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "20"))
+ROUTER_HEDGE_DEFAULT_DELAY = float(os.getenv("ROUTER_HEDGE_DEFAULT_DELAY", "3"))
+ROUTER_HEDGE_MIN_DELAY = float(os.getenv("ROUTER_HEDGE_MIN_DELAY", "0.5"))
+ROUTER_HEDGE_MAX_DELAY = float(os.getenv("ROUTER_HEDGE_MAX_DELAY", "10"))
+# Models failing more often than this are tried after the healthy ones
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+
+# Streamed answers are flushed to the UI or SSE client in pieces of at most
+# this many seconds or characters, see utils/streaming.py
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "256"))
@@ -0,0 +1,172 @@
+import re
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from utils.bm25_index import tokenize
+from utils.tokens import count_tokens
+from utils.tracing import tracer
+
+# Overlap is detected by finding the start of one chunk inside another
+OVERLAP_PROBE_CHARS = 200
+# Shorter repeated spans (labels, "Example:") are kept, they carry structure
+MIN_DUPLICATE_CHARS = 40
+OMITTED = "…"
+
+_FENCE = re.compile(r"```.*?```", re.DOTALL)
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# Paragraph breaks and sentence ends, captured so the separators are kept
+_BOUNDARY = re.compile(r"(\n\s*\n|(?<=[.!?])\s+(?=[A-Z0-9\"'(`\[]))")
+# A unit whose last line is only "1." or "-" ends in the marker of the list
+# item that follows it
+_LIST_MARKER = re.compile(r"(?:^|\n)[ \t]*(?:\d+[.)]|[-*+])$")
+
+
+def _merge_text(first: str, second: str) -> Optional[str]:
+    """Join two texts on their overlap; None if they do not overlap."""
+    if second in first:
+        return first
+    probe = second[:OVERLAP_PROBE_CHARS]
+    pos = first.find(probe)
+    while pos != -1:
+        if second.startswith(first[pos:]):
+            return first[:pos] + second
+        pos = first.find(probe, pos + 1)
+    return None
+
+
+def merge_chunks(docs: List[Document]) -> List[Document]:
+    """Merge overlapping chunks of the same source, keeping the best rank."""
+    merged: List[Document] = []
+    for doc in docs:
+        source = doc.metadata.get("source")
+        for i, existing in enumerate(merged):
+            if existing.metadata.get("source") != source:
+                continue
+            text = _merge_text(existing.page_content, doc.page_content)
+            if text is None:
+                text = _merge_text(doc.page_content, existing.page_content)
+            if text is not None:
+                merged[i] = Document(page_content=text, metadata=existing.metadata)
+                break
+        else:
+            merged.append(doc)
+    if len(merged) < len(docs):
+        # A merged chunk can now overlap one that it did not before
+        return merge_chunks(merged)
+    return merged
+
+
+def _split_units(text: str) -> List[Tuple[int, str, str]]:
+    """(paragraph, separator, sentence) units; fenced code blocks stay whole.
+
+    The separator is the original whitespace before the unit, so kept units
+    are joined as they were written.
+    """
+    units = []
+    gap = ""
+    new_paragraph = False
+
+    def add(piece: str):
+        nonlocal gap, new_paragraph
+        sentence = piece.strip()
+        if not sentence:
+            gap += piece
+            return
+        separator = gap + piece[: len(piece) - len(piece.lstrip())]
+        paragraph = units[-1][0] if units else 0
+        if units and (new_paragraph or _PARAGRAPH_BREAK.search(separator)):
+            paragraph += 1
+        previous = units[-1] if units else None
+        if previous and previous[0] == paragraph and _LIST_MARKER.search(previous[2]):
+            # A list item is not split from its marker
+            units[-1] = (paragraph, previous[1], previous[2] + separator + sentence)
+        else:
+            units.append((paragraph, separator, sentence))
+        gap = piece[len(piece.rstrip()) :]
+        new_paragraph = False
+
+    def add_prose(prose: str):
+        nonlocal gap
+        for i, piece in enumerate(_BOUNDARY.split(prose)):
+            if i % 2:
+                gap += piece
+            else:
+                add(piece)
+
+    last = 0
+    for fence in _FENCE.finditer(text):
+        add_prose(text[last : fence.start()])
+        # A code block is a paragraph of its own
+        new_paragraph = True
+        add(fence.group())
+        new_paragraph = True
+        last = fence.end()
+    add_prose(text[last:])
+    return units
+
+
+def pack_context(
+    docs: List[Document], query: str, token_budget: int, model: str = "gpt-4o"
+) -> List[Document]:
+    """Merge, deduplicate and trim retrieved chunks to ``token_budget`` tokens.
+
+    Overlapping chunks of one source become a single document and sentences
+    already seen in a better-ranked chunk are dropped. If the rest is still
+    over budget, the sentences sharing the most terms with ``query`` are kept
+    (ties go to better-ranked documents), in their original order and with
+    their original separators, ``…`` marking what was left out. Documents
+    with nothing left out keep their text as written.
+    """
+    query_terms = set(tokenize(query))
+    seen = set()
+    # (score, tokens, doc index, paragraph index, ordinal, separator, sentence)
+    sentences: List[Tuple[float, int, int, int, int, str, str]] = []
+    merged = merge_chunks(docs)
+    unit_counts = []
+    for d, doc in enumerate(merged):
+        units = _split_units(doc.page_content)
+        unit_counts.append(len(units))
+        for ordinal, (p, separator, sentence) in enumerate(units, 1):
+            normalized = " ".join(sentence.split()).lower()
+            if len(normalized) >= MIN_DUPLICATE_CHARS:
+                if normalized in seen:
+                    continue
+                seen.add(normalized)
+            score = len(query_terms & set(tokenize(sentence))) + 0.5 / (d + 1)
+            tokens = count_tokens(sentence, model)
+            sentences.append((score, tokens, d, p, ordinal, separator, sentence))
+
+    total = sum(sentence[1] for sentence in sentences)
+    kept = sentences
+    if total > token_budget:
+        kept, total = [], 0
+        for sentence in sorted(sentences, key=lambda item: item[0], reverse=True):
+            if total + sentence[1] <= token_budget:
+                kept.append(sentence)
+                total += sentence[1]
+
+    packed = []
+    for d, doc in enumerate(merged):
+        doc_units = sorted(
+            (item for item in kept if item[2] == d), key=lambda item: item[4]
+        )
+        if len(doc_units) == unit_counts[d]:
+            # Nothing was trimmed or deduplicated, the text stays as written
+            packed.append(doc)
+            continue
+        parts, previous = [], (None, 0)
+        for _, _, _, p, ordinal, separator, sentence in doc_units:
+            if parts:
+                adjacent = ordinal == previous[1] + 1 or p == previous[0]
+                parts.append(separator if adjacent else "\n\n")
+            if ordinal != previous[1] + 1:
+                parts.append(OMITTED + " ")
+            parts.append(sentence)
+            previous = (p, ordinal)
+        if parts:
+            packed.append(Document(page_content="".join(parts), metadata=doc.metadata))
+
+    tracer.annotate(chunks=len(docs), documents=len(packed), token_budget=token_budget)
+    tracer.add_tokens("context", total)
+    return packed
@@ -0,0 +1,180 @@
+import hashlib
+import re
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.constants import CHUNK_OVERLAP, CHUNK_SIZE
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+_FENCE_OPEN = re.compile(r"^\s*(```|~~~)")
+# "POST /screener/company/search" or a full https://api.crustdata.com/... URL
+_ENDPOINT = re.compile(
+    r"\b(?:(GET|POST|PUT|PATCH|DELETE)\s+)?"
+    r"(?:https?://api\.crustdata\.com)?(/(?:[\w.{}:-]+/)*[\w.{}:-]+/?)"
+)
+# Sections shorter than this are folded into the following section
+MIN_SECTION_CHARS = 300
+
+
+def looks_like_markdown(text: str) -> bool:
+    return any(
+        _HEADING.match(line) or _FENCE_OPEN.match(line) for line in text.splitlines()
+    )
+
+
+def find_endpoint(text: str) -> Optional[str]:
+    """First API endpoint path mentioned with a method or the API host."""
+    for match in _ENDPOINT.finditer(text):
+        method, path = match.groups()
+        if method or "api.crustdata.com" in match.group():
+            return f"{method} {path}" if method else path
+    return None
+
+
+def _blocks(text: str) -> List[Tuple[str, str]]:
+    """(kind, text) blocks: heading, code, table or paragraph."""
+    blocks, paragraph = [], []
+    lines = text.splitlines()
+
+    def flush():
+        if paragraph:
+            blocks.append(("paragraph", "\n".join(paragraph)))
+            paragraph.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        fence = _FENCE_OPEN.match(line)
+        if fence:
+            # Code and JSON stay in one block up to the closing fence
+            flush()
+            end = i + 1
+            while end < len(lines) and not lines[end].strip().startswith(
+                fence.group(1)
+            ):
+                end += 1
+            blocks.append(("code", "\n".join(lines[i : end + 1])))
+            i = end + 1
+            continue
+        if line.lstrip().startswith("|"):
+            flush()
+            end = i
+            while end < len(lines) and lines[end].lstrip().startswith("|"):
+                end += 1
+            blocks.append(("table", "\n".join(lines[i:end])))
+            i = end
+            continue
+        if _HEADING.match(line):
+            flush()
+            blocks.append(("heading", line.strip()))
+        elif line.strip():
+            paragraph.append(line)
+        else:
+            flush()
+        i += 1
+    flush()
+    return blocks
+
+
+def _sections(text: str) -> List[Dict]:
+    """Heading sections with their heading path and body blocks."""
+    sections = [{"path": [], "blocks": []}]
+    path: List[Tuple[int, str]] = []
+    for kind, block in _blocks(text):
+        if kind == "heading":
+            level, title = _HEADING.match(block).groups()
+            path = [(l, t) for l, t in path if l < len(level)] + [(len(level), title)]
+            sections.append({"path": [t for _, t in path], "blocks": [block]})
+        else:
+            sections[-1]["blocks"].append(block)
+    return [section for section in sections if section["blocks"]]
+
+
+class ApiDocSplitter:
+    """Split markdown API docs by heading section instead of by length.
+
+    Each chunk holds one section (or consecutive short ones); sections larger
+    than ``chunk_size`` are cut between blocks, never inside a code fence or
+    table, and continuation chunks repeat the section heading. Chunks carry
+    the heading path as ``section`` and the first endpoint as ``endpoint``.
+    Documents without markdown structure (PDFs, Word files) fall back to the
+    recursive character splitter.
+    """
+
+    def __init__(
+        self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP
+    ):
+        self.chunk_size = chunk_size
+        self.fallback = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        chunks = []
+        for doc in docs:
+            if looks_like_markdown(doc.page_content):
+                chunks.extend(self._split_markdown(doc))
+            else:
+                chunks.extend(self.fallback.split_documents([doc]))
+        return chunks
+
+    def _split_markdown(self, doc: Document) -> List[Document]:
+        chunks = []
+        pending = []  # short sections waiting to be folded into the next one
+        for section in _sections(doc.page_content):
+            pending.append(section)
+            size = sum(len(b) + 2 for s in pending for b in s["blocks"])
+            if size < MIN_SECTION_CHARS:
+                continue
+            chunks.extend(self._split_section(doc, pending))
+            pending = []
+        if pending:
+            chunks.extend(self._split_section(doc, pending))
+        return chunks
+
+    def _split_section(self, doc: Document, sections: List[Dict]) -> List[Document]:
+        # The last section names the chunk, earlier ones are short preambles
+        path = sections[-1]["path"]
+        heading = sections[-1]["blocks"][0] if path else None
+        blocks = [block for section in sections for block in section["blocks"]]
+        metadata = {**doc.metadata, "section": " > ".join(path)}
+        endpoint = find_endpoint("\n\n".join(blocks))
+        if endpoint:
+            metadata["endpoint"] = endpoint
+
+        chunks, current = [], []
+        for block in blocks:
+            size = sum(len(b) + 2 for b in current) + len(block)
+            if current and size > self.chunk_size:
+                chunks.append("\n\n".join(current))
+                current = [heading] if heading and block != heading else []
+            current.append(block)
+        if current:
+            chunks.append("\n\n".join(current))
+        return [Document(page_content=text, metadata=dict(metadata)) for text in chunks]
+
+
+def split_documents(docs: List[Document]) -> List[Document]:
+    """Chunk documents for the vector store and the BM25 index."""
+    return ApiDocSplitter().split_documents(docs)
+
+
+def chunk_id(source: str, text: str) -> str:
+    """Deterministic chunk ID from the source and the chunk content.
+
+    Re-adding the same chunk, e.g. when an upsert is retried, overwrites it
+    instead of storing a duplicate.
+    """
+    chunk_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{source}\0{chunk_hash}".encode("utf-8")).hexdigest()
+
+
+def unique_chunks(chunks: List[Document]) -> Tuple[List[Document], List[str]]:
+    """Chunks with their IDs, dropping repeats of a chunk within a source."""
+    unique = {}
+    for chunk in chunks:
+        doc_id = chunk_id(chunk.metadata.get("source", ""), chunk.page_content)
+        unique.setdefault(doc_id, chunk)
+    return list(unique.values()), list(unique)
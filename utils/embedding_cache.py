@@ -0,0 +1,122 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.constants import EMBEDDING_CACHE_PATH
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+def _model_name(embeddings: Embeddings) -> str:
+    return (
+        getattr(embeddings, "model", None)
+        or getattr(embeddings, "model_name", None)
+        or type(embeddings).__name__
+    )
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an embedding model with a persistent content-hash cache.
+
+    Vectors are stored as float32 blobs keyed by (embedding model, sha256 of
+    the text), so re-ingesting unchanged chunks costs no embedding calls.
+    Queries are cached under a separate key since some models embed queries
+    and documents differently.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        path: str = EMBEDDING_CACHE_PATH,
+        cache_queries: bool = True,
+    ):
+        self.embeddings = embeddings
+        self.model = _model_name(embeddings)
+        self.path = path
+        self.cache_queries = cache_queries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                ) WITHOUT ROWID"""
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def _hash(text: str, kind: str = "document") -> str:
+        return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _get(self, hashes: List[str]) -> dict:
+        found = {}
+        with self._connect() as conn:
+            for start in range(0, len(hashes), _LOOKUP_BATCH):
+                batch = hashes[start : start + _LOOKUP_BATCH]
+                rows = conn.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    (self.model, *batch),
+                ).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def _put(self, items: dict):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) "
+                "VALUES (?, ?, ?)",
+                [
+                    (self.model, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                    for text_hash, vector in items.items()
+                ],
+            )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [self._hash(text) for text in texts]
+        cached = self._get(list(set(hashes)))
+
+        # Embed each distinct missing text once
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in cached:
+                missing.setdefault(text_hash, text)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            # Round through float32 so cached and fresh vectors are identical
+            computed = {
+                text_hash: np.asarray(vector, dtype=np.float32).tolist()
+                for text_hash, vector in zip(missing.keys(), vectors)
+            }
+            self._put(computed)
+            cached.update(computed)
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        if not self.cache_queries:
+            return self.embeddings.embed_query(text)
+        text_hash = self._hash(text, kind="query")
+        cached = self._get([text_hash])
+        if text_hash in cached:
+            return cached[text_hash]
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32).tolist()
+        self._put({text_hash: vector})
+        return vector
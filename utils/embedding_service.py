@@ -0,0 +1,309 @@
+import asyncio
+import hashlib
+import random
+import threading
+from time import monotonic, perf_counter, sleep
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.constants import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_RPM,
+    EMBEDDING_TPM,
+)
+from utils.tokens import count_tokens
+from utils.tracing import metrics
+
+
+class TokenBucket:
+    """Allow ``per_minute`` units per minute, with bursts up to that size."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> float:
+        """Wait until ``amount`` units are available; returns the seconds waited."""
+        # Requests larger than the bucket would never fit, let them drain it
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return waited
+            delay = (amount - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic offline embeddings with simulated provider latency.
+
+    Vectors are seeded from the text hash, so the same text always maps to
+    the same unit vector. ``latency`` is paid per request and
+    ``latency_per_1k_tokens`` per thousand (estimated) tokens.
+    """
+
+    model = "fake-embedding"
+
+    def __init__(
+        self,
+        dimensions: int = 1536,
+        latency: float = 0.0,
+        latency_per_1k_tokens: float = 0.0,
+    ):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _delay(self, texts: List[str]) -> float:
+        tokens = sum(len(text) // 4 + 1 for text in texts)
+        return self.latency + self.latency_per_1k_tokens * tokens / 1000
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        sleep(self._delay(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._delay(texts))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds from a Retry-After header on a provider error, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, timeouts, connection errors and 5xx responses.
+
+    Anything else (a bad key, a malformed request) fails the same way on
+    every attempt and is raised at once.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    # SDK connection and timeout errors (e.g. openai.APIConnectionError)
+    # carry no status code
+    return any(
+        kind in type(error).__name__ for kind in ("Timeout", "Connection", "RateLimit")
+    )
+
+
+class EmbeddingService(Embeddings):
+    """Batched, rate-limited, concurrent front end for an embedding model.
+
+    Texts are split into batches of ``batch_size``; at most
+    ``max_concurrency`` batches are in flight, and each waits on token
+    buckets for requests and tokens per minute before it is sent; queries
+    skip batching but wait on the same buckets. Rate-limited, timed-out and
+    server-side failures are retried with jittered exponential backoff,
+    honouring Retry-After; other errors are raised at once. All work runs on
+    one event loop owned by the service, so every caller in the process
+    shares the same limits; sync callers block on the result and async
+    callers await it.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_concurrency: int = EMBEDDING_CONCURRENCY,
+        requests_per_minute: float = EMBEDDING_RPM,
+        tokens_per_minute: float = EMBEDDING_TPM,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+    ):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._metrics = {
+            "requests": 0,
+            "texts": 0,
+            "tokens": 0,
+            "retries": 0,
+            "failures": 0,
+            "rate_limited_seconds": 0.0,
+            "busy_seconds": 0.0,
+            "active_seconds": 0.0,
+            "queue_depth": 0,
+            "in_flight": 0,
+        }
+        self._active_since = None
+        self._pending_calls = 0
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        threading.Thread(
+            target=self._loop.run_forever, daemon=True, name="embedding-service"
+        ).start()
+
+    # --- Event loop side ---
+
+    async def _request(self, call, tokens: int):
+        """Await ``call()`` within the rate limits, retrying transient errors."""
+        for attempt in range(self.max_retries + 1):
+            waited = await self._request_bucket.acquire(1)
+            waited += await self._token_bucket.acquire(tokens)
+            self._metrics["rate_limited_seconds"] += waited
+            start = perf_counter()
+            try:
+                result = await call()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    self._metrics["failures"] += 1
+                    metrics.inc("crustdata_embedding_failures_total", model=self.model)
+                    raise
+                self._metrics["retries"] += 1
+                metrics.inc(
+                    "crustdata_embedding_retries_total",
+                    model=self.model,
+                    error=type(e).__name__,
+                )
+                delay = min(60, 2**attempt) * (0.5 + random.random())
+                delay = max(delay, _retry_after(e) or 0)
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                self._metrics["busy_seconds"] += perf_counter() - start
+            self._metrics["requests"] += 1
+            self._metrics["tokens"] += tokens
+            return result
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        tokens = sum(count_tokens(text, self.model) for text in texts)
+        self._metrics["queue_depth"] += 1
+        async with self._semaphore:
+            self._metrics["queue_depth"] -= 1
+            self._metrics["in_flight"] += 1
+            try:
+                vectors = await self._request(
+                    lambda: self.embeddings.aembed_documents(texts), tokens
+                )
+            finally:
+                self._metrics["in_flight"] -= 1
+        self._metrics["texts"] += len(texts)
+        return vectors
+
+    async def _embed_query(self, text: str) -> List[float]:
+        # Not batched or queued behind documents, queries are latency bound
+        return await self._request(
+            lambda: self.embeddings.aembed_query(text), count_tokens(text, self.model)
+        )
+
+    async def _embed_all(self, texts: List[str]) -> List[List[float]]:
+        batches = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        # Wall time with at least one call pending, for throughput
+        if self._active_since is None:
+            self._active_since = perf_counter()
+        self._pending_calls += 1
+        try:
+            results = await asyncio.gather(*(self._embed_batch(b) for b in batches))
+        finally:
+            self._pending_calls -= 1
+            if not self._pending_calls:
+                self._metrics["active_seconds"] += perf_counter() - self._active_since
+                self._active_since = None
+        return [vector for batch in results for vector in batch]
+
+    # --- Embeddings interface ---
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self._embed_all(texts), self._loop)
+        return future.result()
+
+    def embed_query(self, text: str) -> List[float]:
+        future = asyncio.run_coroutine_threadsafe(self._embed_query(text), self._loop)
+        return future.result()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self._embed_all(texts), self._loop)
+        return await asyncio.wrap_future(future)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        future = asyncio.run_coroutine_threadsafe(self._embed_query(text), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def metrics(self) -> Dict:
+        """Counters plus throughput over the time the service was busy."""
+        metrics = dict(self._metrics)
+        active = metrics["active_seconds"]
+        if self._active_since is not None:
+            active += perf_counter() - self._active_since
+        metrics["texts_per_second"] = metrics["texts"] / active if active else 0.0
+        metrics["tokens_per_second"] = metrics["tokens"] / active if active else 0.0
+        return metrics
+
+
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(
+    api_key: Optional[str] = None, backend: str = EMBEDDING_BACKEND
+) -> EmbeddingService:
+    """Shared service per backend and API key, so limits apply process-wide."""
+    key = f"{backend}/{hashlib.sha256((api_key or '').encode()).hexdigest()}"
+    with _services_lock:
+        if key not in _services:
+            if backend == "fake":
+                embeddings = FakeEmbeddings()
+            else:
+                from langchain_openai import OpenAIEmbeddings
+
+                # Retries and batching are handled by the service
+                embeddings = OpenAIEmbeddings(
+                    api_key=api_key, max_retries=0, chunk_size=EMBEDDING_BATCH_SIZE
+                )
+            _services[key] = EmbeddingService(embeddings)
+        return _services[key]
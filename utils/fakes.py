@@ -0,0 +1,103 @@
+import asyncio
+import random
+import re
+from time import sleep
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Offline stand-ins for benchmarks and failure drills. FakeEmbeddings lives
+# next to the embedding service in utils/embedding_service.py.
+
+DEFAULT_RESPONSE = (
+    "To search companies, send a POST request to /screener/company/search with "
+    "a filters array. Each filter names a column, a type and a value, for "
+    "example region set to United States. Results are paginated with a cursor "
+    "and each company includes its linkedin_profile_url and headcount."
+)
+
+
+class FakeProviderError(RuntimeError):
+    """Injected provider failure."""
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Chat model that streams a fixed answer at a configurable pace.
+
+    Waits ``first_token_latency`` seconds, then emits one word every
+    ``1 / tokens_per_second`` seconds. With probability ``tail_rate`` the
+    first token takes ``tail_latency`` seconds instead, and with probability
+    ``error_rate`` a call fails with ``FakeProviderError`` before its first
+    token.
+    """
+
+    model_name: str = "fake-chat"
+    response: str = DEFAULT_RESPONSE
+    first_token_latency: float = 0.2
+    tokens_per_second: float = 50.0
+    error_rate: float = 0.0
+    tail_rate: float = 0.0
+    tail_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self) -> List[str]:
+        return re.findall(r"\s*\S+", self.response)
+
+    def _first_token_latency(self) -> float:
+        if self.tail_rate and random.random() < self.tail_rate:
+            return self.tail_latency
+        return self.first_token_latency
+
+    def _maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeProviderError(f"{self.model_name} failed (injected)")
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = "".join(
+            chunk.message.content
+            for chunk in self._stream(messages, stop, run_manager, **kwargs)
+        )
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        sleep(self._first_token_latency())
+        self._maybe_fail()
+        for i, token in enumerate(self._tokens()):
+            if i:
+                sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._first_token_latency())
+        self._maybe_fail()
+        for i, token in enumerate(self._tokens()):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
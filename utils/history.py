@@ -0,0 +1,101 @@
+from typing import Dict, List
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.prompts import HISTORY_SUMMARY_PROMPT
+from utils.tokens import count_tokens
+from utils.tracing import tracer
+
+SUMMARY_PREFIX = "Summary of our earlier conversation:\n"
+
+
+class ConversationHistory:
+    """Keeps the prompt history of one chat session within a token budget.
+
+    Recent turns are sent verbatim. Once they exceed the budget the oldest
+    ones are folded into a running summary, which is updated incrementally
+    with only the newly evicted turns; if the summary call fails they stay in
+    the window until one succeeds. Token counts are cached per message,
+    so each call only counts the messages added since the previous one.
+    """
+
+    def __init__(self, min_recent_messages: int = 2, refill_ratio: float = 0.75):
+        # Always keep at least this many of the latest messages verbatim
+        self.min_recent_messages = min_recent_messages
+        # Evict down to this share of the budget so summaries are not
+        # refreshed on every single turn
+        self.refill_ratio = refill_ratio
+        self.reset()
+
+    def reset(self):
+        self.summary = ""
+        self._summary_tokens = 0
+        self._token_counts: List[int] = []
+        self._start = 0
+        self._window_tokens = 0
+
+    def _count_new_messages(self, messages: List[Dict], model: str):
+        for message in messages[len(self._token_counts) :]:
+            tokens = count_tokens(message["content"], model)
+            self._token_counts.append(tokens)
+            self._window_tokens += tokens
+
+    def _summarize(self, turns: List[Dict], llm, model: str) -> bool:
+        transcript = "\n\n".join(
+            f"{message['role'].capitalize()}: {message['content']}" for message in turns
+        )
+        try:
+            response = llm.invoke(
+                HISTORY_SUMMARY_PROMPT.format(
+                    summary=self.summary or "(none)", turns=transcript
+                )
+            )
+            self.summary = response.content
+            self._summary_tokens = count_tokens(self.summary, model)
+            return True
+        except Exception as e:
+            tracer.error("history_summary", e)
+            return False
+
+    def build(self, messages: List[Dict], llm, token_budget: int, model: str):
+        """Return the LangChain messages to send for ``messages``.
+
+        ``messages`` are the session's {"role", "content"} dicts, ending with
+        the current user message. ``llm`` writes the running summary.
+        """
+        if len(messages) < len(self._token_counts):
+            # The chat was cleared
+            self.reset()
+        self._count_new_messages(messages, model)
+
+        if self._window_tokens + self._summary_tokens > token_budget:
+            target = token_budget * self.refill_ratio
+            start, window_tokens = self._start, self._window_tokens
+            evicted = []
+            while (
+                self._window_tokens + self._summary_tokens > target
+                and len(messages) - self._start > self.min_recent_messages
+            ) or messages[self._start]["role"] != "user":
+                # The window starts on a user message: some providers reject
+                # a conversation opening with an answer, and an answer
+                # without its question misleads. The last message is a user's.
+                evicted.append(messages[self._start])
+                self._window_tokens -= self._token_counts[self._start]
+                self._start += 1
+            if evicted and not self._summarize(evicted, llm, model):
+                # Nothing that is not in a summary is dropped: this turn goes
+                # over budget and the next one retries with these turns too
+                self._start, self._window_tokens = start, window_tokens
+
+        history = []
+        if self.summary:
+            history.append(HumanMessage(content=SUMMARY_PREFIX + self.summary))
+        history.extend(
+            (
+                HumanMessage(content=message["content"])
+                if message["role"] == "user"
+                else AIMessage(content=message["content"])
+            )
+            for message in messages[self._start :]
+        )
+        return history
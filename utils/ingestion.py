@@ -0,0 +1,217 @@
+import io
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from time import time
+from typing import Callable, Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from utils.bm25_index import get_bm25_index
+from utils.constants import (
+    INGEST_BATCH_SIZE,
+    INGEST_EMBED_CONCURRENCY,
+    INGEST_PARSE_WORKERS,
+)
+from utils.doc_splitter import split_documents, unique_chunks
+from utils.resources import save_vector_store
+from utils.semantic_cache import get_semantic_cache
+from utils.tracing import metrics, tracer
+
+SUPPORTED_TYPES = {
+    "application/pdf": "pdf",
+    "text/plain": "text",
+    "text/markdown": "text",
+}
+SUPPORTED_EXTENSIONS = {
+    ".pdf": "pdf",
+    ".docx": "docx",
+    ".md": "text",
+    ".txt": "text",
+}
+
+# Upload parsers by kind; each imports its dependencies on first use, so
+# the app starts without them
+LOADERS: Dict[str, Callable[[str, bytes], List[Document]]] = {}
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def register_loader(kind: str):
+    """Register a ``loader(name, data) -> documents`` for an upload kind."""
+
+    def register(loader):
+        LOADERS[kind] = loader
+        return loader
+
+    return register
+
+
+@register_loader("pdf")
+def load_pdf(name: str, data: bytes) -> List[Document]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    return [
+        Document(
+            page_content=page.extract_text() or "",
+            metadata={"source": name, "page": number},
+        )
+        for number, page in enumerate(reader.pages)
+    ]
+
+
+@register_loader("docx")
+def load_docx(name: str, data: bytes) -> List[Document]:
+    import docx2txt
+
+    text = docx2txt.process(io.BytesIO(data))
+    return [Document(page_content=text, metadata={"source": name})]
+
+
+@register_loader("text")
+def load_text(name: str, data: bytes) -> List[Document]:
+    text = data.decode("utf-8", errors="replace")
+    return [Document(page_content=text, metadata={"source": name})]
+
+
+def upload_kind(name: str, mime_type: str):
+    """Loader kind of an upload, by extension or MIME type; None if unsupported."""
+    extension = os.path.splitext(name)[1].lower()
+    kind = SUPPORTED_EXTENSIONS.get(extension) or SUPPORTED_TYPES.get(mime_type)
+    return kind if kind in LOADERS else None
+
+
+def parse_upload(name: str, kind: str, data: bytes) -> List[Document]:
+    """Parse an uploaded file from memory. Runs in a worker process."""
+    return LOADERS[kind](name, data)
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # Forking a process that runs server threads is unsafe
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=INGEST_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+class IngestionJob:
+    """Parse, embed and index uploaded files on a background thread.
+
+    Files are parsed in a process pool straight from their bytes. Chunks are
+    embedded and upserted in batches of ``INGEST_BATCH_SIZE``, at most
+    ``INGEST_EMBED_CONCURRENCY`` at a time; the embedding service retries
+    rate-limited or failed requests. Chunk IDs are derived from the source
+    and content, so indexing the same chunk twice overwrites it. Progress is
+    kept on the job for the UI to poll; the job never touches Streamlit
+    state itself.
+    """
+
+    def __init__(self, vector_db, files: List[Tuple[str, str, bytes]]):
+        self.id = uuid.uuid4().hex[:8]
+        self.vector_db = vector_db
+        self.files = files
+        self.status = "queued"
+        self.files_parsed = 0
+        self.chunks_total = 0
+        self.chunks_indexed = 0
+        self.sources: List[str] = []
+        self.errors: Dict[str, str] = {}
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def progress(self) -> float:
+        """Share of the work completed, parsing counts for the first 20%."""
+        parsed = self.files_parsed / len(self.files) if self.files else 1
+        indexed = self.chunks_indexed / self.chunks_total if self.chunks_total else 0
+        return 0.2 * parsed + 0.8 * indexed
+
+    def start(self) -> "IngestionJob":
+        threading.Thread(
+            target=self._run, daemon=True, name=f"ingest-{self.id}"
+        ).start()
+        return self
+
+    def _run(self):
+        self.started_at = time()
+        self.status = "parsing"
+        try:
+            docs = self._parse()
+            chunks, ids = unique_chunks(split_documents(docs))
+            if not chunks:
+                raise ValueError("No text could be extracted from the uploaded files")
+            self.chunks_total = len(chunks)
+            self.status = "indexing"
+            self._index(chunks, ids)
+            # Partial failures are reported through ``errors``
+            self.status = "done" if self.chunks_indexed else "failed"
+        except Exception as e:
+            self.errors["job"] = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time()
+            metrics.inc("crustdata_ingestion_jobs_total", status=self.status)
+            metrics.inc("crustdata_ingestion_chunks_total", self.chunks_indexed)
+            metrics.observe(
+                "crustdata_ingestion_seconds", self.finished_at - self.started_at
+            )
+
+    def _parse(self) -> List[Document]:
+        pool = _get_parse_pool()
+        futures = {
+            pool.submit(parse_upload, name, kind, data): name
+            for name, kind, data in self.files
+        }
+        docs = []
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                parsed = future.result()
+                docs.extend(parsed)
+                self.sources.append(name)
+            except Exception as e:
+                tracer.error("ingestion_parse", e)
+                self.errors[name] = str(e)
+            self.files_parsed += 1
+        return docs
+
+    def _index(self, chunks: List[Document], ids: List[str]):
+        bm25_index = get_bm25_index()
+        with ThreadPoolExecutor(max_workers=INGEST_EMBED_CONCURRENCY) as executor:
+            futures = {}
+            for start in range(0, len(chunks), INGEST_BATCH_SIZE):
+                batch = chunks[start : start + INGEST_BATCH_SIZE]
+                batch_ids = ids[start : start + INGEST_BATCH_SIZE]
+                future = executor.submit(
+                    self.vector_db.add_documents, batch, ids=batch_ids
+                )
+                futures[future] = (batch, batch_ids)
+            # Each batch is searchable as soon as its upsert returns
+            for future in as_completed(futures):
+                batch, batch_ids = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    tracer.error("ingestion_index", e)
+                    self.errors[f"batch {len(self.errors)}"] = str(e)
+                    continue
+                bm25_index.add_documents(batch, ids=batch_ids)
+                with self._lock:
+                    self.chunks_indexed += len(batch)
+        if self.chunks_indexed:
+            save_vector_store(self.vector_db)
+        bm25_index.save()
+        get_semantic_cache().invalidate()
@@ -0,0 +1,304 @@
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+# Matrix values converted to float32 at a time when scoring int8 rows (4 MB)
+INT8_BLOCK_VALUES = 1 << 20
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store backed by a contiguous NumPy matrix.
+
+    Vectors are L2-normalized so a dot product is the cosine similarity.
+    They are stored as float32, float16 or int8 (with one float32 scale per
+    row), and texts and metadata live in a side table indexed by row. A
+    saved store is reopened memory-mapped, so every worker on a host shares
+    one copy of the matrix through the page cache.
+    """
+
+    def __init__(self, embedding: Embeddings, dtype: str = "float32"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, use one of {SUPPORTED_DTYPES}")
+        self._embedding = embedding
+        self.dtype = dtype
+        self._vectors = None
+        self._scales = None
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # --- Writing ---
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            return quantized, scales.astype(np.float32)
+        return vectors.astype(self.dtype), None
+
+    def add_embeddings(
+        self,
+        texts: Iterable[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Add precomputed embeddings, replacing rows with the same ids."""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors, scales = self._quantize(np.asarray(embeddings, dtype=np.float32))
+
+        with self._lock:
+            self._delete_rows(set(ids))
+            if self._vectors is None or not len(self._ids):
+                self._vectors = np.ascontiguousarray(vectors)
+                self._scales = scales
+            else:
+                self._vectors = np.concatenate([self._vectors, vectors])
+                if scales is not None:
+                    self._scales = np.concatenate([self._scales, scales])
+            self._ids.extend(ids)
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(
+            texts, self._embedding.embed_documents(texts), metadatas, ids
+        )
+
+    def _delete_rows(self, ids: set):
+        if not ids or self._vectors is None:
+            return
+        keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in ids]
+        if len(keep) == len(self._ids):
+            return
+        self._vectors = np.ascontiguousarray(self._vectors[keep])
+        if self._scales is not None:
+            self._scales = self._scales[keep]
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        with self._lock:
+            self._delete_rows(set(ids))
+        return True
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        with self._lock:
+            positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            return [self._document(positions[i]) for i in ids if i in positions]
+
+    # --- Searching ---
+
+    def _document(self, row: int) -> Document:
+        return Document(
+            id=self._ids[row],
+            page_content=self._texts[row],
+            metadata=dict(self._metadatas[row]),
+        )
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine scores of shape (n_queries, n_rows) in one matrix product."""
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        if self.dtype == "int8":
+            # Dequantized a block of rows at a time, so no float32 copy of the
+            # whole matrix is made; the row scales are applied to the scores
+            scores = np.empty((len(queries), len(self._vectors)), dtype=np.float32)
+            block = max(1, INT8_BLOCK_VALUES // max(self._vectors.shape[1], 1))
+            for start in range(0, len(self._vectors), block):
+                rows = self._vectors[start : start + block].astype(np.float32)
+                scores[:, start : start + block] = queries @ rows.T
+            return scores * self._scales
+        if self.dtype == "float16":
+            return (queries.astype(np.float16) @ self._vectors.T).astype(np.float32)
+        return queries @ self._vectors.T
+
+    def search_by_vectors(
+        self, query_vectors: List[List[float]], k: int = 4, filter: Optional[dict] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """Top-k documents and cosine scores for a batch of query vectors."""
+        if not self._ids:
+            return [[] for _ in query_vectors]
+        with self._lock:
+            scores = self._scores(np.asarray(query_vectors, dtype=np.float32))
+            if filter:
+                mask = np.array(
+                    [
+                        all(metadata.get(key) == value for key, value in filter.items())
+                        for metadata in self._metadatas
+                    ]
+                )
+                scores[:, ~mask] = -np.inf
+            k = min(k, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for row_scores, candidates in zip(scores, top):
+                ranked = candidates[np.argsort(-row_scores[candidates])]
+                results.append(
+                    [
+                        (self._document(i), float(row_scores[i]))
+                        for i in ranked
+                        if np.isfinite(row_scores[i])
+                    ]
+                )
+            return results
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        return self.search_by_vectors([embedding], k=k, filter=filter)[0]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k=k, filter=filter
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_by_vector_with_score(
+                embedding, k=k, filter=kwargs.get("filter")
+            )
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score(
+                query, k=k, filter=kwargs.get("filter")
+            )
+        ]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    # --- Persistence ---
+
+    def save(self, path: str):
+        """Write the matrix and side table to ``path`` atomically.
+
+        Data files are written under a new version and ``index.json``, replaced
+        last, points to them, so a crash leaves the previous index intact.
+        Files of older versions are removed afterwards.
+        """
+        directory = Path(path)
+        directory.mkdir(parents=True, exist_ok=True)
+        version = uuid.uuid4().hex[:12]
+
+        def write(name, writer):
+            tmp_path = directory / f".{name}.tmp"
+            with open(tmp_path, "wb") as f:
+                writer(f)
+            os.replace(tmp_path, directory / name)
+
+        with self._lock:
+            vectors = self._vectors if self._vectors is not None else np.empty((0, 0))
+            write(f"vectors-{version}.npy", lambda f: np.save(f, vectors))
+            if self._scales is not None:
+                write(f"scales-{version}.npy", lambda f: np.save(f, self._scales))
+            write(
+                f"docstore-{version}.jsonl",
+                lambda f: f.writelines(
+                    (
+                        json.dumps({"id": i, "text": t, "metadata": m}) + "\n"
+                    ).encode("utf-8")
+                    for i, t, m in zip(self._ids, self._texts, self._metadatas)
+                ),
+            )
+            write(
+                "index.json",
+                lambda f: f.write(
+                    json.dumps(
+                        {"dtype": self.dtype, "count": len(self._ids), "version": version}
+                    ).encode()
+                ),
+            )
+
+            # Under the lock, so a concurrent save cannot remove these files
+            names = ("vectors", "scales", "docstore")
+            current = {f"{name}-{version}" for name in names}
+            for file in directory.iterdir():
+                if file.stem.split("-")[0] in names and file.stem not in current:
+                    try:
+                        file.unlink()
+                    except OSError as e:
+                        # E.g. still memory-mapped on Windows; removed later
+                        print(f"Could not remove old index file {file}: {e}")
+
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings, mmap: bool = True) -> "LocalVectorStore":
+        """Open a saved store, memory-mapping the matrix by default."""
+        directory = Path(path)
+        with open(directory / "index.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+        store = cls(embedding, dtype=info["dtype"])
+        # Indexes saved before versioned files have none
+        suffix = f"-{info['version']}" if info.get("version") else ""
+        mmap_mode = "r" if mmap else None
+        store._vectors = np.load(directory / f"vectors{suffix}.npy", mmap_mode=mmap_mode)
+        if info["dtype"] == "int8":
+            store._scales = np.load(directory / f"scales{suffix}.npy")
+        with open(directory / f"docstore{suffix}.jsonl", "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                store._ids.append(row["id"])
+                store._texts.append(row["text"])
+                store._metadatas.append(row["metadata"])
+        return store
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return (Path(path) / "index.json").exists()
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        dtype: str = "float32",
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, dtype=dtype)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
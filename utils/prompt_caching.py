@@ -0,0 +1,226 @@
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    BaseCallbackHandler,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from utils.bm25_index import get_bm25_index
+from utils.constants import PROMPT_CORE_SECTIONS_PATH, PROMPT_CORE_TOKENS
+from utils.prompts import (
+    CORE_SECTIONS_PROMPT,
+    CRUSTDATA_SYSTEM_PROMPT_WITH_RAG,
+    RAG_CONTEXT_PROMPT,
+)
+from utils.retrieval import QUERY_REWRITE_TAG
+from utils.tokens import count_tokens
+from utils.tracing import tracer
+
+# RAG prompts are laid out as a static prefix (system prompt and core
+# documentation), then the conversation, then the retrieved context and the
+# question. Providers cache prompt prefixes: OpenAI automatically, Anthropic
+# up to explicit cache_control breakpoints. Both need a prefix of at least
+# 1024 tokens, which the core sections provide.
+
+CACHE_CONTROL = {"type": "ephemeral"}
+# Prompt caching is a beta in the pinned anthropic SDK
+ANTHROPIC_PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+
+def load_core_sections(
+    path: str = PROMPT_CORE_SECTIONS_PATH,
+    token_budget: int = PROMPT_CORE_TOKENS,
+    model: str = "gpt-4o",
+) -> Tuple[str, Set[Tuple[str, str]]]:
+    """Text of the core documentation sections and their (source, section) keys.
+
+    ``path`` ranks sections by how often they are retrieved, as written by
+    scripts/select_core_sections.py. Whole sections are taken from the BM25
+    index, which holds every chunk, in rank order while they fit the budget.
+    """
+    if not token_budget or not os.path.exists(path):
+        return "", set()
+    with open(path, "r", encoding="utf-8") as f:
+        ranked = [(item["source"], item["section"]) for item in json.load(f)]
+
+    chunks: Dict[Tuple[str, str], List[str]] = {}
+    for doc in list(get_bm25_index().docs):
+        if doc is not None:
+            metadata = doc["metadata"]
+            key = (metadata.get("source"), metadata.get("section"))
+            chunks.setdefault(key, []).append(doc["text"])
+
+    sections, keys, total = [], set(), 0
+    for key in ranked:
+        if key not in chunks:
+            continue
+        text = "\n\n".join(chunks[key])
+        tokens = count_tokens(text, model)
+        if total + tokens <= token_budget:
+            sections.append(text)
+            keys.add(key)
+            total += tokens
+    tracer.annotate(core_sections=len(keys), core_tokens=total)
+    return "\n\n".join(sections), keys
+
+
+def _with_cache_breakpoint(message: BaseMessage) -> BaseMessage:
+    content = message.content
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = [*content[:-1], {**content[-1], "cache_control": CACHE_CONTROL}]
+    return message.model_copy(update={"content": content})
+
+
+def _add_cache_breakpoints(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """Breakpoints after the system prompt and after the conversation."""
+    messages = list(messages)
+    if messages and isinstance(messages[0], SystemMessage):
+        messages[0] = _with_cache_breakpoint(messages[0])
+    # The last message is the new question (with its context, for RAG)
+    if len(messages) > 2:
+        messages[-2] = _with_cache_breakpoint(messages[-2])
+    return messages
+
+
+class CacheBreakpointChatModel(BaseChatModel):
+    """Adds Anthropic prompt caching breakpoints to the input of ``model``.
+
+    Call options such as ``stop`` and the run's callbacks are passed on to
+    ``model`` unchanged.
+    """
+
+    model: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.model._llm_type
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self.model._generate(
+            _add_cache_breakpoints(messages), stop, run_manager, **kwargs
+        )
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await self.model._agenerate(
+            _add_cache_breakpoints(messages), stop, run_manager, **kwargs
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        yield from self.model._stream(
+            _add_cache_breakpoints(messages), stop, run_manager, **kwargs
+        )
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.model._astream(
+            _add_cache_breakpoints(messages), stop, run_manager, **kwargs
+        ):
+            yield chunk
+
+
+def with_cache_breakpoints(llm):
+    """``llm``, with Anthropic prompt caching breakpoints added to its input.
+
+    The next turn reads the cached system prompt and conversation. Other
+    providers cache prefixes without breakpoints and get ``llm`` unchanged.
+    """
+    if type(llm).__name__ != "ChatAnthropic":
+        return llm
+    return CacheBreakpointChatModel(model=llm)
+
+
+def build_rag_prompt(llm, core_sections: str = ""):
+    """(prompt, model) for the answer chain, laid out for prefix caching.
+
+    The static prefix is a message object rather than a template, so braces
+    in the documentation are not read as prompt variables.
+    """
+    system = CRUSTDATA_SYSTEM_PROMPT_WITH_RAG
+    if core_sections:
+        system += "\n\n" + CORE_SECTIONS_PROMPT.format(sections=core_sections)
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            SystemMessage(content=system),
+            MessagesPlaceholder(variable_name="messages"),
+            ("user", RAG_CONTEXT_PROMPT),
+        ]
+    )
+    return prompt, with_cache_breakpoints(llm)
+
+
+def prompt_usage(message: BaseMessage) -> Dict[str, int]:
+    """Prompt tokens of a response: in total, read from and written to cache.
+
+    Uses LangChain's standard usage details where the integration reports
+    them, otherwise the provider's own usage fields.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    metadata = getattr(message, "response_metadata", None) or {}
+    raw = metadata.get("usage") or metadata.get("token_usage") or {}
+    return {
+        "prompt": usage.get("input_tokens")
+        or raw.get("input_tokens")
+        or raw.get("prompt_tokens")
+        or 0,
+        "prompt_cached": details.get("cache_read")
+        or raw.get("cache_read_input_tokens")
+        or (raw.get("prompt_tokens_details") or {}).get("cached_tokens")
+        or 0,
+        "prompt_cache_write": details.get("cache_creation")
+        or raw.get("cache_creation_input_tokens")
+        or 0,
+    }
+
+
+def record_prompt_usage(trace, message: BaseMessage):
+    for kind, count in prompt_usage(message).items():
+        if count:
+            trace.add_tokens(kind, count)
+
+
+class PromptUsageCallback(BaseCallbackHandler):
+    """Adds the answer model's prompt and cached token counts to a trace."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def on_llm_end(self, response, *, tags=None, **kwargs):
+        if tags and QUERY_REWRITE_TAG in tags:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is not None:
+                    record_prompt_usage(self.trace, message)
@@ -10,3 +10,28 @@ CRUSTDATA_SYSTEM_PROMPT_WITH_RAG = """You are a knowledgeable and helpful custom
 
 
 RAG_PROMPT = "Given the above conversation, generate a search query to look up in order to get inforamtion relevant to the conversation, focusing on the most recent messages."
+
+
+HISTORY_SUMMARY_PROMPT = """Update the running summary of a conversation between a user and a Crustdata API support agent.
+
+Current summary:
+{summary}
+
+New conversation turns to fold into the summary:
+{turns}
+
+Write the updated summary in a few short paragraphs. Keep the user's goals, the endpoints, parameters, field names and values discussed, and any open questions. Do not add information that is not in the conversation."""
+
+
+# Sent after the conversation so that everything before it stays a stable,
+# cacheable prompt prefix across turns
+RAG_CONTEXT_PROMPT = """Documentation excerpts relevant to the question:
+
+{context}
+
+Question: {input}"""
+
+
+CORE_SECTIONS_PROMPT = """The most frequently needed sections of the Crustdata API documentation:
+
+{sections}"""
@@ -0,0 +1,161 @@
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.bm25_index import BM25Index, get_bm25_index, tokenize
+from utils.constants import RERANKER_BATCH_SIZE, RERANKER_MODEL_PATH
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Second retrieval stage: a wide list of fused candidates is scored against
+# the query on the CPU and only the best few go into the prompt.
+
+# BM25, query coverage, identifiers, heading, endpoint, vector similarity and
+# retrieval rank; hand-set, identifiers and endpoints matter most in API docs
+FEATURE_WEIGHTS = np.array([1.0, 1.0, 1.5, 0.5, 1.0, 1.0, 0.5])
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    spread = values.max() - values.min() if values.size else 0
+    if not spread:
+        return np.zeros_like(values)
+    return (values - values.min()) / spread
+
+
+class FeatureReranker:
+    """Scores candidates with cheap features, vectorized over the candidates.
+
+    Per chunk: BM25 of the query, the IDF-weighted share of query terms it
+    contains, the share of the query's identifiers (field names, endpoint
+    paths) it contains, query terms in its section heading, whether its
+    endpoint is named in the query, its vector similarity from retrieval and
+    its fused retrieval rank.
+    """
+
+    def __init__(
+        self,
+        bm25_index: Optional[BM25Index] = None,
+        weights: np.ndarray = FEATURE_WEIGHTS,
+    ):
+        self.bm25_index = bm25_index
+        self.weights = weights
+
+    def features(self, query: str, docs: List[Document]) -> np.ndarray:
+        bm25_index = self.bm25_index or get_bm25_index()
+        terms = list(dict.fromkeys(tokenize(query)))
+        identifiers = [term for term in terms if not term.isalnum()]
+        idf = bm25_index.idf(terms) if terms else np.zeros(0)
+        query_lower = query.lower()
+
+        features = np.zeros((len(docs), len(FEATURE_WEIGHTS)))
+        features[:, 0] = _min_max(
+            bm25_index.score_texts(query, [doc.page_content for doc in docs])
+        )
+        for row, doc in enumerate(docs):
+            tokens = set(tokenize(doc.page_content))
+            present = np.array([term in tokens for term in terms], dtype=float)
+            if idf.sum():
+                features[row, 1] = present @ idf / idf.sum()
+            if identifiers:
+                features[row, 2] = sum(i in tokens for i in identifiers) / len(
+                    identifiers
+                )
+            heading = set(tokenize(doc.metadata.get("section") or ""))
+            heading_terms = np.array([term in heading for term in terms], dtype=float)
+            if idf.sum():
+                features[row, 3] = heading_terms @ idf / idf.sum()
+            endpoint = doc.metadata.get("endpoint")
+            if endpoint:
+                path = endpoint.split()[-1].lower()
+                features[row, 4] = float(path in query_lower)
+            features[row, 5] = doc.metadata.get("vector_score", 0.0)
+        features[:, 5] = _min_max(features[:, 5])
+        features[:, 6] = 1 / (1 + np.arange(len(docs)))
+        return features
+
+    def scores(self, query: str, docs: List[Document]) -> np.ndarray:
+        return self.features(query, docs) @ self.weights
+
+    def rerank(self, query: str, docs: List[Document], top_n: int) -> List[Document]:
+        if not docs:
+            return []
+        # Stable, so ties keep the retrieval order
+        order = np.argsort(-self.scores(query, docs), kind="stable")
+        return [docs[i] for i in order[:top_n]]
+
+
+class CrossEncoderReranker(FeatureReranker):
+    """Scores (query, chunk) pairs with an ONNX cross-encoder on the CPU.
+
+    ``model_dir`` holds ``model.onnx`` and its ``tokenizer.json``, e.g. an
+    MS MARCO MiniLM cross-encoder exported with optimum. Pairs are scored in
+    batches of ``batch_size``.
+    """
+
+    def __init__(
+        self, model_dir: str, batch_size: int = RERANKER_BATCH_SIZE, max_length=512
+    ):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        super().__init__()
+        self.batch_size = batch_size
+        options = onnxruntime.SessionOptions()
+        # Leave cores for the concurrent sessions' other work
+        options.intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2)
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {
+            model_input.name for model_input in self.session.get_inputs()
+        }
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def scores(self, query: str, docs: List[Document]) -> np.ndarray:
+        scores = []
+        for start in range(0, len(docs), self.batch_size):
+            batch = docs[start : start + self.batch_size]
+            encodings = self.tokenizer.encode_batch(
+                [(query, doc.page_content) for doc in batch]
+            )
+            inputs = {
+                "input_ids": [encoding.ids for encoding in encodings],
+                "attention_mask": [encoding.attention_mask for encoding in encodings],
+                "token_type_ids": [encoding.type_ids for encoding in encodings],
+            }
+            logits = self.session.run(
+                None,
+                {
+                    name: np.asarray(values, dtype=np.int64)
+                    for name, values in inputs.items()
+                    if name in self.input_names
+                },
+            )[0]
+            # One relevance logit per pair, or the "relevant" class of two
+            scores.append(logits.reshape(len(batch), -1)[:, -1])
+        return np.concatenate(scores)
+
+
+def get_reranker() -> FeatureReranker:
+    """The process-wide reranker; the cross-encoder is loaded only once."""
+    from utils.resources import registry
+
+    def create():
+        if RERANKER_MODEL_PATH:
+            try:
+                return CrossEncoderReranker(RERANKER_MODEL_PATH)
+            except Exception as e:
+                # Ranking still works, with the hand-set features
+                tracer.error("reranker_load", e)
+                logger.warning("Error loading reranker %s: %s", RERANKER_MODEL_PATH, e)
+        return FeatureReranker()
+
+    return registry.get(("reranker", RERANKER_MODEL_PATH or "features"), create)
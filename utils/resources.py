@@ -0,0 +1,321 @@
+import hashlib
+import logging
+import os
+import threading
+from time import perf_counter
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import httpx
+
+from utils.constants import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_TIMEOUT,
+    LOCAL_INDEX_DTYPE,
+    LOCAL_INDEX_PATH,
+    MODELS,
+    PINECONE_INDEX_NAME,
+    REWRITE_MODELS,
+    ROUTER_ENABLED,
+    ROUTER_FALLBACK_MODELS,
+    VECTOR_STORE_BACKEND,
+)
+from utils.tracing import metrics, tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _label(key: Hashable) -> str:
+    return "/".join(str(part) for part in key)
+
+
+class ResourceRegistry:
+    """Process-wide clients, created once per key and shared by every session.
+
+    ``get`` builds a resource on first use with its factory; concurrent
+    callers for the same key wait for that one construction instead of
+    racing. Resources can register a health check, run by ``health``.
+    """
+
+    def __init__(self):
+        self._resources: Dict[Hashable, Any] = {}
+        self._health_checks: Dict[Hashable, Callable[[Any], None]] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: Hashable,
+        factory: Callable[[], Any],
+        health_check: Optional[Callable[[Any], None]] = None,
+    ):
+        resource = self._resources.get(key)
+        if resource is not None:
+            return resource
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Slow factories (network handshakes) only block callers of this key
+        with key_lock:
+            if key not in self._resources:
+                start = perf_counter()
+                self._resources[key] = factory()
+                if health_check is not None:
+                    self._health_checks[key] = health_check
+                metrics.observe(
+                    "crustdata_resource_init_seconds",
+                    perf_counter() - start,
+                    resource=key[0],
+                )
+            return self._resources[key]
+
+    def discard(self, key: Hashable):
+        """Drop a resource (e.g. a broken client) so the next get rebuilds it."""
+        with self._lock:
+            self._resources.pop(key, None)
+            self._health_checks.pop(key, None)
+
+    def health(self) -> Dict[str, str]:
+        """Run every health check, returning "ok" or the error per resource."""
+        results = {}
+        for key, check in list(self._health_checks.items()):
+            try:
+                check(self._resources[key])
+                results[_label(key)] = "ok"
+            except Exception as e:
+                results[_label(key)] = f"error: {e}"
+        return results
+
+
+registry = ResourceRegistry()
+
+
+def _secret_key(secret: Optional[str]) -> str:
+    """Key resources by API key without keeping the key itself around."""
+    return hashlib.sha256((secret or "").encode()).hexdigest()[:16]
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Pooled keep-alive HTTP client shared by the OpenAI chat models."""
+    return registry.get(
+        ("http_client",),
+        lambda: httpx.Client(limits=_limits(), timeout=HTTP_TIMEOUT),
+    )
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    return registry.get(
+        ("async_http_client",),
+        lambda: httpx.AsyncClient(limits=_limits(), timeout=HTTP_TIMEOUT),
+    )
+
+
+def get_chat_model(
+    provider: str,
+    model: str,
+    temperature: float,
+    api_key: Optional[str],
+    streaming: bool = False,
+):
+    """Shared chat model per provider, model, settings and API key."""
+    key = ("chat_model", provider, model, temperature, streaming, _secret_key(api_key))
+
+    def create():
+        if provider == "openai":
+            from langchain_openai import ChatOpenAI
+
+            return ChatOpenAI(
+                api_key=api_key,
+                model_name=model,
+                temperature=temperature,
+                streaming=streaming,
+                # Usage, including cached prompt tokens, with streamed answers
+                stream_usage=streaming,
+                http_client=get_http_client(),
+                http_async_client=get_async_http_client(),
+            )
+        if provider == "anthropic":
+            from langchain_anthropic import ChatAnthropic
+
+            from utils.prompt_caching import ANTHROPIC_PROMPT_CACHING_HEADERS
+
+            return ChatAnthropic(
+                api_key=api_key,
+                model=model,
+                temperature=temperature,
+                streaming=streaming,
+                default_headers=ANTHROPIC_PROMPT_CACHING_HEADERS,
+            )
+        raise ValueError(f"Unknown model provider: {provider}")
+
+    def check(llm):
+        # A cheap authenticated request that also opens the pooled connection
+        if provider == "openai":
+            llm.root_client.models.retrieve(model)
+
+    return registry.get(key, create, check)
+
+
+def get_routed_chat_model(
+    model_key: str, temperature: float, api_keys: Dict[str, Optional[str]]
+):
+    """Streaming chat model for ``model_key`` ("provider/model").
+
+    With ROUTER_ENABLED and a key for the provider's fallback model, this is
+    a shared ``RouterChatModel`` that hedges slow first tokens and fails over
+    to the fallback; otherwise the plain model.
+    """
+    provider, model = model_key.split("/", 1)
+    primary = get_chat_model(
+        provider, model, temperature, api_keys[provider], streaming=True
+    )
+    fallback_key = ROUTER_FALLBACK_MODELS.get(provider)
+    if not ROUTER_ENABLED or not fallback_key or fallback_key == model_key:
+        return primary
+    fallback_provider, fallback_model = fallback_key.split("/", 1)
+    if not api_keys.get(fallback_provider):
+        return primary
+
+    def create():
+        from utils.prompt_caching import with_cache_breakpoints
+        from utils.router import RouterChatModel
+
+        fallback = get_chat_model(
+            fallback_provider,
+            fallback_model,
+            temperature,
+            api_keys[fallback_provider],
+            streaming=True,
+        )
+        # Either model may answer, so each gets its own provider's caching
+        return RouterChatModel(
+            models={
+                model_key: with_cache_breakpoints(primary),
+                fallback_key: with_cache_breakpoints(fallback),
+            },
+            model_name=model,
+        )
+
+    key = (
+        "router",
+        model_key,
+        fallback_key,
+        temperature,
+        _secret_key(api_keys[provider]),
+        _secret_key(api_keys[fallback_provider]),
+    )
+    return registry.get(key, create)
+
+
+def get_embeddings(api_key: Optional[str]):
+    """Embedding cache in front of the shared rate-limited embedding service."""
+    from utils.embedding_cache import CachedEmbeddings
+    from utils.embedding_service import get_embedding_service
+
+    return registry.get(
+        ("embeddings", _secret_key(api_key)),
+        lambda: CachedEmbeddings(get_embedding_service(api_key)),
+    )
+
+
+def get_pinecone_index():
+    """Index handle whose connection pool is reused by every query and upsert."""
+
+    def create():
+        # The REST client, since PineconeVectorStore waits on async upserts
+        # with ``.get()``, which gRPC futures do not have
+        from pinecone import Pinecone
+
+        return Pinecone(api_key=os.getenv("PINECONE_API_KEY")).Index(
+            PINECONE_INDEX_NAME
+        )
+
+    return registry.get(
+        ("pinecone_index", PINECONE_INDEX_NAME),
+        create,
+        lambda index: index.describe_index_stats(),
+    )
+
+
+def get_vector_store(backend: str, api_key: Optional[str]):
+    """Shared vector store for ``backend`` ("pinecone" or "local")."""
+    key = ("vector_store", backend, _secret_key(api_key))
+
+    def create():
+        embeddings = get_embeddings(api_key)
+        if backend == "local":
+            from utils.local_vector_store import LocalVectorStore
+
+            if LocalVectorStore.exists(LOCAL_INDEX_PATH):
+                return LocalVectorStore.load(LOCAL_INDEX_PATH, embeddings)
+            logger.warning(
+                "No local index at %s, run scripts/build_cloud_index.py "
+                "--backend local to build it.",
+                LOCAL_INDEX_PATH,
+            )
+            return LocalVectorStore(embeddings, dtype=LOCAL_INDEX_DTYPE)
+
+        from langchain_pinecone import PineconeVectorStore
+
+        return PineconeVectorStore(index=get_pinecone_index(), embedding=embeddings)
+
+    return registry.get(key, create)
+
+
+def save_vector_store(vector_store):
+    """Persist a local store after documents were added; Pinecone needs nothing.
+
+    Without it uploads to the local backend are lost on restart while the
+    BM25 index, which is saved with them, still has their chunks.
+    """
+    from utils.local_vector_store import LocalVectorStore
+
+    if isinstance(vector_store, LocalVectorStore):
+        vector_store.save(LOCAL_INDEX_PATH)
+
+
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+
+def warm_up_in_background(
+    openai_api_key: Optional[str], anthropic_api_key: Optional[str]
+):
+    """Build the shared resources once per process on a daemon thread.
+
+    The vector store and every configured chat model are created and their
+    health checks run, which opens the pooled connections, before the first
+    question of the first session needs them.
+    """
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+
+    def run():
+        start = perf_counter()
+        try:
+            get_vector_store(VECTOR_STORE_BACKEND, openai_api_key)
+            api_keys = {"openai": openai_api_key, "anthropic": anthropic_api_key}
+            for model_key in MODELS:
+                provider, model = model_key.split("/", 1)
+                if api_keys[provider]:
+                    get_chat_model(
+                        provider, model, 0.3, api_keys[provider], streaming=True
+                    )
+                    get_chat_model(
+                        provider, REWRITE_MODELS[provider], 0, api_keys[provider]
+                    )
+            metrics.observe("crustdata_warm_up_seconds", perf_counter() - start)
+        except Exception as e:
+            tracer.error("warm_up", e)
+            logger.warning("Error warming up shared resources: %s", e)
+
+    threading.Thread(target=run, daemon=True, name="warm-up").start()
@@ -0,0 +1,129 @@
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
+
+from utils.prompts import RAG_PROMPT
+from utils.tracing import tracer
+
+# Words that point back into the conversation, so the question alone is not
+# a good search query
+FOLLOW_UP_WORDS = {
+    "it",
+    "its",
+    "this",
+    "that",
+    "these",
+    "those",
+    "they",
+    "them",
+    "their",
+    "same",
+    "above",
+    "previous",
+    "earlier",
+    "again",
+    "instead",
+    "else",
+    "also",
+}
+MIN_SELF_CONTAINED_WORDS = 4
+# Tags the rewrite model's runs, e.g. to tell its token usage from the answer's
+QUERY_REWRITE_TAG = "query_rewrite"
+
+# Speculative retrievals run here while the query rewrite is in flight
+_speculative_executor = ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix="speculative-retrieval"
+)
+
+
+def needs_rewrite(query: str, history: List) -> bool:
+    """Whether a question depends on the conversation before it."""
+    if not history:
+        return False
+    words = re.findall(r"[a-z']+", query.lower())
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return True
+    return any(word in FOLLOW_UP_WORDS for word in words)
+
+
+def merge_documents(*rankings: List[Document], k: int) -> List[Document]:
+    """Interleave ranked document lists, dropping duplicates, up to k."""
+    merged, seen = [], set()
+    for rank in range(max((len(r) for r in rankings), default=0)):
+        for ranking in rankings:
+            if rank < len(ranking) and ranking[rank].page_content not in seen:
+                seen.add(ranking[rank].page_content)
+                merged.append(ranking[rank])
+    return merged[:k]
+
+
+def create_adaptive_retriever(
+    retriever, rewrite_llm, k: int, rerank: Optional[Callable] = None
+):
+    """Runnable from {"input", "messages"} to documents.
+
+    The first turn and self-contained questions are retrieved as-is. For
+    follow-ups, ``rewrite_llm`` (ideally a cheap model) writes a search
+    query while the raw question is retrieved speculatively in parallel;
+    both result lists are then merged, up to ``k``. ``rerank(query, docs)``
+    then orders the candidates against the (rewritten) query. An optional
+    "query_embedding" input of the question saves embedding it again.
+    """
+    rewrite_chain = (
+        ChatPromptTemplate.from_messages(
+            [
+                MessagesPlaceholder(variable_name="messages"),
+                ("user", "{input}"),
+                ("user", RAG_PROMPT),
+            ]
+        )
+        | rewrite_llm
+        | StrOutputParser()
+    ).with_config(tags=[QUERY_REWRITE_TAG])
+
+    def finish(query: str, docs: List[Document]) -> List[Document]:
+        return rerank(query, docs) if rerank else docs
+
+    def retrieve(inputs: Dict) -> List[Document]:
+        query = inputs["input"]
+        # Set when the question was already embedded, e.g. for the answer cache
+        raw_kwargs = {}
+        if inputs.get("query_embedding") is not None:
+            raw_kwargs["query_embedding"] = inputs["query_embedding"]
+        if not needs_rewrite(query, inputs.get("messages")):
+            with tracer.span("retrieval", rewrite=False):
+                docs = retriever.invoke(query, **raw_kwargs)
+            return finish(query, docs)
+
+        def retrieve_raw():
+            with tracer.span("raw_retrieval"):
+                return retriever.invoke(query, **raw_kwargs)
+
+        # Sequentially this would take rewrite + both retrievals; the spans
+        # show how much of the raw retrieval hides behind the rewrite
+        with tracer.span("retrieval", rewrite=True) as span:
+            raw_future = _speculative_executor.submit(
+                contextvars.copy_context().run, retrieve_raw
+            )
+            try:
+                with tracer.span("rewrite"):
+                    rewritten = rewrite_chain.invoke(inputs)
+                with tracer.span("rewritten_retrieval"):
+                    rewritten_docs = retriever.invoke(rewritten)
+            except Exception as e:
+                # The raw query still gives a usable answer
+                tracer.error("rewrite", e)
+                rewritten, rewritten_docs = query, []
+            raw_docs = raw_future.result()
+            if tracer.debug:
+                span.set(rewritten_query=rewritten)
+            docs = merge_documents(rewritten_docs, raw_docs, k=k)
+        return finish(rewritten, docs)
+
+    return RunnableLambda(retrieve, name="adaptive_retriever")
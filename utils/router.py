@@ -0,0 +1,335 @@
+import asyncio
+import queue
+import threading
+from collections import deque
+from time import monotonic, perf_counter
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import (
+    agenerate_from_stream,
+    generate_from_stream,
+)
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from utils.constants import (
+    ROUTER_HEDGE_DEFAULT_DELAY,
+    ROUTER_HEDGE_MAX_DELAY,
+    ROUTER_HEDGE_MIN_DELAY,
+    ROUTER_MAX_ERROR_RATE,
+    ROUTER_MIN_SAMPLES,
+    ROUTER_WINDOW,
+)
+from utils.tracing import metrics, tracer
+
+
+class ModelStats:
+    """Rolling time to first token and error rate of one model.
+
+    Only attempts that streamed a token are TTFT samples; one cancelled
+    before its first token only says the token would have come later.
+    """
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self.ttfts = deque(maxlen=window)
+        self.failures = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, ttft: Optional[float] = None, failed: bool = False):
+        with self._lock:
+            if ttft is not None:
+                self.ttfts.append(ttft)
+            self.failures.append(failed)
+
+    def ttft_p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self.ttfts) < ROUTER_MIN_SAMPLES:
+                return None
+            return float(np.percentile(self.ttfts, 95))
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if len(self.failures) < ROUTER_MIN_SAMPLES:
+                return 0.0
+            return sum(self.failures) / len(self.failures)
+
+    def hedge_delay(self) -> float:
+        """How long to wait for a first token before asking another model."""
+        p95 = self.ttft_p95()
+        if p95 is None:
+            return ROUTER_HEDGE_DEFAULT_DELAY
+        return min(max(p95, ROUTER_HEDGE_MIN_DELAY), ROUTER_HEDGE_MAX_DELAY)
+
+
+# Shared by every router in the process, keyed by "provider/model"
+_model_stats: Dict[str, ModelStats] = {}
+_model_stats_lock = threading.Lock()
+
+
+def get_model_stats(name: str) -> ModelStats:
+    with _model_stats_lock:
+        return _model_stats.setdefault(name, ModelStats())
+
+
+class _Race:
+    """Bookkeeping of one routed call, shared by the sync and async drivers.
+
+    The first candidate starts right away. The next one starts when the
+    latest attempt's hedge delay passes without a token, or as soon as no
+    attempt is left running after a failure. The first attempt to stream
+    content wins and the others are cancelled.
+    """
+
+    def __init__(self, candidates: List[Tuple[str, Any]]):
+        self.candidates = candidates
+        self.started: List[str] = []
+        self.active = set()
+        self.winner: Optional[str] = None
+        self.done = False
+        self.hedged = False
+        self.deadline = 0.0
+        # Chunks without content (e.g. usage) that arrive before the first token
+        self._held: Dict[str, List[ChatGenerationChunk]] = {}
+
+    def start_next(self) -> Tuple[str, Any]:
+        name, model = self.candidates[len(self.started)]
+        self.started.append(name)
+        self.active.add(name)
+        self._held[name] = []
+        self.deadline = monotonic() + get_model_stats(name).hedge_delay()
+        return name, model
+
+    def hedge(self) -> Tuple[str, Any]:
+        metrics.inc("crustdata_router_hedges_total", model=self.started[-1])
+        self.hedged = True
+        return self.start_next()
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until the next hedge, or None to wait for the attempts."""
+        if self.winner is not None or len(self.started) == len(self.candidates):
+            return None
+        return max(0.0, self.deadline - monotonic())
+
+    def _win(self, name: str) -> Tuple[List[ChatGenerationChunk], List[str]]:
+        self.winner = name
+        losers = [other for other in self.active if other != name]
+        self.active = {name}
+        if name == self.started[0]:
+            route = "primary"
+        else:
+            route = "hedge" if self.hedged else "failover"
+        metrics.inc("crustdata_router_answers_total", model=name, route=route)
+        tracer.annotate(routed_to=name, route=route, attempts=len(self.started))
+        return self._held.pop(name), losers
+
+    def handle(self, name: str, kind: str, payload) -> Tuple[List, List, bool]:
+        """(chunks to forward, attempts to cancel, whether to start another)."""
+        if name not in self.active:
+            # A cancelled attempt that had not stopped yet
+            return [], [], False
+        if kind == "chunk":
+            if name == self.winner:
+                return [payload], [], False
+            self._held[name].append(payload)
+            if not payload.message.content:
+                return [], [], False
+            chunks, losers = self._win(name)
+            return chunks, losers, False
+        if kind == "end":
+            self.done = True
+            if name == self.winner:
+                return [], [], False
+            # Finished without any content
+            chunks, losers = self._win(name)
+            return chunks, losers, False
+
+        # kind == "error"
+        metrics.inc("crustdata_router_errors_total", model=name)
+        if name == self.winner:
+            # Part of the answer was already forwarded, nothing to fail over to
+            raise payload
+        self.active.discard(name)
+        if self.active:
+            return [], [], False
+        if len(self.started) == len(self.candidates):
+            raise payload
+        tracer.annotate(failed_over_from=name, failover_error=repr(payload))
+        return [], [], True
+
+
+def _run_attempt(name, model, messages, stop, kwargs, events, cancelled):
+    stats = get_model_stats(name)
+    start = perf_counter()
+    first_token = False
+    try:
+        for chunk in model.stream(messages, stop=stop, **kwargs):
+            if chunk.content and not first_token:
+                first_token = True
+                ttft = perf_counter() - start
+                stats.record(ttft=ttft)
+                metrics.observe("crustdata_model_ttft_seconds", ttft, model=name)
+            if cancelled.is_set():
+                # Leaving the loop closes the provider's stream
+                return
+            events.put((name, "chunk", ChatGenerationChunk(message=chunk)))
+        if not first_token:
+            stats.record()
+        events.put((name, "end", None))
+    except Exception as e:
+        stats.record(failed=True)
+        events.put((name, "error", e))
+
+
+async def _arun_attempt(name, model, messages, stop, kwargs, events):
+    stats = get_model_stats(name)
+    start = perf_counter()
+    first_token = False
+    try:
+        async for chunk in model.astream(messages, stop=stop, **kwargs):
+            if chunk.content and not first_token:
+                first_token = True
+                ttft = perf_counter() - start
+                stats.record(ttft=ttft)
+                metrics.observe("crustdata_model_ttft_seconds", ttft, model=name)
+            events.put_nowait((name, "chunk", ChatGenerationChunk(message=chunk)))
+        if not first_token:
+            stats.record()
+        events.put_nowait((name, "end", None))
+    except Exception as e:
+        stats.record(failed=True)
+        events.put_nowait((name, "error", e))
+
+
+class RouterChatModel(BaseChatModel):
+    """Streams from the first of several chat models to answer.
+
+    ``models`` maps "provider/model" names to chat models, preferred first;
+    models whose rolling error rate is above ROUTER_MAX_ERROR_RATE are moved
+    to the back. When the first token of an attempt is later than that
+    model's rolling TTFT p95, the next model is asked as well (a hedged
+    request), and whichever streams content first is forwarded while the
+    other is cancelled. Failures before the first token fail over to the
+    next model.
+
+    Sync streams run each attempt on a thread, which notices cancellation at
+    its next chunk; async attempts are cancelled right away.
+    """
+
+    models: Dict[str, Any]
+    model_name: str = "router"
+
+    @property
+    def _llm_type(self) -> str:
+        return "router"
+
+    def _candidates(self) -> List[Tuple[str, Any]]:
+        healthy, failing = [], []
+        for name, model in self.models.items():
+            error_rate = get_model_stats(name).error_rate()
+            (healthy if error_rate <= ROUTER_MAX_ERROR_RATE else failing).append(
+                (name, model)
+            )
+        return healthy + failing
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await agenerate_from_stream(
+            self._astream(messages, stop, run_manager, **kwargs)
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        race = _Race(self._candidates())
+        events = queue.Queue()
+        cancelled: Dict[str, threading.Event] = {}
+
+        def launch(candidate):
+            name, model = candidate
+            cancelled[name] = threading.Event()
+            threading.Thread(
+                target=_run_attempt,
+                args=(name, model, messages, stop, kwargs, events, cancelled[name]),
+                daemon=True,
+                name=f"router-{name}",
+            ).start()
+
+        launch(race.start_next())
+        try:
+            while not race.done:
+                try:
+                    name, kind, payload = events.get(timeout=race.timeout())
+                except queue.Empty:
+                    launch(race.hedge())
+                    continue
+                chunks, losers, failover = race.handle(name, kind, payload)
+                for loser in losers:
+                    cancelled[loser].set()
+                if failover:
+                    launch(race.start_next())
+                yield from chunks
+        finally:
+            for event in cancelled.values():
+                event.set()
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        race = _Race(self._candidates())
+        events = asyncio.Queue()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        def launch(candidate):
+            name, model = candidate
+            tasks[name] = asyncio.create_task(
+                _arun_attempt(name, model, messages, stop, kwargs, events)
+            )
+
+        launch(race.start_next())
+        try:
+            while not race.done:
+                try:
+                    name, kind, payload = await asyncio.wait_for(
+                        events.get(), race.timeout()
+                    )
+                except asyncio.TimeoutError:
+                    launch(race.hedge())
+                    continue
+                chunks, losers, failover = race.handle(name, kind, payload)
+                for loser in losers:
+                    tasks[loser].cancel()
+                if failover:
+                    launch(race.start_next())
+                for chunk in chunks:
+                    yield chunk
+        finally:
+            for task in tasks.values():
+                task.cancel()
@@ -0,0 +1,234 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from time import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from utils.constants import (
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_PATH,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL,
+)
+
+
+class SemanticCache:
+    """SQLite-backed cache of answers keyed on query embedding and model.
+
+    A lookup hits when a stored query for the same model has a cosine
+    similarity of at least ``threshold`` with the new query. Entries expire
+    after ``ttl`` seconds and the least recently used ones are evicted once
+    there are more than ``max_entries``.
+
+    ``model`` should name both the answer model and the embedding model, so
+    answers are never matched against vectors from another embedding space.
+    The normalized embeddings are kept in memory per model and dimension;
+    lookups only read a generation counter from SQLite, and the matrices are
+    reloaded when another process changed the entries.
+    """
+
+    def __init__(
+        self,
+        path: str = SEMANTIC_CACHE_PATH,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: float = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (model, dimension) -> (ids, created_at, normalized embeddings)
+        self._matrices: Dict[Tuple[str, int], Tuple] = {}
+        self._generation = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_model ON entries(model)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """One transaction on a connection that is closed afterwards."""
+        with closing(sqlite3.connect(self.path, timeout=10)) as conn, conn:
+            yield conn
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _read_generation(conn) -> int:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    @staticmethod
+    def _bump_generation(conn) -> int:
+        """Count a change to the entries; atomic across processes."""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        return SemanticCache._read_generation(conn)
+
+    def _matrix(self, conn, model: str, dimension: int, now: float) -> Tuple:
+        generation = self._read_generation(conn)
+        with self._lock:
+            if generation != self._generation:
+                self._matrices.clear()
+                self._generation = generation
+            cached = self._matrices.get((model, dimension))
+        if cached is not None:
+            return cached
+        rows = conn.execute(
+            "SELECT id, created_at, embedding FROM entries "
+            "WHERE model = ? AND length(embedding) = ? AND created_at > ?",
+            (model, dimension * 4, now - self.ttl),
+        ).fetchall()
+        matrix = (
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([row[1] for row in rows], dtype=np.float64),
+            np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float32).reshape(
+                len(rows), dimension
+            ),
+        )
+        with self._lock:
+            if self._generation == generation:
+                self._matrices[(model, dimension)] = matrix
+        return matrix
+
+    def lookup(self, embedding, model: str) -> Optional[str]:
+        """Return the cached answer for the closest matching query, if any."""
+        query = self._normalize(embedding)
+        now = time()
+        with self._connect() as conn:
+            ids, created_at, matrix = self._matrix(conn, model, len(query), now)
+            if len(ids):
+                scores = matrix @ query
+                scores[created_at <= now - self.ttl] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    row = conn.execute(
+                        "SELECT answer FROM entries WHERE id = ?", (int(ids[best]),)
+                    ).fetchone()
+                    if row is not None:
+                        conn.execute(
+                            "UPDATE entries SET last_used_at = ? WHERE id = ?",
+                            (now, int(ids[best])),
+                        )
+                        with self._lock:
+                            self.hits += 1
+                        return row[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, embedding, model: str, query: str, answer: str):
+        """Cache an answer and evict expired or least recently used entries."""
+        vector = self._normalize(embedding)
+        now = time()
+        with self._lock, self._connect() as conn:
+            generation = self._read_generation(conn)
+            new_id = conn.execute(
+                "INSERT INTO entries "
+                "(model, query, embedding, answer, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (model, query, vector.tobytes(), answer, now, now),
+            ).lastrowid
+            evicted = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM entries WHERE created_at <= ? OR id NOT IN "
+                    "(SELECT id FROM entries ORDER BY last_used_at DESC LIMIT ?)",
+                    (now - self.ttl, self.max_entries),
+                )
+            ]
+            conn.executemany(
+                "DELETE FROM entries WHERE id = ?", [(row_id,) for row_id in evicted]
+            )
+            new_generation = self._bump_generation(conn)
+
+            if generation != self._generation:
+                # Another process changed the entries, reload on the next lookup
+                self._matrices.clear()
+            else:
+                for key, (ids, created_at, matrix) in list(self._matrices.items()):
+                    keep = ~np.isin(ids, evicted)
+                    ids, created_at, matrix = ids[keep], created_at[keep], matrix[keep]
+                    if key == (model, len(vector)) and new_id not in evicted:
+                        ids = np.append(ids, new_id)
+                        created_at = np.append(created_at, now)
+                        matrix = np.vstack([matrix, vector])
+                    self._matrices[key] = (ids, created_at, matrix)
+            self._generation = new_generation
+
+    def invalidate(self):
+        """Drop every cached answer, e.g. after documents were added."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+            self._generation = self._bump_generation(conn)
+            self._matrices.clear()
+
+    def set_corpus_version(self, version: str):
+        """Invalidate the cache if the indexed documents changed."""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'corpus_version'"
+            ).fetchone()
+            if row is not None and row[0] == version:
+                return
+            conn.execute("DELETE FROM entries")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('corpus_version', ?)",
+                (version,),
+            )
+            self._generation = self._bump_generation(conn)
+            self._matrices.clear()
+        if row is not None:
+            print("Document corpus changed, semantic cache cleared")
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            (entries,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+def replay_answer(answer: str):
+    """Yield a cached answer in word-sized chunks, like a model stream.
+
+    The chunks join back to exactly ``answer``, trailing whitespace included.
+    """
+    for chunk in re.findall(r"\s*\S+\s*\Z|\s*\S+|\s+\Z", answer):
+        yield chunk
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Return the process-wide semantic cache."""
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache()
+        return _semantic_cache
@@ -0,0 +1,86 @@
+import re
+from time import monotonic
+from typing import Iterable, Iterator
+
+from utils.constants import STREAM_FLUSH_CHARS, STREAM_FLUSH_INTERVAL
+
+# Text after the last whitespace may be half of a markdown token ("**bo",
+# "`fie", "[li") and is held back until the next flush
+_LAST_BREAK = re.compile(r".*\s", re.DOTALL)
+
+
+class AnswerBuffer:
+    """Collects a streamed answer and releases it in coalesced pieces.
+
+    Every token is kept in a list, so the full answer is joined once at the
+    end instead of growing a string per token. ``add`` returns the text to
+    flush, or "" to wait: the first token goes out at once, later ones once
+    ``interval`` seconds passed since the last flush or ``max_chars`` are
+    pending. Pieces end at whitespace, so markdown is not re-rendered with
+    half of an emphasis or code span. Flushes happen as tokens arrive; a
+    stalled stream keeps its pending text until the next token or ``flush``.
+    """
+
+    def __init__(
+        self,
+        interval: float = STREAM_FLUSH_INTERVAL,
+        max_chars: int = STREAM_FLUSH_CHARS,
+    ):
+        self.interval = interval
+        self.max_chars = max_chars
+        self.parts = []
+        self._pending = []
+        self._pending_chars = 0
+        self._flushed = False
+        self._last_flush = monotonic()
+
+    @property
+    def empty(self) -> bool:
+        return not self.parts
+
+    def add(self, text: str) -> str:
+        if not text:
+            return ""
+        self.parts.append(text)
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if (
+            self._flushed
+            and self._pending_chars < self.max_chars
+            and monotonic() - self._last_flush < self.interval
+        ):
+            return ""
+        pending = "".join(self._pending)
+        match = _LAST_BREAK.match(pending)
+        if match and self._pending_chars < self.max_chars:
+            # Keep the unfinished word for the next flush
+            end = match.end()
+        else:
+            end = len(pending)
+        rest = pending[end:]
+        self._pending = [rest] if rest else []
+        self._pending_chars = len(rest)
+        self._flushed = True
+        self._last_flush = monotonic()
+        return pending[:end]
+
+    def flush(self) -> str:
+        """The text not released yet, at the end of the stream."""
+        pending = "".join(self._pending)
+        self._pending, self._pending_chars = [], 0
+        return pending
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def coalesce(chunks: Iterable[str], **kwargs) -> Iterator[str]:
+    """Yield ``chunks`` in the coalesced pieces of an ``AnswerBuffer``."""
+    buffer = AnswerBuffer(**kwargs)
+    for chunk in chunks:
+        text = buffer.add(chunk)
+        if text:
+            yield text
+    rest = buffer.flush()
+    if rest:
+        yield rest
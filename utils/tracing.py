@@ -0,0 +1,352 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import uuid
+from bisect import bisect_left
+from time import perf_counter, time
+from typing import Dict, Optional, Tuple
+
+from utils.constants import TRACE_LEVEL, TRACE_PATH, TRACE_SAMPLE_RATE
+
+# Per-request spans and process-wide metrics for the answer path.
+#
+#     with tracer.trace("rag") as trace:
+#         with tracer.span("retrieval"):
+#             ...
+#         trace.mark("ttft")
+#
+# Every stage is timed into the ``crustdata_stage_seconds`` histogram; a
+# sample of requests also keeps its spans and is written as one JSON line.
+# Outside a trace, or with TRACE_LEVEL=off, spans are a shared no-op object.
+
+LEVELS = {"off": 0, "metrics": 1, "trace": 2, "debug": 3}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _reset(var: contextvars.ContextVar, token):
+    try:
+        var.reset(token)
+    except ValueError:
+        # A generator closed from another context (e.g. garbage collected
+        # after a client disconnect); that context is gone anyway
+        pass
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    """Counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._counters: Dict[Tuple, float] = {}
+        self._histograms: Dict[Tuple, list] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            bounds = self._buckets.setdefault(name, tuple(buckets))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (the last is +Inf), sum, count
+                histogram = self._histograms[key] = [[0] * (len(bounds) + 1), 0, 0]
+            histogram[0][bisect_left(bounds, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._histograms.items()
+            )
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            bounds = [f"{bound:g}" for bound in self._buckets[name]] + ["+Inf"]
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels + (("le", bound),))
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class _NullSpan:
+    """Stands in for spans and traces when nothing is recorded."""
+
+    sampled = False
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def mark(self, name: str):
+        pass
+
+    def add_tokens(self, kind: str, count: int):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("trace", "name", "attrs", "start", "_token")
+
+    def __init__(self, trace: "Trace", name: str, attrs: Dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        if self.trace.sampled:
+            self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _reset(_current_span, self._token)
+        self.trace.record(self.name, self.start, perf_counter(), self.attrs, exc)
+        return False
+
+
+class Trace:
+    """One request: its stage timings, and its spans when sampled."""
+
+    def __init__(self, tracer: "Tracer", name: str, sampled: bool, attrs: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.sampled = sampled
+        self.attrs = attrs
+        self.outcome = "ok"
+        self.spans = []
+        self.marks = {}
+
+    def set(self, **attrs):
+        if self.sampled:
+            self.attrs.update(attrs)
+
+    def record(self, stage: str, start: float, end: float, attrs=None, error=None):
+        """Time ``stage`` from ``start`` to ``end`` (``perf_counter`` values)."""
+        metrics.observe(
+            "crustdata_stage_seconds", end - start, trace=self.name, stage=stage
+        )
+        if self.sampled:
+            span = {
+                "name": stage,
+                "start_ms": round((start - self.start) * 1000, 2),
+                "duration_ms": round((end - start) * 1000, 2),
+            }
+            if attrs:
+                span.update(attrs)
+            if error is not None:
+                span["error"] = repr(error)
+            # list.append is atomic, spans may end on worker threads
+            self.spans.append(span)
+
+    def mark(self, name: str):
+        """Record a stage from the start of the request until now, e.g. TTFT."""
+        self.marks[name] = perf_counter()
+        self.record(name, self.start, self.marks[name])
+
+    def add_tokens(self, kind: str, count: int):
+        metrics.inc("crustdata_tokens_total", count, trace=self.name, kind=kind)
+        metrics.observe(
+            "crustdata_tokens", count, TOKEN_BUCKETS, trace=self.name, kind=kind
+        )
+        if self.sampled:
+            self.attrs[f"{kind}_tokens"] = self.attrs.get(f"{kind}_tokens", 0) + count
+
+    def __enter__(self):
+        self.start = perf_counter()
+        self.started_at = time()
+        self._tokens = (_current_trace.set(self), _current_span.set(None))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = perf_counter()
+        _reset(_current_span, self._tokens[1])
+        _reset(_current_trace, self._tokens[0])
+        if exc_type is GeneratorExit:
+            # The consumer stopped reading, e.g. a client disconnect
+            self.outcome = "cancelled"
+        elif exc_type is not None:
+            self.outcome = "error"
+        metrics.inc("crustdata_requests_total", trace=self.name, outcome=self.outcome)
+        metrics.observe("crustdata_request_seconds", end - self.start, trace=self.name)
+        if self.sampled:
+            record = {
+                "trace_id": uuid.uuid4().hex,
+                "name": self.name,
+                "timestamp": self.started_at,
+                "duration_ms": round((end - self.start) * 1000, 2),
+                "outcome": self.outcome,
+                **self.attrs,
+                "spans": self.spans,
+            }
+            if exc is not None and exc_type is not GeneratorExit:
+                record["error"] = repr(exc)
+            self.tracer.export(record)
+        return False
+
+
+class Tracer:
+    """Creates traces at the configured level and sample rate.
+
+    ``level`` is one of ``LEVELS``: "metrics" only aggregates stage timings,
+    "trace" also writes a ``sample_rate`` share of requests to ``path`` as
+    JSON lines, and "debug" lets callers attach queries and sources.
+    """
+
+    def __init__(
+        self,
+        level: str = "metrics",
+        sample_rate: float = 0.1,
+        path: Optional[str] = None,
+    ):
+        if level not in LEVELS:
+            raise ValueError(f"Unknown trace level {level!r}, use one of {LEVELS}")
+        self.level = LEVELS[level]
+        self.sample_rate = sample_rate
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def debug(self) -> bool:
+        return self.level >= LEVELS["debug"]
+
+    def trace(self, name: str, **attrs):
+        """Context manager for one request; yields a falsy no-op when off."""
+        if not self.level:
+            return _NULL_SPAN
+        sampled = (
+            self.level >= LEVELS["trace"]
+            and self.path is not None
+            and random.random() < self.sample_rate
+        )
+        return Trace(self, name, sampled, attrs if sampled else {})
+
+    def span(self, name: str, **attrs):
+        """Time a stage of the current request; a no-op outside of one."""
+        trace = _current_trace.get()
+        if trace is None:
+            return _NULL_SPAN
+        return Span(trace, name, attrs if trace.sampled else {})
+
+    def annotate(self, **attrs):
+        """Attach attributes to the innermost span of a sampled request."""
+        trace = _current_trace.get()
+        if trace is not None and trace.sampled:
+            (_current_span.get() or trace).attrs.update(attrs)
+
+    def add_tokens(self, kind: str, count: int):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_tokens(kind, count)
+
+    def error(self, stage: str, error: BaseException, **labels):
+        """Count a handled error and attach it to the current sampled span.
+
+        Counted in ``crustdata_errors_total`` inside or outside a request,
+        e.g. on background threads.
+        """
+        metrics.inc("crustdata_errors_total", stage=stage, **labels)
+        self.annotate(**{f"{stage}_error": repr(error)})
+
+    def export(self, record: Dict):
+        line = json.dumps(record, default=str) + "\n"
+        try:
+            with self._lock:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line)
+        except OSError as e:
+            print(f"Error writing trace to {self.path}: {e}")
+
+
+tracer = Tracer(TRACE_LEVEL, TRACE_SAMPLE_RATE, TRACE_PATH)
+
+
+_metrics_server_started = False
+_metrics_server_lock = threading.Lock()
+
+
+def serve_metrics_in_background(port: int):
+    """Serve ``metrics`` for Prometheus on ``port`` once per process."""
+    global _metrics_server_started
+    with _metrics_server_lock:
+        if _metrics_server_started or not port:
+            return
+        _metrics_server_started = True
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    except OSError as e:
+        print(f"Error serving metrics on port {port}: {e}")
+        return
+    threading.Thread(
+        target=server.serve_forever, daemon=True, name="metrics-server"
+    ).start()
+    print(f"Serving metrics on port {port}")